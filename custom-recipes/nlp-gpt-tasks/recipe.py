@@ -1,23 +1,46 @@
 # -*- coding: utf-8 -*-
 import json
+import logging
+import os
 from typing import Dict
 from typing import List
-from typing import Tuple
+from typing import Optional
 
+import numpy as np
 import pandas as pd
-from retry import retry
 
 import dataiku
 from dataiku.customrecipe import get_input_names_for_role
 from dataiku.customrecipe import get_output_names_for_role
 from dataiku.customrecipe import get_recipe_config
+from dataiku.customrecipe import get_recipe_resource
 
+from dkulib.dku_io_utils import process_dataset_chunks
 from dkulib.dku_io_utils import set_column_descriptions
+from dkulib.parallelizer import AdaptiveConcurrencyController
 from dkulib.parallelizer import DataFrameParallelizer
+from dkulib.parallelizer.parallelizer import ErrorHandling
+from dkulib.parallelizer.parallelizer import ExecutorType
 from gpt_api_client import API_EXCEPTIONS
+from gpt_api_client import DEFAULT_CONNECT_TIMEOUT
+from gpt_api_client import DEFAULT_READ_TIMEOUT
+from gpt_api_client import MAX_CHOICES_PER_REQUEST
+from gpt_api_client import OVERLOAD_EXCEPTIONS
 from gpt_api_client import GPTClient
 from gpt_api_formatting import GPTAPIFormatter
+from gpt_checkpoint import GPTCheckpoint
+from gpt_checkpoint import compute_hash
+from gpt_checkpoint import merge_saved_responses
+from gpt_incremental import PreviousGenerations
+from gpt_incremental import compute_input_hashes
+from gpt_metrics import GPTMetrics
+from gpt_prompt_template import PromptTemplate
+from gpt_rate_limiter import RateLimiter
+from gpt_retry_policy import RetryPolicy
+from gpt_response_cache import GPTResponseCache
+from gpt_tokenizer import load_tokenizer
 from plugin_io_utils import ErrorHandlingEnum
+from plugin_io_utils import generate_unique
 from plugin_io_utils import validate_column_input
 
 # ==============================================================================
@@ -48,6 +71,8 @@ task = recipe_config.get("task", "")
 output_desc = recipe_config.get("output_desc", "")
 temperature = recipe_config.get("temperature", 0.7)
 max_tokens = recipe_config.get("max_tokens", 64)
+# Prompts which do not fit in the context window with the tokens to output are rejected or truncated
+truncate_prompts = recipe_config.get("prompt_overflow", "reject") == "truncate"
 
 # Create a fitting name for the output column
 if output_desc:
@@ -57,15 +82,143 @@ else:
 
 # Params for parallelization
 column_prefix = "gpt"
+# Identical texts yield the same generation when sampling is deterministic
+deduplicate_texts = not output_only_mode and (
+    temperature == 0 or recipe_config.get("deduplicate_texts", False)
+)
+# Maximum number of distinct texts whose generation is kept in memory to be reused by later chunks
+dedup_max_entries = 100000
 parallel_workers = api_configuration_preset.get("parallel_workers")
+# Threads by default, or asyncio tasks sharing a pooled HTTP session for high concurrency
+executor_type = ExecutorType(api_configuration_preset.get("execution_engine", "thread"))
+max_thread_workers = 100
+batch_size = api_configuration_preset.get("batch_size", 1)
+# Maximum tokens of the prompts and outputs of a batch, 0 for batches of a fixed number of rows
+batch_token_budget = api_configuration_preset.get("batch_token_budget", 0)
+if output_only_mode:
+    # All output rows share the same prompt, so each batch of rows is generated by a single call
+    batch_size = MAX_CHOICES_PER_REQUEST
+    batch_token_budget = 0
+# Identical generations are replaced by new ones in output-only mode, in rounds of top-up calls
+deduplicate_outputs = output_only_mode and recipe_config.get("deduplicate_outputs", False)
+max_top_up_rounds = 10
+# Upper bound of the adaptive concurrency for presets saved without one, as in the preset defaults
+default_max_parallel_workers = 20
+concurrency_controller = None
+if api_configuration_preset.get("adaptive_concurrency", False):
+    max_parallel_workers = api_configuration_preset.get("max_parallel_workers") or max(
+        default_max_parallel_workers, parallel_workers
+    )
+    if parallel_workers > max_parallel_workers:
+        raise ValueError(
+            f"Concurrency ({parallel_workers}) cannot exceed the maximum concurrency "
+            + f"({max_parallel_workers}), please increase the maximum or decrease the concurrency"
+        )
+    concurrency_controller = AdaptiveConcurrencyController(
+        initial_concurrency=parallel_workers,
+        max_concurrency=max_parallel_workers,
+        overload_exceptions=OVERLOAD_EXCEPTIONS,
+    )
+max_concurrency = (
+    concurrency_controller.max_concurrency if concurrency_controller else parallel_workers
+)
+if executor_type == ExecutorType.THREAD and max_concurrency > max_thread_workers:
+    raise ValueError(
+        f"Concurrency is limited to {max_thread_workers} with threads, please use the asyncio engine"
+    )
 error_handling = (
     ErrorHandlingEnum.FAIL if get_recipe_config().get("fail_on_error") else ErrorHandlingEnum.LOG
 )
 
-# Create client
-client = GPTClient(api_configuration_preset.get("engine"), api_configuration_preset.get("api_key"))
-max_attempts = api_configuration_preset.get("max_attempts")
-wait_interval = api_configuration_preset.get("wait_interval")
+# Create response cache, persisted in the optional cache folder
+cache_folder_names = get_output_names_for_role("cache_folder")
+cache_folder_path = dataiku.Folder(cache_folder_names[0]).get_path() if cache_folder_names else None
+response_cache = None
+if recipe_config.get("cache_responses", False):
+    cache_ttl_days = recipe_config.get("cache_ttl_days", 30)
+    response_cache = GPTResponseCache(
+        cache_dir=cache_folder_path,
+        max_disk_entries=recipe_config.get("cache_max_entries", 100000),
+        ttl_seconds=cache_ttl_days * 24 * 3600 if cache_ttl_days else None,
+    )
+elif deduplicate_texts:
+    # Identical texts of different chunks are generated once, through an in-memory cache
+    response_cache = GPTResponseCache(max_memory_entries=dedup_max_entries)
+
+# Collect latency, retries, rate limit waits, tokens and throughput, summarized at the end of the run
+metrics = GPTMetrics()
+metrics_columns = recipe_config.get("metrics_columns", False)
+
+# Create rate limiter shared by all threads calling the API
+rate_limiter = RateLimiter(
+    requests_per_minute=api_configuration_preset.get("requests_per_minute"),
+    tokens_per_minute=api_configuration_preset.get("tokens_per_minute"),
+)
+
+# Load the vocabulary shipped with the plugin to count prompt tokens offline
+tokenizer = load_tokenizer(os.path.join(get_recipe_resource(), "gpt2_bpe"))
+
+# Create client, retrying transient errors with exponential backoff
+retry_policy = RetryPolicy(
+    max_attempts=api_configuration_preset.get("max_attempts"),
+    base_delay=api_configuration_preset.get("wait_interval"),
+    metrics=metrics,
+    # Reduce concurrency on the first rate limit or server error, rather than once retries are exhausted
+    on_retry=concurrency_controller.record_error if concurrency_controller else None,
+)
+client = GPTClient(
+    api_configuration_preset.get("engine"),
+    api_configuration_preset.get("api_key"),
+    cache=response_cache,
+    rate_limiter=rate_limiter,
+    retry_policy=retry_policy,
+    tokenizer=tokenizer,
+    truncate_prompts=truncate_prompts,
+    metrics=metrics,
+    # Keep one pooled connection per concurrent request
+    max_connections=max_concurrency,
+    connect_timeout=api_configuration_preset.get("connect_timeout", DEFAULT_CONNECT_TIMEOUT),
+    read_timeout=api_configuration_preset.get("read_timeout", DEFAULT_READ_TIMEOUT),
+    # Adapt concurrency to the latency of requests, excluding rate limiter waits and retries
+    on_response=concurrency_controller.record if concurrency_controller else None,
+)
+
+# Compile the task and examples once, only the text changes from one row to the next
+prompt_template = client.compile_prompt(task, input_desc, output_desc, examples)
+logging.info(
+    f"Prompt prefix of {prompt_template.num_prefix_tokens} token(s), "
+    + f"context window of {client.context_window} token(s)"
+)
+
+# Everything except the text which determines a generation, to detect configuration changes across runs
+prompt_config = {
+    "engine": client.engine,
+    "text_column": text_column,
+    "prompt": [prompt_template.prefix, prompt_template.input_label, prompt_template.suffix],
+    "temperature": temperature,
+    "max_tokens": max_tokens,
+    "truncate_prompts": truncate_prompts,
+}
+
+# Create checkpoint of responses in the cache folder, to resume the run if it fails
+checkpoint = None
+if recipe_config.get("checkpoint_runs", False) and not output_only_mode:
+    if cache_folder_path is None:
+        raise ValueError("Please add a cache and checkpoint folder to resume interrupted runs")
+    checkpoint = GPTCheckpoint(checkpoint_dir=cache_folder_path, prompt_config=prompt_config)
+
+# Number of input rows read, processed and written at a time
+chunksize = 1000
+# Chunks read ahead and written in the background, so that the API is called while reading and writing
+pipeline_depth = 2
+# Counting input records sizes the progress bar, but may require a full scan of the dataset
+count_input_records = recipe_config.get("count_input_records", True)
+# Partitions of the input dataset read concurrently, to avoid waiting on the reading of each one in turn
+parallel_partitions = recipe_config.get("parallel_partitions", 1)
+# Chunks read ahead for each of these partitions, so that up to parallel_partitions * 5 chunks are held in memory
+partition_prefetch_depth = 5
+# Summary of the metrics of the last run, saved in the cache folder if any
+metrics_file_name = "gpt_metrics.json"
 
 
 # ==============================================================================
@@ -83,47 +236,171 @@ else:
             "Cannot find input dataset. Use Output-only mode to generate without input dataset."
         )
     input_dataset = dataiku.Dataset(input_dataset_names[0])
-    validate_column_input(text_column, [col["name"] for col in input_dataset.read_schema()])
-    input_df = input_dataset.get_dataframe()
+    input_columns = [col["name"] for col in input_dataset.read_schema()]
+    validate_column_input(text_column, input_columns)
+    # Only the schema is needed upfront, rows are streamed by chunks at run time
+    input_df = pd.DataFrame(columns=input_columns)
 
-output_dataset = dataiku.Dataset(get_output_names_for_role("output_dataset")[0])
+output_dataset_name = get_output_names_for_role("output_dataset")[0]
+output_dataset = dataiku.Dataset(output_dataset_name)
+
+
+def get_text(row: Dict, text_column: str = "") -> str:
+    """
+    Returns the text of a row to generate from, which is empty in output-only mode.
+    """
+    return row[text_column] if text_column else ""
+
+
+def count_row_tokens(row: Dict) -> int:
+    """
+    Returns the number of tokens of the prompt of a row and of its output at most, to pack batches.
+    """
+    text = get_text(row, text_column)
+    return prompt_template.count_prompt_tokens(text if isinstance(text, str) else "") + max_tokens
 
 
-@retry((API_EXCEPTIONS), delay=wait_interval, tries=max_attempts)
 def call_gpt_api(
     row: Dict,
     text_column: str = "",
-    task: str = "",
-    input_desc: str = "",
-    output_desc: str = "",
-    examples: List[Tuple[str, str]] = [("", "")],
+    prompt_template: PromptTemplate = None,
     temperature: float = 0.7,
     max_tokens: int = 64,
 ) -> str:
     """
     Calls GPT Text Generation API.
     """
-    if text_column:
-        text = row[text_column]
-    else:
-        text = ""
+    text = get_text(row, text_column)
 
     # Recipe UI will show an error when selecting a non-string input column
     if not isinstance(text, str):
         return json.dumps({})
     else:
         response = client.generate(
-            task=task,
             text=text,
-            input_desc=input_desc,
-            output_desc=output_desc,
-            examples=examples,
             temperature=temperature,
             max_tokens=max_tokens,
+            prompt_template=prompt_template,
+        )
+        return response
+
+
+async def call_gpt_api_async(
+    row: Dict,
+    text_column: str = "",
+    prompt_template: PromptTemplate = None,
+    temperature: float = 0.7,
+    max_tokens: int = 64,
+) -> str:
+    """
+    Calls GPT Text Generation API asynchronously.
+    """
+    text = get_text(row, text_column)
+
+    # Recipe UI will show an error when selecting a non-string input column
+    if not isinstance(text, str):
+        return json.dumps({})
+    else:
+        response = await client.agenerate(
+            text=text,
+            temperature=temperature,
+            max_tokens=max_tokens,
+            prompt_template=prompt_template,
         )
         return response
 
 
+def call_gpt_api_batch(
+    batch: List[Dict],
+    text_column: str = "",
+    prompt_template: PromptTemplate = None,
+    temperature: float = 0.7,
+    max_tokens: int = 64,
+) -> List:
+    """
+    Calls GPT Text Generation API once for a batch of rows.
+    Rows whose prompt is too long get their error in place of a response, recorded by the parallelizer.
+    """
+    texts = [get_text(row, text_column) for row in batch]
+
+    # Recipe UI will show an error when selecting a non-string input column
+    responses = [json.dumps({})] * len(batch)
+    string_positions = [i for i, text in enumerate(texts) if isinstance(text, str)]
+    if string_positions:
+        generations = client.generate_batch(
+            texts=[texts[i] for i in string_positions],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            prompt_template=prompt_template,
+        )
+        for i, generation in zip(string_positions, generations):
+            responses[i] = generation
+    return responses
+
+
+def call_gpt_api_many(
+    batch: List[Dict],
+    text_column: str = "",
+    prompt_template: PromptTemplate = None,
+    temperature: float = 0.7,
+    max_tokens: int = 64,
+) -> List:
+    """
+    Calls GPT Text Generation API to sample one generation per row of a batch in output-only mode.
+    """
+    return client.generate_many(
+        temperature=temperature,
+        max_tokens=max_tokens,
+        prompt_template=prompt_template,
+        n=len(batch),
+    )
+
+
+async def call_gpt_api_many_async(
+    batch: List[Dict],
+    text_column: str = "",
+    prompt_template: PromptTemplate = None,
+    temperature: float = 0.7,
+    max_tokens: int = 64,
+) -> List:
+    """
+    Calls GPT Text Generation API asynchronously to sample one generation per row of a batch in output-only mode.
+    """
+    return await client.agenerate_many(
+        temperature=temperature,
+        max_tokens=max_tokens,
+        prompt_template=prompt_template,
+        n=len(batch),
+    )
+
+
+async def call_gpt_api_batch_async(
+    batch: List[Dict],
+    text_column: str = "",
+    prompt_template: PromptTemplate = None,
+    temperature: float = 0.7,
+    max_tokens: int = 64,
+) -> List:
+    """
+    Calls GPT Text Generation API asynchronously once for a batch of rows.
+    """
+    texts = [get_text(row, text_column) for row in batch]
+
+    # Recipe UI will show an error when selecting a non-string input column
+    responses = [json.dumps({})] * len(batch)
+    string_positions = [i for i, text in enumerate(texts) if isinstance(text, str)]
+    if string_positions:
+        generations = await client.agenerate_batch(
+            texts=[texts[i] for i in string_positions],
+            temperature=temperature,
+            max_tokens=max_tokens,
+            prompt_template=prompt_template,
+        )
+        for i, generation in zip(string_positions, generations):
+            responses[i] = generation
+    return responses
+
+
 formatter = GPTAPIFormatter(
     input_df=input_df,
     output_column=output_column_name,
@@ -133,31 +410,262 @@ formatter = GPTAPIFormatter(
     error_handling=error_handling,
 )
 
-# ==============================================================================
-# RUN
-# ==============================================================================
+# Load the generations of the previous run from the output dataset, to only generate new or changed rows
+previous_generations = None
+if recipe_config.get("incremental_mode", False) and not output_only_mode:
+    incremental_key_column = recipe_config.get("incremental_key_column") or None
+    if incremental_key_column:
+        validate_column_input(incremental_key_column, input_columns)
+    prompt_hash = compute_hash(prompt_config)
+    input_hash_column = generate_unique("input_hash", input_columns, column_prefix)
+    formatter.column_description_dict[
+        input_hash_column
+    ] = "Hash of the input text and prompt configuration, used by incremental mode"
+    previous_generations = PreviousGenerations(key_column=incremental_key_column)
+    previous_columns = [col["name"] for col in output_dataset.read_schema(raise_if_empty=False)]
+    required_columns = [input_hash_column, formatter.api_column_names.response]
+    if incremental_key_column:
+        required_columns.append(incremental_key_column)
+    if all(column in previous_columns for column in required_columns):
+        error_message_column = formatter.api_column_names.error_message
+        if error_message_column in previous_columns:
+            required_columns.append(error_message_column)
+        # Read before the output dataset is overwritten by this run
+        previous_generations.load(
+            dataiku.Dataset(output_dataset_name, ignore_flow=True).iter_dataframes(
+                chunksize=10 * chunksize, infer_with_pandas=False, columns=required_columns
+            ),
+            input_hash_column=input_hash_column,
+            response_column=formatter.api_column_names.response,
+            error_message_column=error_message_column,
+        )
+    else:
+        logging.info("No generations of a previous run in the output dataset, generating all rows")
+
+if output_only_mode:
+    api_function = (
+        call_gpt_api_many_async if executor_type == ExecutorType.ASYNCIO else call_gpt_api_many
+    )
+elif executor_type == ExecutorType.ASYNCIO:
+    api_function = call_gpt_api_batch_async if batch_size > 1 else call_gpt_api_async
+else:
+    api_function = call_gpt_api_batch if batch_size > 1 else call_gpt_api
 
 df_parallelizer = DataFrameParallelizer(
-    function=call_gpt_api,
-    error_handling=error_handling,
+    function=api_function,
+    # The parallelizer library has its own enum with the same values
+    error_handling=ErrorHandling(error_handling.value),
     exceptions_to_catch=API_EXCEPTIONS,
     parallel_workers=parallel_workers,
+    batch_support=output_only_mode or batch_size > 1,
+    batch_size=batch_size,
     output_column_prefix=column_prefix,
+    deduplicate_columns=[text_column] if deduplicate_texts else None,
+    # The API functions only read the text column, which is empty in output-only mode
+    input_columns=[text_column] if text_column else [],
+    concurrency_controller=concurrency_controller,
+    # Latencies are fed to the concurrency controller by the client, errors by the parallelizer
+    latency_feedback=False,
+    executor_type=executor_type,
+    # One pool of keep-alive connections as large as the number of concurrent calls, see shared_event_loop
+    async_context=client.async_session,
+    # Pack batches to a token budget rather than a number of rows, if specified
+    row_cost_function=count_row_tokens if batch_token_budget else None,
+    max_batch_cost=batch_token_budget or None,
+    metrics_collector=metrics,
+    record_latency=metrics_columns,
+    # Choice objects are read by the formatter directly, without a round-trip through strings
+    keep_raw_responses=True,
 )
 
-df = df_parallelizer.run(
-    input_df,
-    text_column=text_column,
-    task=task,
-    input_desc=input_desc,
-    output_desc=output_desc,
-    examples=examples,
-    temperature=temperature,
-    max_tokens=max_tokens,
-)
 
-output_df = formatter.format_df(df)
-output_dataset.write_with_schema(output_df)
+def run_parallelizer(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Calls the API on a chunk of rows.
+    """
+    return df_parallelizer.run(
+        df,
+        text_column=text_column,
+        prompt_template=prompt_template,
+        temperature=temperature,
+        max_tokens=max_tokens,
+    )
+
+
+def get_saved_responses(df: pd.DataFrame, input_hashes: Optional[List[str]]) -> List:
+    """
+    Returns the response of each row of a chunk carried forward from the previous run or restored
+    from the checkpoint, or None if the row needs to be generated.
+    Chunks of the input dataset keep a running index, which identifies rows in the checkpoint.
+    """
+    saved_responses = [None] * len(df.index)
+    if previous_generations is not None:
+        keys = df[incremental_key_column].tolist() if incremental_key_column else input_hashes
+        saved_responses = previous_generations.get_responses(keys, input_hashes)
+    if checkpoint is not None:
+        checkpoint_responses = checkpoint.get_responses(df.index, df[text_column].tolist())
+        saved_responses = [
+            saved_response if saved_response is not None else checkpoint_response
+            for (saved_response, checkpoint_response) in zip(saved_responses, checkpoint_responses)
+        ]
+    return saved_responses
+
+
+def run_parallelizer_with_saved_responses(df: pd.DataFrame, saved_responses: List) -> pd.DataFrame:
+    """
+    Calls the API on the rows of a chunk without a saved response, and saves the new successful responses
+    in the checkpoint if any. Rows with a saved response are restored at their position in the chunk.
+    """
+    is_missing = np.array([response is None for response in saved_responses], dtype=bool)
+    output_df = run_parallelizer(df if is_missing.all() else df[is_missing])
+
+    api_column_names = formatter.api_column_names
+    if checkpoint is not None:
+        error_messages = output_df.get(api_column_names.error_message, [""] * len(output_df.index))
+        is_success = np.array([not error_message for error_message in error_messages], dtype=bool)
+        checkpoint.save_responses(
+            row_numbers=output_df.index[is_success],
+            texts=output_df[text_column][is_success].tolist(),
+            responses=[
+                json.dumps(response) if isinstance(response, dict) else response
+                for response in output_df[api_column_names.response][is_success]
+            ],
+        )
+    return merge_saved_responses(df, output_df, saved_responses, api_column_names.response)
+
+
+# Name the per-row metric columns like the API columns of the parallelizer and formatter
+if metrics_columns:
+    metric_column_descriptions = {
+        "latency": "Duration of the API request in seconds, shared by the rows of a batch",
+        "prompt_tokens": "Number of tokens of the prompt",
+        "completion_tokens": "Number of tokens of the generation",
+    }
+    metric_column_names = {
+        name: generate_unique(name, input_df.columns, column_prefix)
+        for name in metric_column_descriptions
+    }
+    for (name, description) in metric_column_descriptions.items():
+        formatter.column_description_dict[metric_column_names[name]] = description
+
+
+def add_metric_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Adds the number of prompt and generation tokens of each successful row, next to its latency.
+    Rows restored from a checkpoint or a previous run have no latency.
+    """
+    texts = df[text_column] if text_column else [""] * len(df.index)
+    generations = df[formatter.generated_text_column_name]
+    is_success = [response != "" for response in df[formatter.api_column_names.response]]
+    # Truncated prompts are counted at the maximum length they were truncated to
+    max_prompt_tokens = client.context_window - max_tokens
+    df[metric_column_names["prompt_tokens"]] = [
+        min(prompt_template.count_prompt_tokens(text), max_prompt_tokens)
+        if success and isinstance(text, str)
+        else ""
+        for (text, success) in zip(texts, is_success)
+    ]
+    df[metric_column_names["completion_tokens"]] = [
+        tokenizer.count_tokens(generation) if success and isinstance(generation, str) else ""
+        for (generation, success) in zip(generations, is_success)
+    ]
+    metric_columns = list(metric_column_names.values())
+    return df[[column for column in df.columns if column not in metric_columns] + metric_columns]
+
+
+def generate_df(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Calls the API on a chunk of rows and formats the results.
+    """
+    input_hashes = None
+    if previous_generations is not None:
+        input_hashes = compute_input_hashes(df[text_column], prompt_hash)
+    df = run_parallelizer_with_saved_responses(df, get_saved_responses(df, input_hashes))
+    df = formatter.format_df(df)
+    if previous_generations is not None:
+        df[input_hash_column] = input_hashes
+    if metrics_columns:
+        df = add_metric_columns(df)
+    return df
+
+
+def find_duplicate_outputs(df: pd.DataFrame) -> pd.Series:
+    """
+    Returns whether the generation of each row came up in a previous row.
+    Failed rows have no generation, they are kept as is rather than generated again.
+    """
+    is_success = df[formatter.api_column_names.response] != ""
+    return is_success & df[output_column_name].duplicated()
+
+
+def generate_outputs_df(num_outputs: int) -> pd.DataFrame:
+    """
+    Generates the rows of output-only mode. If outputs are deduplicated, identical generations are
+    replaced by new ones, until all rows are distinct or a round brings no new generation.
+    """
+    df = generate_df(pd.DataFrame([""] * num_outputs, columns=[output_column_name]))
+    if not deduplicate_outputs:
+        return df
+    is_duplicate = find_duplicate_outputs(df)
+    for _ in range(max_top_up_rounds):
+        num_duplicates = is_duplicate.sum()
+        if num_duplicates == 0:
+            break
+        logging.info(f"Generating {num_duplicates} output(s) again to replace duplicates")
+        top_up_df = generate_df(pd.DataFrame([""] * num_duplicates, columns=[output_column_name]))
+        df = pd.concat([df[~is_duplicate], top_up_df], ignore_index=True)
+        is_duplicate = find_duplicate_outputs(df)
+        if is_duplicate.sum() == num_duplicates:
+            break
+    if is_duplicate.any():
+        logging.warning(f"Dropping {is_duplicate.sum()} duplicate output(s) without new generations")
+    return df[~is_duplicate].reset_index(drop=True)
+
+
+# ==============================================================================
+# RUN
+# ==============================================================================
+
+# Keep the event loop and HTTP connections of the asyncio engine open from one chunk to the next
+with df_parallelizer.shared_event_loop():
+    if output_only_mode:
+        output_dataset.write_with_schema(generate_outputs_df(recipe_config.get("num_outputs")))
+    else:
+        # Write the output schema from an empty chunk, so that no API call is made to probe it.
+        # Column types are refined with the first chunk of generations.
+        if not output_dataset.read_schema(raise_if_empty=False):
+            output_dataset.write_schema_from_dataframe(generate_df(input_df))
+        # Stream the input dataset so that only one chunk is held in memory at a time
+        process_dataset_chunks(
+            input_dataset=input_dataset,
+            output_dataset=output_dataset,
+            func=generate_df,
+            chunksize=chunksize,
+            pipeline_depth=pipeline_depth,
+            count_input_records=count_input_records,
+            parallel_partitions=parallel_partitions,
+            partition_prefetch_depth=partition_prefetch_depth,
+        )
+
+if response_cache is not None:
+    logging.info(f"Response cache: {response_cache.hits} hit(s), {response_cache.misses} miss(es)")
+    response_cache.close()
+
+client.close()
+
+if previous_generations is not None:
+    logging.info(f"Reused {previous_generations.num_reused} generation(s) of the previous run")
+
+if checkpoint is not None:
+    logging.info(f"Restored {checkpoint.num_restored} response(s) from checkpoint")
+    # The run has succeeded, so the next one starts from scratch
+    checkpoint.clear()
+    checkpoint.close()
+
+logging.info(f"Run metrics: {metrics.to_json()}")
+if cache_folder_path is not None:
+    with open(os.path.join(cache_folder_path, metrics_file_name), "w") as metrics_file:
+        metrics_file.write(metrics.to_json())
 
 set_column_descriptions(
     input_dataset=input_dataset,
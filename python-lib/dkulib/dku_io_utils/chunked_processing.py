@@ -3,18 +3,72 @@
 
 import logging
 import math
+import queue
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from time import perf_counter
+from time import time
+from typing import Any
 from typing import Callable
+from typing import Generator
+from typing import Iterable
+from typing import List
+from typing import Optional
 
+import pandas as pd
 from tqdm.auto import tqdm as tqdm_auto
 import dataiku
 
 
-def count_records(dataset: dataiku.Dataset) -> int:
+def _get_fresh_metric_value(
+    metrics: dataiku.ComputedMetrics,
+    metric_id: str,
+    max_age_seconds: float,
+    partition: Optional[str] = None,
+) -> Optional[int]:
+    """Returns the last value of a metric if it was computed recently, for a given partition if specified
+
+    Args:
+        metrics: Last metric values of a dataset, as returned by `dataiku.Dataset.get_last_metric_values`
+        metric_id: Identifier of the metric, e.g. "records:COUNT_RECORDS"
+        max_age_seconds: Maximum number of seconds since the metric was computed
+        partition: Partition identifier, or None for a dataset which is not partitioned
+
+    Returns:
+        Value of the metric, or None if it was never computed or is older than `max_age_seconds`
+
+    """
+    try:
+        last_values = metrics.get_metric_by_id(metric_id).get("lastValues", [])
+    except Exception:
+        return None
+    if partition is not None:
+        last_values = [v for v in last_values if v.get("partition") == partition]
+    if not last_values:
+        return None
+    last_value = max(last_values, key=lambda v: v.get("computed", 0))
+    # Timestamps of metrics are in milliseconds
+    if time() - last_value.get("computed", 0) / 1000 > max_age_seconds:
+        return None
+    return int(last_value["value"])
+
+
+def count_records(
+    dataset: dataiku.Dataset,
+    max_metric_age_seconds: float = 3600,
+    max_workers: int = 4,
+) -> int:
     """Counts the number of records of a dataset using the Dataiku dataset metrics API
 
+    Record counts computed less than `max_metric_age_seconds` ago are reused.
+    Other partitions are counted concurrently, so that a scan of each partition is not waited for in turn.
+    A reused count of 0 is always computed again, as an empty dataset fails processing.
+
     Args:
         dataset: dataiku.Dataset instance
+        max_metric_age_seconds: Maximum age of a record count to reuse it, 0 to always compute counts
+        max_workers: Maximum number of partitions counted at the same time
 
     Returns:
         Number of records
@@ -24,43 +78,318 @@ def count_records(dataset: dataiku.Dataset) -> int:
     partitions = dataset.read_partitions
     client = dataiku.api_client()
     project = client.get_project(dataset.project_key)
-    record_count = 0
     logging.info(f"Counting records of dataset: {dataset.name}...")
+    last_metrics = dataset.get_last_metric_values()
     if partitions is None or len(partitions) == 0:
-        project.get_dataset(dataset.short_name).compute_metrics(metric_ids=[metric_id])
-        metric = dataset.get_last_metric_values()
-        record_count = dataiku.ComputedMetrics.get_value_from_data(
-            metric.get_global_data(metric_id=metric_id)
+        record_count = _get_fresh_metric_value(
+            last_metrics, metric_id, max_metric_age_seconds
         )
+        if not record_count:
+            project.get_dataset(dataset.short_name).compute_metrics(
+                metric_ids=[metric_id]
+            )
+            metric = dataset.get_last_metric_values()
+            record_count = dataiku.ComputedMetrics.get_value_from_data(
+                metric.get_global_data(metric_id=metric_id)
+            )
         logging.info(
             f"Dataset {dataset.name} contains {record_count:d} records and is not partitioned"
         )
     else:
-        for partition in partitions:
-            project.get_dataset(dataset.short_name).compute_metrics(
-                partition=partition, metric_ids=[metric_id]
+        partition_counts = {
+            partition: _get_fresh_metric_value(
+                last_metrics, metric_id, max_metric_age_seconds, partition
             )
+            for partition in partitions
+        }
+        partitions_to_count = [
+            p for (p, count) in partition_counts.items() if not count
+        ]
+        if partitions_to_count:
+            with ThreadPoolExecutor(max_workers=max_workers) as pool:
+                futures = [
+                    pool.submit(
+                        project.get_dataset(dataset.short_name).compute_metrics,
+                        partition=partition,
+                        metric_ids=[metric_id],
+                    )
+                    for partition in partitions_to_count
+                ]
+                for future in futures:
+                    future.result()
             metric = dataset.get_last_metric_values()
-            record_count += dataiku.ComputedMetrics.get_value_from_data(
-                metric.get_partition_data(partition=partition, metric_id=metric_id)
-            )
+            for partition in partitions_to_count:
+                partition_counts[partition] = (
+                    dataiku.ComputedMetrics.get_value_from_data(
+                        metric.get_partition_data(
+                            partition=partition, metric_id=metric_id
+                        )
+                    )
+                )
+        record_count = sum(partition_counts.values())
         logging.info(
-            f"Dataset {dataset.name} contains {record_count:d} records in partition(s) {partitions}"
+            f"Dataset {dataset.name} contains {record_count:d} records in partition(s) {partitions}, "
+            + f"{len(partitions) - len(partitions_to_count)} reused from existing metrics"
         )
     return record_count
 
 
+def _get_last_record_count(dataset: dataiku.Dataset) -> Optional[int]:
+    """Returns the last record count computed on a dataset without computing it, as an estimate
+
+    Args:
+        dataset: dataiku.Dataset instance
+
+    Returns:
+        Number of records when the count was last computed, summed over partitions,
+        or None if it is missing for the dataset or any of its partitions
+
+    """
+    metric_id = "records:COUNT_RECORDS"
+    last_metrics = dataset.get_last_metric_values()
+    partitions = dataset.read_partitions
+    if partitions is None or len(partitions) == 0:
+        return _get_fresh_metric_value(
+            last_metrics, metric_id, max_age_seconds=math.inf
+        )
+    partition_counts = [
+        _get_fresh_metric_value(last_metrics, metric_id, math.inf, partition)
+        for partition in partitions
+    ]
+    if any(count is None for count in partition_counts):
+        return None
+    return sum(partition_counts)
+
+
+def _close_iterator(iterator: Iterable) -> None:
+    """Closes an iterator which has a `close` method, like generators, so that it releases its resources"""
+    close = getattr(iterator, "close", None)
+    if close is not None:
+        close()
+
+
+_END_OF_QUEUE = object()
+# Seconds between checks of whether the consumer of a queue has stopped, when the queue is full
+_QUEUE_POLL_INTERVAL = 0.1
+
+
+class _Prefetcher:
+    """Iterator over an iterable read in a background thread, keeping up to `max_prefetched` items ahead
+
+    Reading starts as soon as the prefetcher is created, and stops once it is closed,
+    even if the iterable is not exhausted. The iterable is then closed by the background thread,
+    if it has a `close` method like generators. Errors raised while reading the iterable are raised
+    by the iterator when their item would have been reached.
+
+    Attributes:
+        max_prefetched: Maximum number of items read ahead of the consumer
+        read_seconds: Duration of the reading of the whole iterable, None until it is exhausted
+
+    """
+
+    def __init__(self, iterable: Iterable, max_prefetched: int):
+        self.max_prefetched = max_prefetched
+        self.read_seconds = None
+        self._queue = queue.Queue(maxsize=max_prefetched)
+        self._stopped = threading.Event()
+        self._exhausted = False
+        self._thread = threading.Thread(
+            target=self._read, args=(iterable,), daemon=True
+        )
+        self._thread.start()
+
+    def _put(self, item: Any) -> bool:
+        while not self._stopped.is_set():
+            try:
+                self._queue.put(item, timeout=_QUEUE_POLL_INTERVAL)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _read(self, iterable: Iterable) -> None:
+        start = perf_counter()
+        try:
+            for item in iterable:
+                if not self._put((item, None)):
+                    return
+        except Exception as error:
+            self._put((None, error))
+            return
+        finally:
+            _close_iterator(iterable)
+        self.read_seconds = perf_counter() - start
+        self._put((_END_OF_QUEUE, None))
+
+    def __iter__(self) -> "_Prefetcher":
+        return self
+
+    def __next__(self) -> Any:
+        if self._exhausted:
+            raise StopIteration
+        (item, error) = self._queue.get()
+        if error is not None:
+            self._exhausted = True
+            raise error
+        if item is _END_OF_QUEUE:
+            self._exhausted = True
+            raise StopIteration
+        return item
+
+    def close(self) -> None:
+        """Stops reading and waits for the background thread to finish its current read"""
+        self._stopped.set()
+        self._thread.join()
+
+
+class _BackgroundWriter:
+    """Writes dataframes to a dataset writer from a single background thread, in the order they were queued
+
+    Errors of the writer are raised by the next call to `write_dataframe` or by `close`.
+
+    Attributes:
+        writer: Dataset writer, only used by the background thread until `close` returns
+        max_queued: Maximum number of dataframes waiting to be written, before `write_dataframe` blocks
+
+    """
+
+    def __init__(
+        self, writer: "dataiku.core.dataset_write.DatasetWriter", max_queued: int
+    ):
+        self.writer = writer
+        self.max_queued = max_queued
+        self._queue = queue.Queue(maxsize=max_queued)
+        self._error = None
+        self._thread = threading.Thread(target=self._write, daemon=True)
+        self._thread.start()
+
+    def _write(self) -> None:
+        while True:
+            df = self._queue.get()
+            if df is _END_OF_QUEUE:
+                return
+            # After an error, dataframes are discarded so that the queue never stays full
+            if self._error is None:
+                try:
+                    self.writer.write_dataframe(df)
+                except Exception as error:
+                    self._error = error
+
+    def write_dataframe(self, df: pd.DataFrame) -> None:
+        if self._error is not None:
+            raise self._error
+        self._queue.put(df)
+
+    def close(self) -> None:
+        """Waits for all queued dataframes to be written"""
+        self._queue.put(_END_OF_QUEUE)
+        self._thread.join()
+        if self._error is not None:
+            raise self._error
+
+
+def _with_running_index(df: pd.DataFrame, start: int) -> pd.DataFrame:
+    df = df.reset_index(drop=True)
+    df.index = pd.RangeIndex(start, start + len(df.index))
+    return df
+
+
+def _iter_partitions_in_parallel(
+    dataset: dataiku.Dataset,
+    partitions: List[str],
+    chunksize: int,
+    max_parallel_partitions: int,
+    max_prefetched: int,
+) -> Generator:
+    """Reads the partitions of a dataset concurrently, and yields chunks like a single stream of all partitions
+
+    Up to `max_parallel_partitions` partitions are read at a time, each in a background thread.
+    Chunks are yielded in the order of the partitions, regrouped in chunks of `chunksize` rows across
+    partitions and with a running index, so that they do not depend on how partitions were read.
+    Only reading is concurrent: the next partitions are read ahead while the chunks of the first one
+    are consumed, up to `max_prefetched` chunks each, so that at most
+    `max_parallel_partitions * max_prefetched` chunks are held in memory.
+
+    Args:
+        dataset: Input dataiku.Dataset instance
+        partitions: Identifiers of the partitions to read, in order
+        chunksize: Number of rows of each chunk
+        max_parallel_partitions: Maximum number of partitions read at the same time
+        max_prefetched: Maximum number of chunks read ahead of the consumer for each partition
+
+    Yields:
+        Chunks of the dataset as pandas.DataFrame
+
+    """
+    partitions_to_read = iter(partitions)
+    readers = deque()
+
+    def read_next_partition() -> None:
+        partition = next(partitions_to_read, None)
+        if partition is not None:
+            partition_dataset = dataiku.Dataset(dataset.name, ignore_flow=True)
+            partition_dataset.add_read_partitions(partition)
+            df_iterator = partition_dataset.iter_dataframes(
+                chunksize=chunksize, infer_with_pandas=False
+            )
+            readers.append((partition, _Prefetcher(df_iterator, max_prefetched)))
+
+    for _ in range(max_parallel_partitions):
+        read_next_partition()
+    buffer = []
+    num_buffered_rows = 0
+    num_rows = 0
+    try:
+        for i in range(len(partitions)):
+            (partition, reader) = readers[0]
+            num_partition_rows = 0
+            for df in reader:
+                num_partition_rows += len(df.index)
+                buffer.append(df)
+                num_buffered_rows += len(df.index)
+                while num_buffered_rows >= chunksize:
+                    buffer_df = pd.concat(buffer) if len(buffer) > 1 else buffer[0]
+                    buffer = [buffer_df.iloc[chunksize:]]
+                    num_buffered_rows -= chunksize
+                    yield _with_running_index(buffer_df.iloc[:chunksize], num_rows)
+                    num_rows += chunksize
+            readers.popleft()
+            read_next_partition()
+            logging.info(
+                f"Read partition {partition} of dataset {dataset.name} ({i + 1}/{len(partitions)}): "
+                + f"{num_partition_rows} rows in {reader.read_seconds:.2f} seconds"
+            )
+        if num_buffered_rows > 0:
+            yield _with_running_index(pd.concat(buffer), num_rows)
+    finally:
+        for (_, reader) in readers:
+            reader.close()
+
+
 def process_dataset_chunks(
     input_dataset: dataiku.Dataset,
     output_dataset: dataiku.Dataset,
     func: Callable,
     chunksize: float = 1000,
+    pipeline_depth: int = 0,
+    count_input_records: bool = True,
+    parallel_partitions: int = 1,
+    partition_prefetch_depth: int = 2,
     **kwargs,
 ) -> None:
     """Reads a dataset by chunks, process each dataframe chunk with a function and write back to another dataset.
 
     Pass keyword arguments to the function, adds a tqdm progress bar and generic logging.
     Directly write chunks to the output_dataset, so that only one chunk needs to be processed in-memory at a time.
+    With a `pipeline_depth`, the next chunks are read and the previous ones written in background threads
+    while a chunk is processed, so that reads and writes overlap with `func`. Chunks are still processed
+    by `func` in the calling thread and written in order by a single writer.
+    Without `count_input_records`, processing starts right away and the progress bar is sized
+    by the last record count computed on the input dataset, however old, or left open-ended if there is none.
+    If the input dataset reads several partitions, up to `parallel_partitions` of them can be read concurrently.
+    They are still processed in order, by chunks of `chunksize` rows, as if they were read one after the other:
+    only reads overlap, processing is not spread across partitions. To parallelize processing, `func` should
+    spread each chunk over its own workers, e.g. with a `DataFrameParallelizer`.
 
     Args:
         input_dataset: Input dataiku.Dataset instance
@@ -69,19 +398,40 @@ def process_dataset_chunks(
             This function must take a pandas.DataFrame as first input argument,
             and output another pandas.DataFrame
         chunksize: Number of rows of each chunk of pandas.DataFrame fed to `func`
+        pipeline_depth: Maximum number of chunks read ahead, and of processed chunks waiting to be written.
+            0 (default) to read, process and write each chunk in turn, in the calling thread
+        count_input_records: If True (default), count the records of the input dataset before processing.
+            Set to False for datasets where counting requires a costly full scan
+        parallel_partitions: Maximum number of input partitions read at the same time, 1 (default)
+            to read all partitions in a single stream
+        partition_prefetch_depth: Maximum number of chunks read ahead for each partition read at the same time,
+            independently of `pipeline_depth`. Partitions read concurrently only make progress while
+            they have room for this many chunks
         **kwargs: Optional keyword arguments fed to `func`
 
     Raises:
         ValueError: If the input dataset is empty or if pandas cannot read it without type inference
 
     """
-    input_count_records = count_records(input_dataset)
-    if input_count_records == 0:
-        raise ValueError("Input dataset has no records")
-    logging.info(
-        f"Processing dataset {input_dataset.name} of {input_count_records} rows "
-        + f"by chunks of {chunksize}..."
-    )
+    if count_input_records:
+        input_count_records = count_records(input_dataset)
+        if input_count_records == 0:
+            raise ValueError("Input dataset has no records")
+        logging.info(
+            f"Processing dataset {input_dataset.name} of {input_count_records} rows "
+            + f"by chunks of {chunksize}..."
+        )
+    else:
+        input_count_records = _get_last_record_count(input_dataset)
+        logging.info(
+            f"Processing dataset {input_dataset.name} of "
+            + (
+                f"about {input_count_records}"
+                if input_count_records
+                else "an unknown number of"
+            )
+            + f" rows by chunks of {chunksize}..."
+        )
     start = perf_counter()
     # First, initialize output schema if empty. Required to show the real error if `iter_dataframes` fails.
     if not output_dataset.read_schema(raise_if_empty=False):
@@ -89,24 +439,67 @@ def process_dataset_chunks(
         output_df = func(df=df, **kwargs)
         output_dataset.write_schema_from_dataframe(output_df)
     with output_dataset.get_writer() as writer:
-        df_iterator = input_dataset.iter_dataframes(
-            chunksize=chunksize, infer_with_pandas=False
-        )
-        len_iterator = math.ceil(input_count_records / chunksize)
-        for i, df in tqdm_auto(
-            enumerate(df_iterator),
-            total=len_iterator,
-            unit="chunk",
+        partitions = input_dataset.read_partitions or []
+        if parallel_partitions > 1 and len(partitions) > 1:
+            logging.info(
+                f"Reading {len(partitions)} partitions of dataset {input_dataset.name}, "
+                + f"up to {parallel_partitions} at a time with up to {partition_prefetch_depth} "
+                + "chunks read ahead each..."
+            )
+            df_iterator = _iter_partitions_in_parallel(
+                input_dataset,
+                partitions,
+                chunksize,
+                max_parallel_partitions=parallel_partitions,
+                max_prefetched=partition_prefetch_depth,
+            )
+        else:
+            df_iterator = input_dataset.iter_dataframes(
+                chunksize=chunksize, infer_with_pandas=False
+            )
+            if pipeline_depth > 0:
+                df_iterator = _Prefetcher(df_iterator, max_prefetched=pipeline_depth)
+        chunk_writer = writer
+        if pipeline_depth > 0:
+            chunk_writer = _BackgroundWriter(writer, max_queued=pipeline_depth)
+        # Progress in rows, so that the throughput and remaining time do not depend on the chunk size
+        progress_bar = tqdm_auto(
+            total=input_count_records,
+            unit="row",
+            unit_scale=True,
             miniters=1,
             mininterval=1.0,
-        ):
-            output_df = func(df=df, **kwargs)
-            if i == 0:
-                output_dataset.write_schema_from_dataframe(
-                    output_df, dropAndCreate=bool(not output_dataset.writePartition)
-                )
-            writer.write_dataframe(output_df)
+        )
+        num_rows = 0
+        completed = False
+        try:
+            for i, df in enumerate(df_iterator):
+                output_df = func(df=df, **kwargs)
+                if i == 0:
+                    # Before the first chunk is queued, so that the schema is not written concurrently
+                    output_dataset.write_schema_from_dataframe(
+                        output_df, dropAndCreate=bool(not output_dataset.writePartition)
+                    )
+                chunk_writer.write_dataframe(output_df)
+                num_rows += len(df.index)
+                progress_bar.update(len(df.index))
+            completed = True
+        finally:
+            progress_bar.close()
+            # Stops background reads, or the dataset stream if it was not read until the end
+            _close_iterator(df_iterator)
+            if pipeline_depth > 0:
+                if completed:
+                    chunk_writer.close()
+                else:
+                    # Do not mask the exception already propagating with an error of the writer
+                    try:
+                        chunk_writer.close()
+                    except Exception:
+                        logging.exception("Error while closing the background writer")
+    if num_rows == 0:
+        raise ValueError("Input dataset has no records")
     logging.info(
-        f"Processing dataset {input_dataset.name} of {input_count_records} rows: "
+        f"Processing dataset {input_dataset.name} of {num_rows} rows: "
         + f"Done in {perf_counter() - start:.2f} seconds."
     )
@@ -8,3 +8,4 @@
 #########################################################
 
 from .parallelizer import DataFrameParallelizer
+from .concurrency import AdaptiveConcurrencyController
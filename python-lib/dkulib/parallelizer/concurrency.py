@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""Adapts the number of concurrent function calls to the observed latency and errors"""
+
+import math
+import threading
+from typing import Optional
+from typing import Tuple
+
+
+class AdaptiveConcurrencyController:
+    """Additive-increase/multiplicative-decrease (AIMD) controller of the number of concurrent calls.
+
+    The concurrency limit grows by about one call per round trip while calls succeed with a healthy latency,
+    and is multiplied by `backoff_ratio` when a call fails with an overload error (rate limit, server error)
+    or when the smoothed latency exceeds `latency_tolerance` times its best recent value.
+    After a decrease, the calls already in flight are not taken into account, to avoid collapsing the limit
+    on a single burst of errors.
+
+    Attributes:
+        initial_concurrency: Concurrency limit to start from
+        min_concurrency: Lower bound of the concurrency limit. Default is 1.
+        max_concurrency: Upper bound of the concurrency limit, i.e., the number of worker threads
+        overload_exceptions: Tuple of Exception classes which signal that the called service is overloaded
+        backoff_ratio: Multiplicative factor applied to the limit on overload. Default is 0.5.
+        latency_tolerance: Ratio of the smoothed latency to its best value above which calls are considered
+            overloaded. Default is 2.0. If None, only errors are taken into account.
+    """
+
+    # Default ratio applied to the concurrency limit when the service is overloaded
+    DEFAULT_BACKOFF_RATIO = 0.5
+    # Default ratio of the smoothed latency to its best value above which the service is considered overloaded
+    DEFAULT_LATENCY_TOLERANCE = 2.0
+    # Weight of the last call in the exponentially weighted moving average of latency
+    LATENCY_SMOOTHING = 0.1
+    # Relative increase of the best latency per call, so that it follows lasting changes of the service
+    BEST_LATENCY_DRIFT = 0.001
+
+    def __init__(
+        self,
+        initial_concurrency: int,
+        max_concurrency: int,
+        min_concurrency: int = 1,
+        overload_exceptions: Tuple[Exception] = (),
+        backoff_ratio: float = DEFAULT_BACKOFF_RATIO,
+        latency_tolerance: Optional[float] = DEFAULT_LATENCY_TOLERANCE,
+    ):
+        if not 1 <= min_concurrency <= initial_concurrency <= max_concurrency:
+            raise ValueError(
+                "Concurrency bounds must verify 1 <= min <= initial <= max, "
+                + f"got {min_concurrency}, {initial_concurrency}, {max_concurrency}"
+            )
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.overload_exceptions = overload_exceptions
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self._limit = float(initial_concurrency)
+        self._latency_ewma = None
+        self._best_latency_ewma = math.inf
+        self._calls_to_skip = 0
+        self._lock = threading.Lock()
+
+    @property
+    def limit(self) -> int:
+        """Current number of calls allowed to run concurrently"""
+        return int(self._limit)
+
+    def _is_overloaded(self, latency: float, error: Optional[Exception]) -> bool:
+        if error is not None:
+            return isinstance(error, self.overload_exceptions)
+        if self._latency_ewma is None:
+            self._latency_ewma = latency
+        else:
+            self._latency_ewma += self.LATENCY_SMOOTHING * (
+                latency - self._latency_ewma
+            )
+        self._best_latency_ewma = min(
+            self._best_latency_ewma * (1 + self.BEST_LATENCY_DRIFT), self._latency_ewma
+        )
+        return (
+            self.latency_tolerance is not None
+            and self._latency_ewma > self.latency_tolerance * self._best_latency_ewma
+        )
+
+    def record(self, latency: float, error: Optional[Exception] = None) -> None:
+        """Updates the concurrency limit after a call has completed
+
+        Args:
+            latency: Duration of the call in seconds
+            error: Exception raised by the call if any
+
+        """
+        with self._lock:
+            overloaded = self._is_overloaded(latency, error)
+            if self._calls_to_skip > 0:
+                self._calls_to_skip -= 1
+            elif overloaded:
+                self._calls_to_skip = self.limit
+                self._limit = max(
+                    self.min_concurrency, self._limit * self.backoff_ratio
+                )
+            elif error is None:
+                self._limit = min(self.max_concurrency, self._limit + 1 / self._limit)
+
+    def record_error(self, error: Exception) -> None:
+        """Updates the concurrency limit after a failed attempt which is retried within the same call
+
+        This lets the limit decrease on the first overload error, rather than once the call
+        has exhausted its retries. The latency of the attempt is not taken into account.
+
+        Args:
+            error: Exception raised by the attempt
+
+        """
+        self.record(latency=0.0, error=error)
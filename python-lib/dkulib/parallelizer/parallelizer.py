@@ -1,32 +1,42 @@
 # -*- coding: utf-8 -*-
 """Applies a function to a pandas DataFrame with parallelization, error logging and progress tracking"""
 
+import asyncio
 import logging
 import inspect
 import math
+import pickle
 
 from collections import namedtuple
 from collections import OrderedDict
+from contextlib import contextmanager
 from concurrent.futures import as_completed
+from concurrent.futures import wait
+from concurrent.futures import FIRST_COMPLETED
+from concurrent.futures import ProcessPoolExecutor
 from concurrent.futures import ThreadPoolExecutor
-from copy import deepcopy
 from enum import Enum
 from time import perf_counter
 from typing import Any
 from typing import AnyStr
+from typing import AsyncContextManager
 from typing import Callable
 from typing import Dict
+from typing import Iterator
 from typing import List
 from typing import NamedTuple
+from typing import Optional
 from typing import Tuple
 from typing import Union
 
 from more_itertools import chunked
 from more_itertools import flatten
+import numpy as np
 import pandas as pd
 from tqdm.auto import tqdm as tqdm_auto
 
 from ..io_utils.plugin_io_utils import generate_unique
+from .concurrency import AdaptiveConcurrencyController
 
 
 class ErrorHandling(Enum):
@@ -36,15 +46,38 @@ class ErrorHandling(Enum):
     FAIL = "Fail"
 
 
+class ExecutorType(Enum):
+    """Enum class to identify how to run concurrent function calls"""
+
+    THREAD = "thread"
+    ASYNCIO = "asyncio"
+    PROCESS = "process"
+    HYBRID = "hybrid"
+
+
 class BatchError(ValueError):
     """Custom exception raised if the Batch function fails"""
 
 
+def _get_error_columns(error: Exception, output_column_names: NamedTuple) -> Dict:
+    """Returns the error message, type and raw details of an error, keyed by their output column names"""
+    error_type = str(type(error).__qualname__)
+    module = inspect.getmodule(error)
+    if module:
+        error_type = f"{module.__name__}.{error_type}"
+    return {
+        output_column_names.error_message: str(error),
+        output_column_names.error_type: error_type,
+        output_column_names.error_raw: str(error.args),
+    }
+
+
 def _parse_batch_response_default(
     batch: List[Dict], response: List[Any], output_column_names: NamedTuple
 ) -> List[Dict]:
-    """Adds responses to each row dictionary in the batch, assuming the batch response is a list of responses
-    in the same order as the batch, while keeping the existing row dictionary entries in the batch.
+    """Assigns responses to each row of the batch, assuming the batch response is a list of responses
+    in the same order as the batch. Input rows are not copied: only the output columns are returned.
+    A response which is an exception is assigned as the error of its row, with an empty response.
 
     Args:
         batch: Single input row from the dataframe as a dict in a list of length 1
@@ -53,19 +86,74 @@ def _parse_batch_response_default(
             as defined in _get_unique_output_column_names
 
     Returns:
-        batch: Same as input batch with additional columns
-            corresponding to the default output columns
+        List of dictionaries with the default output columns, one per row of the input batch
     """
-    return [
-        {
-            output_column_names.response: response,
-            output_column_names.error_message: "",
-            output_column_names.error_type: "",
-            output_column_names.error_raw: "",
-            **row,
-        }
-        for response, row in zip(response, batch)
-    ]
+    output = []
+    for response, _ in zip(response, batch):
+        if isinstance(response, Exception):
+            output_row = {
+                output_column_names.response: "",
+                **_get_error_columns(response, output_column_names),
+            }
+        else:
+            output_row = {
+                output_column_names.response: response,
+                output_column_names.error_message: "",
+                output_column_names.error_type: "",
+                output_column_names.error_raw: "",
+            }
+        output.append(output_row)
+    return output
+
+
+class _CompletionRecorder:
+    """Records the completion of batches in a worker process, to be replayed in the parent process"""
+
+    def __init__(self):
+        self.completions = []
+
+    def record_batch(
+        self, num_rows: int, latency: float, error: Optional[Exception] = None
+    ) -> None:
+        self.completions.append((num_rows, latency, _make_picklable(error)))
+
+
+def _make_picklable(error: Optional[Exception]) -> Optional[Exception]:
+    """Returns the error if it can be sent back to the parent process, else a RuntimeError with its message"""
+    if error is None:
+        return None
+    try:
+        pickle.loads(pickle.dumps(error))
+        return error
+    except Exception:
+        return RuntimeError(f"{type(error).__qualname__}: {error}")
+
+
+def _apply_function_in_worker_process(
+    parallelizer: "DataFrameParallelizer",
+    batches: List[List[Dict]],
+    function_kwargs: Dict,
+) -> Tuple[List[List[Dict]], List[Tuple[int, float, Optional[Exception]]]]:
+    """Applies the function of a parallelizer to batches in a worker process, in threads for the hybrid executor
+
+    Returns:
+        Tuple with the output of each batch, and the number of rows, latency and error of each batch
+        to record in the parent process
+    """
+    recorder = _CompletionRecorder()
+    parallelizer.metrics_collector = recorder
+
+    def apply(batch: List[Dict]) -> List[Dict]:
+        return parallelizer._apply_function_with_error_logging(
+            batch=batch, **function_kwargs
+        )
+
+    if parallelizer.executor_type == ExecutorType.HYBRID:
+        with ThreadPoolExecutor(max_workers=parallelizer.threads_per_process) as pool:
+            outputs = list(pool.map(apply, batches))
+    else:
+        outputs = [apply(batch) for batch in batches]
+    return (outputs, recorder.completions)
 
 
 class DataFrameParallelizer:
@@ -92,7 +180,8 @@ class DataFrameParallelizer:
             Taken into account if `batch_support` is True.
             We recommend letting the end user tune this parameter if they need to increase performance.
         batch_response_parser: Function used to parse the raw response from the function in batch mode,
-            and assign the actual responses and errors back to the original batch of row (list of dict).
+            and assign the actual responses and errors to each row of the batch (list of dict).
+            Only the output columns of the returned dictionaries are kept, so input columns need not be copied.
             This is often required for batch APIs which return nested objects with a mix of responses and errors.
             This parameter is required if batch_support is True.
         output_column_prefix: Column prefix to add to the output columns of the dataframe,
@@ -102,6 +191,55 @@ class DataFrameParallelizer:
         verbose: If True, log raw details on any error encountered along with the error message and error type.
             Else (default) log only the error message and the error type.
             We recommend trying without verbose first. Usually, the error message is enough to diagnose the issue.
+        max_inflight_batches_per_worker: Maximum number of batches submitted to the pool per worker thread
+            and not yet completed. Default is 4. New batches are only submitted as previous ones complete,
+            so that memory stays flat regardless of the number of rows.
+            If None, all batches are submitted upfront.
+        deduplicate_columns: Optional list of column names whose values fully determine the `function` result.
+            If specified, the function is applied once per distinct combination of values in these columns,
+            and the result is fanned out to every matching row in the original order.
+        concurrency_controller: Optional AdaptiveConcurrencyController to adapt the number of concurrent calls
+            to the observed latency and errors, instead of using a fixed `parallel_workers`.
+            If specified, its `max_concurrency` sets the number of worker threads.
+        executor_type: If ExecutorType.THREAD (default), call the function in a pool of `parallel_workers` threads.
+            If ExecutorType.ASYNCIO, the function must be a coroutine function. It is awaited in an event loop,
+            with at most `parallel_workers` concurrent calls. This allows hundreds of concurrent API calls
+            without the overhead of one thread per call.
+            If ExecutorType.PROCESS, call the function in a pool of `parallel_workers` processes,
+            so that CPU-bound functions are not limited by the GIL. If ExecutorType.HYBRID, each process
+            calls the function in `threads_per_process` threads, for functions mixing computation and I/O.
+            With processes, the function and its keyword arguments must be picklable, e.g. defined at module level.
+            Rows and outputs are sent between processes, and errors are handled as with threads.
+        async_context: Optional callable returning an asynchronous context manager, entered in the event loop
+            around all the calls of a run, for instance to open and close a pooled HTTP session.
+            Within `shared_event_loop`, it is entered once for all the runs instead.
+            Taken into account if `executor_type` is ExecutorType.ASYNCIO.
+        input_columns: Optional list of column names read by the `function` from each row.
+            If specified, rows are fed to the function as dictionaries restricted to these columns,
+            which avoids extracting the whole row when the function only needs a few columns.
+            If None (default), rows contain all the columns of the dataframe.
+        row_cost_function: Optional function returning the cost of a row, for instance its number of tokens.
+            If specified with `max_batch_cost`, batches are packed in order with as many rows as fit in
+            `max_batch_cost`, up to `batch_size` rows. A row costlier than `max_batch_cost` is sent alone.
+            Taken into account if `batch_support` is True.
+        max_batch_cost: Maximum total cost of the rows of a batch, as measured by `row_cost_function`.
+        metrics_collector: Optional object with a `record_batch(num_rows, latency, error)` method,
+            called as each batch completes, for instance to measure throughput over time.
+        record_latency: If True, add an output column with the duration of the function call for each row,
+            shared by the rows of a batch. Default is False.
+        threads_per_process: Number of threads calling the function in each worker process.
+            Taken into account if `executor_type` is ExecutorType.HYBRID. Default is 4.
+        batches_per_task: Number of batches shipped to a worker process at a time, to amortize the cost
+            of sending rows to processes. If None (default), batches are split in about 4 tasks per process,
+            small enough for all processes to have a task in flight within `max_inflight_batches_per_worker`.
+            Taken into account if `executor_type` is ExecutorType.PROCESS or ExecutorType.HYBRID.
+        keep_raw_responses: If True, keep responses as returned by the function in the response column,
+            for instance to parse them without a round-trip through strings.
+            Else (default), responses are cast to strings, like the error columns.
+        latency_feedback: If True (default), the latency of each successful call is fed to the
+            `concurrency_controller`. Set to False if the function feeds the controller itself with a more
+            accurate latency, e.g. excluding the time spent waiting on a client-side rate limiter.
+            Errors are fed to the controller in either case.
     """
 
     # Default number of worker threads to use in parallel - may be tuned by the end user
@@ -121,10 +259,22 @@ class DataFrameParallelizer:
             ("error_message", "Error message"),
             ("error_type", "Error type or code"),
             ("error_raw", "Raw error"),
+            ("latency", "Duration of the function call in seconds"),
         ]
     )
     # By default, set verbose to False assuming error message and type are enough information in the logs
     DEFAULT_VERBOSE = False
+    # Default number of pending batches per worker - keeps workers busy without queuing all rows
+    DEFAULT_MAX_INFLIGHT_BATCHES_PER_WORKER = 4
+    # Default number of threads in each worker process of the hybrid executor
+    DEFAULT_THREADS_PER_PROCESS = 4
+    # Attributes only used in the parent process, not sent to worker processes as they may not be picklable
+    PARENT_PROCESS_ATTRIBUTES = (
+        "concurrency_controller",
+        "metrics_collector",
+        "async_context",
+        "row_cost_function",
+    )
 
     def __init__(
         self,
@@ -139,6 +289,22 @@ class DataFrameParallelizer:
         ] = DEFAULT_RESPONSE_PARSER,
         output_column_prefix: AnyStr = DEFAULT_OUTPUT_COLUMN_PREFIX,
         verbose: bool = DEFAULT_VERBOSE,
+        max_inflight_batches_per_worker: Optional[
+            int
+        ] = DEFAULT_MAX_INFLIGHT_BATCHES_PER_WORKER,
+        deduplicate_columns: Optional[List[AnyStr]] = None,
+        concurrency_controller: Optional[AdaptiveConcurrencyController] = None,
+        executor_type: ExecutorType = ExecutorType.THREAD,
+        async_context: Optional[Callable[[], AsyncContextManager]] = None,
+        input_columns: Optional[List[AnyStr]] = None,
+        row_cost_function: Optional[Callable[[Dict], float]] = None,
+        max_batch_cost: Optional[float] = None,
+        metrics_collector: Optional[Any] = None,
+        record_latency: bool = False,
+        threads_per_process: int = DEFAULT_THREADS_PER_PROCESS,
+        batches_per_task: Optional[int] = None,
+        keep_raw_responses: bool = False,
+        latency_feedback: bool = True,
     ):
         self.function = function
         self.error_handling = error_handling
@@ -153,7 +319,73 @@ class DataFrameParallelizer:
         self.batch_response_parser = batch_response_parser
         self.output_column_prefix = output_column_prefix
         self.verbose = verbose
+        if (
+            max_inflight_batches_per_worker is not None
+            and max_inflight_batches_per_worker < 1
+        ):
+            raise ValueError("max_inflight_batches_per_worker must be at least 1")
+        self.max_inflight_batches_per_worker = max_inflight_batches_per_worker
+        self.deduplicate_columns = deduplicate_columns
+        self.concurrency_controller = concurrency_controller
+        if concurrency_controller is not None:
+            self.parallel_workers = concurrency_controller.max_concurrency
+        self.executor_type = executor_type
+        if executor_type == ExecutorType.ASYNCIO and not asyncio.iscoroutinefunction(
+            function
+        ):
+            raise ValueError(
+                "Please use a coroutine function with the asyncio executor"
+            )
+        if executor_type in (ExecutorType.PROCESS, ExecutorType.HYBRID):
+            if asyncio.iscoroutinefunction(function):
+                raise ValueError(
+                    "Please use the asyncio executor with a coroutine function"
+                )
+            self._check_picklable(function, "function")
+        self.async_context = async_context
+        self.input_columns = input_columns
+        if (row_cost_function is None) != (max_batch_cost is None):
+            raise ValueError(
+                "Please set both row_cost_function and max_batch_cost, or neither"
+            )
+        self.row_cost_function = row_cost_function
+        self.max_batch_cost = max_batch_cost
+        self.metrics_collector = metrics_collector
+        self.record_latency = record_latency
+        self.threads_per_process = threads_per_process
+        self.batches_per_task = batches_per_task
+        self.keep_raw_responses = keep_raw_responses
+        self.latency_feedback = latency_feedback
         self._output_column_names = None  # Will be set at runtime by the run method
+        self._event_loop = None  # Will be set by the shared_event_loop method
+
+    def __getstate__(self) -> Dict:
+        """Returns the attributes sent to worker processes, without those only used in the parent process"""
+        state = self.__dict__.copy()
+        for attribute in self.PARENT_PROCESS_ATTRIBUTES:
+            state[attribute] = None
+        # The named tuple class is created at runtime, so it cannot be pickled by reference
+        if self._output_column_names is not None:
+            state["_output_column_names"] = self._output_column_names._asdict()
+        return state
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        if self._output_column_names is not None:
+            self._output_column_names = namedtuple(
+                "OutputColumnNameTuple", self._output_column_names.keys()
+            )(**self._output_column_names)
+
+    @staticmethod
+    def _check_picklable(value: Any, name: AnyStr) -> None:
+        """Raises a ValueError if a value cannot be sent to worker processes"""
+        try:
+            pickle.dumps(value)
+        except Exception as error:
+            raise ValueError(
+                f"The {name} must be picklable to run in worker processes, "
+                + f"e.g. defined at module level: {error}"
+            )
 
     def _get_unique_output_column_names(
         self, existing_names: List[AnyStr]
@@ -173,6 +405,39 @@ class DataFrameParallelizer:
             ]
         )
 
+    def _get_max_inflight_batches(self) -> Union[int, float]:
+        """Returns the number of batches which may be submitted to the pool without having completed"""
+        if self.concurrency_controller is not None:
+            # Only submit batches which can run right away, within the adaptive limit
+            return self.concurrency_controller.limit
+        if self.max_inflight_batches_per_worker:
+            return self.max_inflight_batches_per_worker * self.parallel_workers
+        return math.inf
+
+    def _record_batch_completion(
+        self, output: List[Dict], start: float, error: Optional[Exception] = None
+    ) -> None:
+        """Feeds the latency and error of a batch to the concurrency controller and metrics collector if any
+
+        If `self.record_latency` is True, the latency is also assigned to the output rows of the batch.
+        """
+        latency = perf_counter() - start
+        self._record_completion(len(output), latency, error)
+        if self.record_latency:
+            for output_row in output:
+                output_row[self._output_column_names.latency] = latency
+
+    def _record_completion(
+        self, num_rows: int, latency: float, error: Optional[Exception] = None
+    ) -> None:
+        """Feeds the latency and error of a batch to the concurrency controller and metrics collector if any"""
+        if self.concurrency_controller is not None and (
+            error is not None or self.latency_feedback
+        ):
+            self.concurrency_controller.record(latency, error)
+        if self.metrics_collector is not None:
+            self.metrics_collector.record_batch(num_rows, latency, error)
+
     def _apply_function_with_error_logging(
         self, batch: List[Dict] = None, **function_kwargs,
     ) -> Union[Dict, List[Dict]]:  # sourcery skip: or-if-exp-identity
@@ -189,70 +454,168 @@ class DataFrameParallelizer:
             * (default) log the error message as a warning and return the row with error keys
             * fail if there is an error (if `self.error_handling == ErrorHandling.FAIL`)
         """
-        output = deepcopy(batch)
-        for output_column in self._output_column_names:
-            for output_row in output:
-                output_row[output_column] = ""
+        output = self._init_output(batch)
+        start = perf_counter()
         try:
             if not self.batch_support:
                 # In the row-by-row case, there is only one element in the list as batch_size=1
                 response = [(self.function(row=batch[0], **function_kwargs))]
             else:
                 response = self.function(batch=batch, **function_kwargs)
-            output = self.batch_response_parser(
-                batch=batch,
-                response=response,
-                output_column_names=self._output_column_names,
-            )
-            errors = [
-                row[self._output_column_names.error_message]
-                for row in output
-                if row[self._output_column_names.error_message]
-            ]
-            if errors:
-                raise BatchError(str(errors))
+            output = self._parse_response(batch, response)
+            self._record_batch_completion(output, start)
         except self.exceptions_to_catch + (BatchError,) as error:
+            self._record_batch_completion(output, start, error)
+            self._handle_error(batch, output, error)
+        return output
+
+    async def _apply_coroutine_with_error_logging(
+        self,
+        semaphore: asyncio.Semaphore,
+        batch: List[Dict] = None,
+        **function_kwargs,
+    ) -> Union[Dict, List[Dict]]:
+        """Same as `_apply_function_with_error_logging` for a coroutine function
+
+        The coroutine is awaited once the semaphore is acquired, to limit the number of concurrent calls.
+        """
+        output = self._init_output(batch)
+        async with semaphore:
+            start = perf_counter()
+            try:
+                if not self.batch_support:
+                    response = [await self.function(row=batch[0], **function_kwargs)]
+                else:
+                    response = await self.function(batch=batch, **function_kwargs)
+                output = self._parse_response(batch, response)
+                self._record_batch_completion(output, start)
+            except self.exceptions_to_catch + (BatchError,) as error:
+                self._record_batch_completion(output, start, error)
+                self._handle_error(batch, output, error)
+        return output
+
+    def _init_output(self, batch: List[Dict]) -> List[Dict]:
+        """Returns empty output columns for each row of the batch, without copying the input rows"""
+        return [
+            {output_column: "" for output_column in self._output_column_names}
+            for _ in batch
+        ]
+
+    def _parse_response(self, batch: List[Dict], response: Any) -> List[Dict]:
+        """Assigns the function response to the batch rows
+
+        If any row has an error, raises a BatchError if `self.error_handling == ErrorHandling.FAIL`,
+        else logs it and keeps it in its row, along with the responses of the other rows.
+        """
+        output = self.batch_response_parser(
+            batch=batch,
+            response=response,
+            output_column_names=self._output_column_names,
+        )
+        errors = [
+            row[self._output_column_names.error_message]
+            for row in output
+            if row[self._output_column_names.error_message]
+        ]
+        if errors:
             if self.error_handling == ErrorHandling.FAIL:
-                raise error
+                raise BatchError(str(errors))
             logging.warning(
-                f"Function {self.function.__name__} failed on: {batch} because of error: {error}"
+                f"Function {self.function.__name__} failed on {len(errors)} row(s) of a batch "
+                + f"because of error(s): {errors}"
             )
-            error_type = str(type(error).__qualname__)
-            module = inspect.getmodule(error)
-            if module:
-                error_type = f"{module.__name__}.{error_type}"
-            for output_row in output:
-                output_row[self._output_column_names.error_message] = str(error)
-                output_row[self._output_column_names.error_type] = error_type
-                output_row[self._output_column_names.error_raw] = str(error.args)
         return output
 
+    def _handle_error(
+        self, batch: List[Dict], output: List[Dict], error: Exception
+    ) -> None:
+        """Raises the error if `self.error_handling == ErrorHandling.FAIL`, else logs it in the output rows"""
+        if self.error_handling == ErrorHandling.FAIL:
+            raise error
+        logging.warning(
+            f"Function {self.function.__name__} failed on: {batch} because of error: {error}"
+        )
+        error_columns = _get_error_columns(error, self._output_column_names)
+        for output_row in output:
+            output_row.update(error_columns)
+
+    def _generate_rows(self, df: pd.DataFrame) -> Iterator[Dict]:
+        """Yields each row of the dataframe as a dictionary restricted to `self.input_columns`
+
+        Values are read from the column iterators, which avoids creating one pandas.Series per row
+        and keeps the type of each column.
+        """
+        columns = (
+            list(df.columns) if self.input_columns is None else list(self.input_columns)
+        )
+        if not columns:
+            return ({} for _ in range(len(df.index)))
+        return (
+            dict(zip(columns, values))
+            for values in zip(*[df[column] for column in columns])
+        )
+
+    def _pack_batches(self, rows: Iterator[Dict]) -> List[List[Dict]]:
+        """Groups consecutive rows into batches of at most `self.batch_size` rows and `self.max_batch_cost`
+
+        Rows keep their order, so that results can be assigned back by position.
+        """
+        batches = []
+        (batch, batch_cost) = ([], 0)
+        for row in rows:
+            row_cost = self.row_cost_function(row)
+            if batch and (
+                len(batch) >= self.batch_size
+                or batch_cost + row_cost > self.max_batch_cost
+            ):
+                batches.append(batch)
+                (batch, batch_cost) = ([], 0)
+            batch.append(row)
+            batch_cost += row_cost
+        if batch:
+            batches.append(batch)
+        return batches
+
     def _post_process_results(
-        self, df: pd.DataFrame, results: List[Dict]
+        self,
+        df: pd.DataFrame,
+        results: List[List[Dict]],
+        row_positions: Optional[np.ndarray] = None,
     ) -> pd.DataFrame:
-        """Combines results from the function with the input dataframe"""
+        """Combines results from the function with the input dataframe
+
+        Results are output rows stored in one slot per batch, in the order of the input dataframe.
+        Output columns are joined to the input dataframe by index, without copying input columns.
+        If specified, `row_positions` maps each row of the input dataframe to the position of its result,
+        so that a result may be shared by several rows.
+        """
         results = flatten(results)
-        output_schema = {
-            **{column_name: str for column_name in self._output_column_names},
-            **dict(df.dtypes),
-        }
-        output_df = (
-            pd.DataFrame.from_records(results)
-            .reindex(columns=list(df.columns) + list(self._output_column_names))
-            .astype(output_schema)
-        )
+        output_columns = list(self._output_column_names)
         if not self.verbose:
-            output_df.drop(
-                labels=self._output_column_names.error_raw, axis=1, inplace=True
-            )
+            output_columns.remove(self._output_column_names.error_raw)
+        if not self.record_latency:
+            output_columns.remove(self._output_column_names.latency)
         if self.error_handling == ErrorHandling.FAIL:
-            error_columns = [
-                self._output_column_names.error_message,
-                self._output_column_names.error_type,
-                self._output_column_names.error_raw,
-            ]
-            output_df.drop(labels=error_columns, axis=1, inplace=True, errors="ignore")
-        num_error = sum(output_df[self._output_column_names.response] == "")
+            output_columns = [self._output_column_names.response] + (
+                [self._output_column_names.latency] if self.record_latency else []
+            )
+        output_values = pd.DataFrame.from_records(list(results), columns=output_columns)
+        # Output columns are strings, except the latency and the raw responses if they are kept
+        non_string_columns = [self._output_column_names.latency]
+        if self.keep_raw_responses:
+            non_string_columns.append(self._output_column_names.response)
+        output_values = output_values.astype(
+            {
+                column: str
+                for column in output_columns
+                if column not in non_string_columns
+            }
+        )
+        if row_positions is not None:
+            output_values = output_values.take(row_positions)
+        output_values.index = df.index
+        output_df = pd.concat([df, output_values], axis=1, copy=False)
+        num_error = sum(output_values[self._output_column_names.response] == "")
         num_success = len(df.index) - num_error
         logging.info(
             f"Applying function {self.function.__name__} in parallel to {len(df.index)} row(s): "
@@ -260,13 +623,220 @@ class DataFrameParallelizer:
         )
         return output_df
 
+    def _run_thread_pool(
+        self,
+        batches: Iterator[Tuple[int, List[Dict]]],
+        progress_bar: tqdm_auto,
+        results: List[Optional[List[Dict]]],
+        **pool_kwargs,
+    ) -> None:
+        """Applies the function to indexed batches in a pool of threads
+
+        The output of each batch is stored in its slot of the preallocated `results` list.
+        """
+        futures = {}
+        with ThreadPoolExecutor(max_workers=self.parallel_workers) as pool:
+            for batch_index, batch in batches:
+                # Backpressure: wait for some batches to complete before submitting new ones
+                while len(futures) >= self._get_max_inflight_batches():
+                    (done, _) = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        results[futures.pop(future)] = future.result()
+                        progress_bar.update(1)
+                future = pool.submit(
+                    self._apply_function_with_error_logging,
+                    batch=batch,
+                    **pool_kwargs,
+                )
+                futures[future] = batch_index
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                progress_bar.update(1)
+
+    def _get_default_batches_per_task(self, num_batches: int) -> int:
+        """Returns the number of batches per task so that each worker process gets about 4 tasks
+
+        Tasks are capped so that backpressure lets at least one task per worker process be in flight.
+        """
+        batches_per_task = math.ceil(num_batches / (4 * self.parallel_workers))
+        max_inflight_batches = self._get_max_inflight_batches()
+        if max_inflight_batches != math.inf:
+            batches_per_task = min(
+                batches_per_task, int(max_inflight_batches // self.parallel_workers)
+            )
+        return max(1, batches_per_task)
+
+    def _run_process_pool(
+        self,
+        batches: Iterator[Tuple[int, List[Dict]]],
+        progress_bar: tqdm_auto,
+        results: List[Optional[List[Dict]]],
+        num_batches: int,
+        **pool_kwargs,
+    ) -> None:
+        """Applies the function to indexed batches in a pool of processes, several batches per task
+
+        The output of each batch is stored in its slot of the preallocated `results` list.
+        The completion of each batch is recorded in the parent process, as tasks complete.
+        """
+        self._check_picklable(pool_kwargs, "keyword arguments of the function")
+        batches_per_task = self.batches_per_task or self._get_default_batches_per_task(
+            num_batches
+        )
+        futures = {}
+
+        def collect(done: List) -> None:
+            for future in done:
+                batch_indices = futures.pop(future)
+                (outputs, completions) = future.result()
+                for batch_index, output in zip(batch_indices, outputs):
+                    results[batch_index] = output
+                for completion in completions:
+                    self._record_completion(*completion)
+                progress_bar.update(len(batch_indices))
+
+        with ProcessPoolExecutor(max_workers=self.parallel_workers) as pool:
+            try:
+                for task in chunked(batches, batches_per_task):
+                    # Backpressure: wait for some batches to complete before submitting new ones
+                    while (
+                        sum(len(batch_indices) for batch_indices in futures.values())
+                        >= self._get_max_inflight_batches()
+                    ):
+                        (done, _) = wait(futures, return_when=FIRST_COMPLETED)
+                        collect(done)
+                    future = pool.submit(
+                        _apply_function_in_worker_process,
+                        self,
+                        [batch for _, batch in task],
+                        pool_kwargs,
+                    )
+                    futures[future] = [batch_index for batch_index, _ in task]
+                while futures:
+                    (done, _) = wait(futures, return_when=FIRST_COMPLETED)
+                    collect(done)
+            finally:
+                # Do not start remaining tasks if a call has failed
+                for future in futures:
+                    future.cancel()
+
+    async def _gather_coroutines(
+        self,
+        batches: Iterator[Tuple[int, List[Dict]]],
+        progress_bar: tqdm_auto,
+        results: List[Optional[List[Dict]]],
+        **pool_kwargs,
+    ) -> None:
+        """Applies the coroutine function to indexed batches as concurrent tasks
+
+        The output of each batch is stored in its slot of the preallocated `results` list.
+        """
+        semaphore = asyncio.Semaphore(self.parallel_workers)
+        tasks = {}
+        try:
+            for batch_index, batch in batches:
+                # Backpressure: wait for some batches to complete before creating new tasks
+                while len(tasks) >= self._get_max_inflight_batches():
+                    (done, _) = await asyncio.wait(
+                        tasks, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for task in done:
+                        results[tasks.pop(task)] = task.result()
+                        progress_bar.update(1)
+                task = asyncio.ensure_future(
+                    self._apply_coroutine_with_error_logging(
+                        semaphore, batch=batch, **pool_kwargs
+                    )
+                )
+                tasks[task] = batch_index
+            while tasks:
+                (done, _) = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    results[tasks.pop(task)] = task.result()
+                    progress_bar.update(1)
+        finally:
+            # Cancel remaining tasks if a call has failed
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def _run_coroutines(
+        self,
+        batches: Iterator[Tuple[int, List[Dict]]],
+        progress_bar: tqdm_auto,
+        results: List[Optional[List[Dict]]],
+        **pool_kwargs,
+    ) -> None:
+        """Applies the coroutine function to batches within the asynchronous context if any"""
+        if self.async_context is None:
+            await self._gather_coroutines(batches, progress_bar, results, **pool_kwargs)
+            return
+        async with self.async_context():
+            await self._gather_coroutines(batches, progress_bar, results, **pool_kwargs)
+
+    def _run_event_loop(
+        self,
+        batches: Iterator[Tuple[int, List[Dict]]],
+        progress_bar: tqdm_auto,
+        results: List[Optional[List[Dict]]],
+        **pool_kwargs,
+    ) -> None:
+        """Applies the coroutine function to batches in a new event loop
+
+        This method cannot be called from a thread which already runs an event loop.
+        Within `shared_event_loop`, the shared event loop is used instead, with its asynchronous context.
+        """
+        if self._event_loop is not None:
+            self._event_loop.run_until_complete(
+                self._gather_coroutines(batches, progress_bar, results, **pool_kwargs)
+            )
+            return
+        loop = asyncio.new_event_loop()
+        try:
+            loop.run_until_complete(
+                self._run_coroutines(batches, progress_bar, results, **pool_kwargs)
+            )
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
+    @contextmanager
+    def shared_event_loop(self) -> Iterator[None]:
+        """Runs the asyncio executor in a single event loop for all the runs within this context
+
+        The asynchronous context if any is entered once for all the runs, rather than once per run,
+        for instance to keep a pool of HTTP connections alive while a dataset is processed by chunks.
+        This has no effect on the other executors.
+        """
+        if self.executor_type != ExecutorType.ASYNCIO:
+            yield
+            return
+        loop = asyncio.new_event_loop()
+        try:
+            context = self.async_context() if self.async_context is not None else None
+            if context is not None:
+                loop.run_until_complete(context.__aenter__())
+            self._event_loop = loop
+            try:
+                yield
+            finally:
+                self._event_loop = None
+                if context is not None:
+                    loop.run_until_complete(context.__aexit__(None, None, None))
+        finally:
+            loop.run_until_complete(loop.shutdown_asyncgens())
+            loop.close()
+
     def run(self, df: pd.DataFrame, **function_kwargs,) -> pd.DataFrame:
         """Applies a function to a pandas.DataFrame with parallelization, error logging and progress tracking.
 
         The DataFrame is iterated on and fed to the function as dictionaries, row-by-row or by batches of rows.
-        This process is accelerated by the use of concurrent threads and is tracked with a progress bar.
+        This process is accelerated by the use of concurrent threads, or of asyncio tasks,
+        and is tracked with a progress bar.
         Errors are catched if they match the `self.exceptions_to_catch` attribute and automatically logged.
         Once the whole DataFrame has been iterated on, results and errors are added as additional columns.
+        Output rows are in the same order as input rows, whatever the order in which calls complete.
+        If `self.deduplicate_columns` is set, only the first row of each group of duplicates is iterated on.
 
         Args:
             df: Input dataframe on which the function will be applied
@@ -279,37 +849,65 @@ class DataFrameParallelizer:
             - error type if any
 
         """
-        # First, we create a generator expression to yield each row of the input dataframe.
-        # Each row will be represented as a dictionary like {"column_name_1": "foo", "column_name_2": 42}
-        df_row_generator = (
-            index_series_pair[1].to_dict() for index_series_pair in df.iterrows()
+        self._output_column_names = self._get_unique_output_column_names(
+            existing_names=df.columns
         )
-        len_generator = math.ceil(len(df.index) / self.batch_size)
+        (input_df, row_positions) = (df, None)
+        if self.deduplicate_columns:
+            # Number each group of duplicates in order of first appearance, like drop_duplicates
+            row_positions = (
+                df.groupby(self.deduplicate_columns, sort=False, dropna=False)
+                .ngroup()
+                .values
+            )
+            df = df.drop_duplicates(subset=self.deduplicate_columns)
+            logging.info(
+                f"Deduplicated {len(input_df.index)} row(s) to {len(df.index)} distinct value(s) "
+                + f"of column(s) {self.deduplicate_columns}"
+            )
+        # First, we create a generator to yield each row of the input dataframe.
+        # Each row will be represented as a dictionary like {"column_name_1": "foo", "column_name_2": 42}
+        df_row_generator = self._generate_rows(df)
+        if self.batch_support and self.row_cost_function is not None:
+            # Batch boundaries depend on row costs, so batches are packed upfront to count them
+            batches = self._pack_batches(df_row_generator)
+            len_generator = len(batches)
+        else:
+            batches = chunked(df_row_generator, self.batch_size)
+            len_generator = math.ceil(len(df.index) / self.batch_size)
         logging.info(
             f"Applying function {self.function.__name__} in parallel to {len(df.index)} row(s)"
-            + f" using batch size of {self.batch_size}..."
+            + f" using batch size of {self.batch_size}"
+            + (
+                f" and maximum batch cost of {self.max_batch_cost}..."
+                if self.batch_support and self.row_cost_function is not None
+                else "..."
+            )
         )
         start = perf_counter()
-        self._output_column_names = self._get_unique_output_column_names(
-            existing_names=df.columns
-        )
         pool_kwargs = function_kwargs.copy()
         for kwarg in ["function", "row", "batch"]:  # Reserved pool keyword arguments
             pool_kwargs.pop(kwarg, None)
-        (futures, results) = ([], [])
-        with ThreadPoolExecutor(max_workers=self.parallel_workers) as pool:
-            for batch in chunked(df_row_generator, self.batch_size):
-                futures.append(
-                    pool.submit(
-                        fn=self._apply_function_with_error_logging,
-                        batch=batch,
-                        **pool_kwargs,
-                    )
+        batches = enumerate(batches)
+        # One slot per batch, filled as batches complete, so that results keep the input order
+        results = [None] * len_generator
+        with tqdm_auto(
+            total=len_generator, miniters=1, mininterval=1.0
+        ) as progress_bar:
+            if self.executor_type == ExecutorType.ASYNCIO:
+                self._run_event_loop(batches, progress_bar, results, **pool_kwargs)
+            elif self.executor_type in (ExecutorType.PROCESS, ExecutorType.HYBRID):
+                self._run_process_pool(
+                    batches, progress_bar, results, len_generator, **pool_kwargs
                 )
-            for future in tqdm_auto(
-                as_completed(futures), total=len_generator, miniters=1, mininterval=1.0
-            ):
-                results.append(future.result())
-        output_df = self._post_process_results(df, results)
+            else:
+                self._run_thread_pool(batches, progress_bar, results, **pool_kwargs)
+        # Fan out the results of each distinct value to all matching rows, in the original order
+        output_df = self._post_process_results(input_df, results, row_positions)
+        if self.concurrency_controller is not None:
+            logging.info(
+                "Adaptive concurrency settled on "
+                + f"{self.concurrency_controller.limit} parallel worker(s)."
+            )
         logging.info(f"Parallelization done in {(perf_counter() - start):.2f} seconds.")
         return output_df
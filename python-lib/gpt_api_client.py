@@ -1,17 +1,44 @@
 # -*- coding: utf-8 -*-
 """Module with client calling the OpenAI GPT completion endpoint"""
 
+import asyncio
+import json
+from time import perf_counter
+from typing import Callable
+from typing import Dict
 from typing import List
+from typing import Optional
 from typing import Tuple
 
+import aiohttp
 import openai
 import requests
 
+from gpt_metrics import GPTMetrics
+from gpt_prompt_template import PromptTemplate
+from gpt_rate_limiter import RateLimiter
+from gpt_rate_limiter import estimate_num_tokens
+from gpt_response_cache import GPTResponseCache
+from gpt_retry_policy import RetryPolicy
+from gpt_tokenizer import CONTEXT_WINDOWS
+from gpt_tokenizer import DEFAULT_CONTEXT_WINDOW
+from gpt_tokenizer import GPTTokenizer
+from gpt_tokenizer import PromptTooLongError
+
 # ==============================================================================
 # CONSTANT DEFINITION
 # ==============================================================================
 
-API_EXCEPTIONS = (requests.HTTPError,)
+API_EXCEPTIONS = (requests.HTTPError, openai.error.OpenAIError, PromptTooLongError)
+# Errors signaling that the API is overloaded, upon which concurrency should be reduced
+OVERLOAD_EXCEPTIONS = (openai.error.RateLimitError, openai.error.APIError)
+# Default number of keep-alive connections to the API, which should match the number of concurrent requests
+DEFAULT_MAX_CONNECTIONS = 10
+# Default seconds to wait for a connection to the API to open, and for each read of a response
+DEFAULT_CONNECT_TIMEOUT = 10.0
+DEFAULT_READ_TIMEOUT = 120.0
+# Maximum number of completions sampled from one prompt in a single request, with the `n` parameter
+MAX_CHOICES_PER_REQUEST = 50
 
 # ==============================================================================
 # CLASS AND FUNCTION DEFINITION
@@ -19,10 +46,75 @@ API_EXCEPTIONS = (requests.HTTPError,)
 
 
 class GPTClient:
-    def __init__(self, engine, api_key) -> None:
+    """
+    Client of the completion endpoint, holding its own API key, endpoint and pool of HTTP connections.
+
+    Requests are sent over a keep-alive session shared by all threads, with `max_connections` connections,
+    so that TLS handshakes are not repeated for each request. The global state of the openai module
+    is not modified, so that several clients with different keys or engines may coexist.
+    Call `close` once done to close the connections.
+    If specified, `on_response` is called with the round-trip latency of each successful request,
+    excluding rate limiter waits and retries, for instance to adapt concurrency to the API latency.
+    """
+
+    def __init__(
+        self,
+        engine,
+        api_key,
+        cache: GPTResponseCache = None,
+        rate_limiter: RateLimiter = None,
+        retry_policy: RetryPolicy = None,
+        tokenizer: Optional[GPTTokenizer] = None,
+        context_window: Optional[int] = None,
+        truncate_prompts: bool = False,
+        metrics: Optional[GPTMetrics] = None,
+        api_base: Optional[str] = None,
+        max_connections: int = DEFAULT_MAX_CONNECTIONS,
+        connect_timeout: float = DEFAULT_CONNECT_TIMEOUT,
+        read_timeout: float = DEFAULT_READ_TIMEOUT,
+        on_response: Optional[Callable[[float], None]] = None,
+    ) -> None:
         self.engine = engine
         self.api_key = api_key
-        openai.api_key = api_key
+        self.api_base = api_base or openai.api_base
+        self.max_connections = max_connections
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.cache = cache
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy if retry_policy is not None else RetryPolicy()
+        # If a tokenizer is given, prompts are checked against the context window before sending
+        self.tokenizer = tokenizer
+        self.context_window = (
+            context_window
+            if context_window is not None
+            else CONTEXT_WINDOWS.get(engine, DEFAULT_CONTEXT_WINDOW)
+        )
+        self.truncate_prompts = truncate_prompts
+        # Records the latency and token usage of each request, and rate limiter waits
+        self.metrics = metrics
+        self.on_response = on_response
+        self._session = requests.Session()
+        # Resolve proxies from the environment once, rather than for each request
+        self._session.proxies = requests.utils.get_environ_proxies(self.api_base)
+        self._session.trust_env = False
+        # Asynchronous requests go through the same proxy, if any
+        self._async_proxy = requests.utils.select_proxy(self.api_base, self._session.proxies)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=max_connections)
+        self._session.mount("https://", adapter)
+        self._session.mount("http://", adapter)
+        # Sends requests over the pooled session, and interprets responses and errors like the openai module
+        self._requestor = openai.api_requestor.APIRequestor(
+            key=api_key,
+            api_base=self.api_base,
+            client=openai.http_client.RequestsClient(
+                timeout=(connect_timeout, read_timeout),
+                session=self._session,
+                verify_ssl_certs=openai.verify_ssl_certs,
+                proxy=openai.proxy,
+            ),
+        )
+        self._async_session = None
 
     def format_prompt(
         self,
@@ -53,39 +145,277 @@ class GPTClient:
             prompt: Formatted prompt
         """
 
-        prompt = ""
+        return self.compile_prompt(task, input_desc, output_desc, examples).render(text)
+
+    def compile_prompt(
+        self,
+        task: str = "",
+        input_desc: str = "",
+        output_desc: str = "",
+        examples: List[Tuple[str, str]] = [("", "")],
+    ) -> PromptTemplate:
+        """
+        Returns a prompt template to be built once per run and passed to the generate methods,
+        so that the task and examples are not formatted again for each text.
+        """
+        return PromptTemplate(task, input_desc, output_desc, examples, self.tokenizer)
+
+    def _render_prompts(
+        self,
+        texts: List[str],
+        task: str,
+        input_desc: str,
+        output_desc: str,
+        examples: List[Tuple[str, str]],
+        max_tokens: int,
+        prompt_template: PromptTemplate = None,
+        return_errors: bool = False,
+    ) -> List:
+        """
+        Returns one prompt per text, using the compiled template if any.
+        If the client has a tokenizer, prompts which would not fit in the context window
+        with the tokens to output are truncated or rejected with PromptTooLongError.
+        If `return_errors` is True, the error of each rejected prompt is returned in its place
+        rather than raised, so that the other prompts may still be sent.
+        """
+        if prompt_template is None:
+            prompt_template = self.compile_prompt(task, input_desc, output_desc, examples)
+        if self.tokenizer is None:
+            return [prompt_template.render(text) for text in texts]
+        max_prompt_tokens = self.context_window - max_tokens
+        prompts = []
+        for text in texts:
+            try:
+                prompts.append(
+                    prompt_template.render_within_budget(
+                        text, max_prompt_tokens, self.truncate_prompts
+                    )
+                )
+            except PromptTooLongError as error:
+                if not return_errors:
+                    raise
+                prompts.append(error)
+        return prompts
 
-        ### Task ###
-        if task:
-            prompt += f"{task}\n\n"
+    @staticmethod
+    def _get_valid_positions(prompts: List) -> List[int]:
+        """
+        Returns the positions of the prompts which were not rejected by `_render_prompts`.
+        """
+        return [i for i, prompt in enumerate(prompts) if not isinstance(prompt, PromptTooLongError)]
 
-        ### Examples ###
-        for ex_inp, ex_out in examples:
-            if ex_inp:
-                if input_desc:
-                    prompt += f"{input_desc}: "
-                prompt += f"{ex_inp}\n"
+    def _build_request(self, temperature: float, max_tokens: int, n: int = 1) -> Dict:
+        """
+        Returns the parameters of a request, except prompts.
+        """
+        request = {
+            "engine": self.engine,
+            "stop": "\n",
+            "temperature": temperature,
+            "max_tokens": max_tokens,
+        }
+        # Only sent to sample several completions, so that cache keys of single completions are unchanged
+        if n > 1:
+            request["n"] = n
+        return request
 
-            # One could also provide output examples without descriptions, e.g.
-            # elephant
-            # giraffe
-            # cat
-            if ex_out:
-                if output_desc:
-                    prompt += f"{output_desc}: "
-                prompt += f"{ex_out}\n"
+    def _estimate_request_tokens(self, prompts: List[str], request: Dict) -> int:
+        """
+        Estimates the cost of a request in tokens for the rate limiter.
+        Prompt tokens are counted exactly if the client has a tokenizer, else estimated from characters.
+        """
+        count_tokens = (
+            estimate_num_tokens if self.tokenizer is None else self.tokenizer.count_tokens
+        )
+        # The completion may stop early, so max_tokens is an upper bound of its cost
+        max_completion_tokens = request["max_tokens"] * request.get("n", 1)
+        return sum(count_tokens(prompt) + max_completion_tokens for prompt in prompts)
 
-        ### Final prompt ###
-        if text:
-            if input_desc:
-                prompt += f"{input_desc}: "
-            prompt += f"{text}\n"
+    @staticmethod
+    def _split_choices(n: int) -> List[int]:
+        """
+        Returns the number of completions to sample in each request, to sample n in total.
+        """
+        return [min(MAX_CHOICES_PER_REQUEST, n - i) for i in range(0, n, MAX_CHOICES_PER_REQUEST)]
 
-        if output_desc:
-            # Do not end with a space, as it worsens generation
-            prompt += f"{output_desc}:"
+    @staticmethod
+    def _get_choices(response: Dict) -> List:
+        """
+        Returns the choices of a response, or raises an error if there are none.
+        """
+        if "choices" in response:
+            return response["choices"]
+        else:
+            # OpenAIs Python client seems to handle all exceptions so this should rarely be called
+            user_message = f"Encountered the following error while sending an API request to OpenAI: {response}"
+            raise requests.HTTPError(user_message)
 
-        return prompt
+    def _lookup_cache(self, prompts: List[str], request: Dict) -> Tuple[List, List]:
+        """
+        Returns the cached choice (or None) and the cache key of each prompt.
+        """
+        choices = [None] * len(prompts)
+        cache_keys = [None] * len(prompts)
+        if self.cache is not None:
+            for i, prompt in enumerate(prompts):
+                cache_keys[i] = self.cache.compute_key({**request, "prompt": prompt})
+                cached_response = self.cache.get(cache_keys[i])
+                if cached_response is not None:
+                    choices[i] = openai.util.convert_to_openai_object(json.loads(cached_response))
+        return (choices, cache_keys)
+
+    def _store_choices(
+        self, choices: List, cache_keys: List, missing_positions: List[int], response_choices: List
+    ) -> List:
+        """
+        Assigns the choices of a response to the missing prompts, and caches them.
+        """
+        # Choices hold the index of their prompt in the request, in no guaranteed order
+        for choice in response_choices:
+            position = missing_positions[choice["index"]]
+            choices[position] = choice
+            if self.cache is not None:
+                self.cache.set(cache_keys[position], json.dumps(choice))
+        return choices
+
+    @staticmethod
+    def _build_params(prompts: List[str], request: Dict) -> Dict:
+        """
+        Returns the body of a request to the completion endpoint, whose URL holds the engine.
+        """
+        params = {key: value for key, value in request.items() if key != "engine"}
+        # The endpoint accepts a list of prompts, but a single one is sent as is
+        params["prompt"] = prompts[0] if len(prompts) == 1 else prompts
+        return params
+
+    def _record_request(
+        self, start: float, prompts: List[str], response: Dict = None, error: Exception = None
+    ) -> None:
+        """
+        Records the latency of a request and the token usage of its response in the metrics if any,
+        and passes the latency of a successful request to `on_response` if specified.
+        """
+        latency = perf_counter() - start
+        if self.metrics is not None:
+            usage = response.get("usage") if response is not None else None
+            self.metrics.record_request(latency, len(prompts), usage, error)
+        if self.on_response is not None and response is not None:
+            self.on_response(latency)
+
+    def _record_rate_limit_wait(self, wait_seconds: float) -> None:
+        """
+        Records the time waited for the rate limiter in the metrics if any.
+        """
+        if self.metrics is not None:
+            self.metrics.record_rate_limit_wait(wait_seconds)
+
+    def _send_request(self, prompts: List[str], request: Dict) -> List:
+        """
+        Sends one request to the completion endpoint and returns the choices of the response.
+        """
+        if self.rate_limiter is not None:
+            wait_seconds = self.rate_limiter.acquire(
+                self._estimate_request_tokens(prompts, request)
+            )
+            self._record_rate_limit_wait(wait_seconds)
+        start = perf_counter()
+        try:
+            (response, _, api_key) = self._requestor.request(
+                "post",
+                openai.Completion.class_url(self.engine),
+                self._build_params(prompts, request),
+            )
+            response = openai.util.convert_to_openai_object(response, api_key)
+            choices = self._get_choices(response)
+        except API_EXCEPTIONS as error:
+            self._record_request(start, prompts, error=error)
+            raise
+        self._record_request(start, prompts, response=response)
+        return choices
+
+    async def _apost(self, params: Dict) -> Tuple:
+        """
+        Posts the parameters of a request to the completion endpoint and returns the raw response.
+        """
+        try:
+            async with self._async_session.post(
+                self.api_base + openai.Completion.class_url(self.engine),
+                json=params,
+                headers={"Authorization": f"Bearer {self.api_key}"},
+                proxy=self._async_proxy,
+            ) as http_response:
+                return (await http_response.read(), http_response.status, http_response.headers)
+        except (aiohttp.ClientError, asyncio.TimeoutError) as error:
+            raise openai.error.APIConnectionError(f"Error communicating with OpenAI: {error}")
+
+    async def _asend_request(self, prompts: List[str], request: Dict) -> List:
+        """
+        Sends one request to the completion endpoint over the pooled asynchronous HTTP session.
+        Errors are raised as the same OpenAI exceptions as synchronous requests.
+        """
+        if self._async_session is None:
+            raise RuntimeError(
+                "Asynchronous requests must be sent within GPTClient.async_session()"
+            )
+        if self.rate_limiter is not None:
+            wait_seconds = await self.rate_limiter.async_acquire(
+                self._estimate_request_tokens(prompts, request)
+            )
+            self._record_rate_limit_wait(wait_seconds)
+        start = perf_counter()
+        try:
+            (rbody, rcode, rheaders) = await self._apost(self._build_params(prompts, request))
+            response = openai.util.convert_to_openai_object(
+                self._requestor.interpret_response(rbody, rcode, rheaders), self.api_key
+            )
+            choices = self._get_choices(response)
+        except API_EXCEPTIONS as error:
+            self._record_request(start, prompts, error=error)
+            raise
+        self._record_request(start, prompts, response=response)
+        return choices
+
+    def _complete(self, prompts: List[str], temperature: float, max_tokens: int) -> List:
+        """
+        Makes a single API call to complete one or several prompts, skipping those found in the cache.
+        Transient errors are retried according to the retry policy of the client.
+        Returns one choice per prompt, in the same order as the prompts.
+        """
+        request = self._build_request(temperature, max_tokens)
+        (choices, cache_keys) = self._lookup_cache(prompts, request)
+        missing_positions = [i for i, choice in enumerate(choices) if choice is None]
+        if not missing_positions:
+            return choices
+        response_choices = self.retry_policy.call(
+            self._send_request, [prompts[i] for i in missing_positions], request
+        )
+        return self._store_choices(choices, cache_keys, missing_positions, response_choices)
+
+    async def _acomplete(self, prompts: List[str], temperature: float, max_tokens: int) -> List:
+        """
+        Same as `_complete` for an asynchronous request.
+        Cache reads and writes may hit the disk, so they run in the default executor of the event loop
+        rather than blocking it.
+        """
+        loop = asyncio.get_event_loop()
+        request = self._build_request(temperature, max_tokens)
+        if self.cache is None:
+            (choices, cache_keys) = self._lookup_cache(prompts, request)
+        else:
+            (choices, cache_keys) = await loop.run_in_executor(
+                None, self._lookup_cache, prompts, request
+            )
+        missing_positions = [i for i, choice in enumerate(choices) if choice is None]
+        if not missing_positions:
+            return choices
+        response_choices = await self.retry_policy.async_call(
+            self._asend_request, [prompts[i] for i in missing_positions], request
+        )
+        if self.cache is None:
+            return self._store_choices(choices, cache_keys, missing_positions, response_choices)
+        return await loop.run_in_executor(
+            None, self._store_choices, choices, cache_keys, missing_positions, response_choices
+        )
 
     def generate(
         self,
@@ -96,24 +426,182 @@ class GPTClient:
         examples: List[Tuple[str, str]] = [("", "")],
         temperature: float = 0.7,
         max_tokens: int = 64,
+        prompt_template: PromptTemplate = None,
     ) -> str:
         """
         Constructs a prompt and makes an API call to generate text.
         Default values for temperature and max_tokens are chosen based on the OpenAI playground.
+        If the client has a cache, identical requests are only sent once.
+        If a compiled prompt template is given, it replaces task, descriptions and examples.
+        """
+        prompts = self._render_prompts(
+            [text], task, input_desc, output_desc, examples, max_tokens, prompt_template
+        )
+        return self._complete(prompts, temperature, max_tokens)[0]
+
+    def generate_batch(
+        self,
+        task: str = "",
+        texts: List[str] = [],
+        input_desc: str = "",
+        output_desc: str = "",
+        examples: List[Tuple[str, str]] = [("", "")],
+        temperature: float = 0.7,
+        max_tokens: int = 64,
+        prompt_template: PromptTemplate = None,
+    ) -> List:
+        """
+        Constructs one prompt per text and makes a single API call to generate text for all of them.
+        Returns one generation per text, in the same order as the texts.
+        Texts whose prompt is rejected as too long get their PromptTooLongError in place of a generation,
+        and are not sent, so that the other texts of the batch are still generated.
+        """
+        generations = self._render_prompts(
+            texts, task, input_desc, output_desc, examples, max_tokens, prompt_template, True
+        )
+        valid_positions = self._get_valid_positions(generations)
+        if valid_positions:
+            choices = self._complete(
+                [generations[i] for i in valid_positions], temperature, max_tokens
+            )
+            for i, choice in zip(valid_positions, choices):
+                generations[i] = choice
+        return generations
+
+    def generate_many(
+        self,
+        task: str = "",
+        text: str = "",
+        input_desc: str = "",
+        output_desc: str = "",
+        examples: List[Tuple[str, str]] = [("", "")],
+        temperature: float = 0.7,
+        max_tokens: int = 64,
+        prompt_template: PromptTemplate = None,
+        n: int = 1,
+    ) -> List:
         """
-        prompt = self.format_prompt(task, text, input_desc, output_desc, examples)
+        Constructs a prompt and samples n generations from it, with as few API calls as possible:
+        up to MAX_CHOICES_PER_REQUEST generations are returned by each call.
+        Generations are samples, so they are never read from or written to the cache.
+        """
+        prompts = self._render_prompts(
+            [text], task, input_desc, output_desc, examples, max_tokens, prompt_template
+        )
+        choices = []
+        for num_choices in self._split_choices(n):
+            request = self._build_request(temperature, max_tokens, num_choices)
+            choices += self.retry_policy.call(self._send_request, prompts, request)
+        return choices
 
-        response = openai.Completion.create(
-            engine=self.engine,
-            prompt=prompt,
-            stop="\n",
-            temperature=temperature,
-            max_tokens=max_tokens,
+    async def agenerate(
+        self,
+        task: str = "",
+        text: str = "",
+        input_desc: str = "",
+        output_desc: str = "",
+        examples: List[Tuple[str, str]] = [("", "")],
+        temperature: float = 0.7,
+        max_tokens: int = 64,
+        prompt_template: PromptTemplate = None,
+    ) -> str:
+        """
+        Same as `generate` for an asynchronous request, to be awaited within `async_session`.
+        """
+        prompts = self._render_prompts(
+            [text], task, input_desc, output_desc, examples, max_tokens, prompt_template
         )
+        return (await self._acomplete(prompts, temperature, max_tokens))[0]
 
-        if "choices" in response:
-            return response["choices"][0]
-        else:
-            # OpenAIs Python client seems to handle all exceptions so this should rarely be called
-            user_message = f"Encountered the following error while sending an API request to OpenAI: {response}"
-            raise requests.HTTPError(user_message)
+    async def agenerate_batch(
+        self,
+        task: str = "",
+        texts: List[str] = [],
+        input_desc: str = "",
+        output_desc: str = "",
+        examples: List[Tuple[str, str]] = [("", "")],
+        temperature: float = 0.7,
+        max_tokens: int = 64,
+        prompt_template: PromptTemplate = None,
+    ) -> List:
+        """
+        Same as `generate_batch` for an asynchronous request, to be awaited within `async_session`.
+        """
+        generations = self._render_prompts(
+            texts, task, input_desc, output_desc, examples, max_tokens, prompt_template, True
+        )
+        valid_positions = self._get_valid_positions(generations)
+        if valid_positions:
+            choices = await self._acomplete(
+                [generations[i] for i in valid_positions], temperature, max_tokens
+            )
+            for i, choice in zip(valid_positions, choices):
+                generations[i] = choice
+        return generations
+
+    async def agenerate_many(
+        self,
+        task: str = "",
+        text: str = "",
+        input_desc: str = "",
+        output_desc: str = "",
+        examples: List[Tuple[str, str]] = [("", "")],
+        temperature: float = 0.7,
+        max_tokens: int = 64,
+        prompt_template: PromptTemplate = None,
+        n: int = 1,
+    ) -> List:
+        """
+        Same as `generate_many` for asynchronous requests, sent concurrently within `async_session`.
+        """
+        prompts = self._render_prompts(
+            [text], task, input_desc, output_desc, examples, max_tokens, prompt_template
+        )
+        responses_choices = await asyncio.gather(
+            *[
+                self.retry_policy.async_call(
+                    self._asend_request,
+                    prompts,
+                    self._build_request(temperature, max_tokens, num_choices),
+                )
+                for num_choices in self._split_choices(n)
+            ]
+        )
+        return [choice for choices in responses_choices for choice in choices]
+
+    def async_session(self, max_connections: Optional[int] = None) -> "GPTAsyncSession":
+        """
+        Returns an asynchronous context manager opening the pooled HTTP session used by `agenerate`,
+        with as many connections as the client by default.
+        """
+        return GPTAsyncSession(self, max_connections or self.max_connections)
+
+    def close(self) -> None:
+        """
+        Closes the pooled HTTP connections of synchronous requests.
+        """
+        self._session.close()
+
+
+class GPTAsyncSession:
+    """
+    Asynchronous context manager holding the pooled HTTP session of a GPTClient.
+    Connections are kept alive and reused by all requests sent within the context.
+    """
+
+    def __init__(self, client: GPTClient, max_connections: int = 100) -> None:
+        self.client = client
+        self.max_connections = max_connections
+
+    async def __aenter__(self) -> GPTClient:
+        self.client._async_session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_connections),
+            timeout=aiohttp.ClientTimeout(
+                sock_connect=self.client.connect_timeout, sock_read=self.client.read_timeout
+            ),
+        )
+        return self.client
+
+    async def __aexit__(self, *exc_info) -> None:
+        await self.client._async_session.close()
+        self.client._async_session = None
@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 """Module with classes to format results from the OpenAI GPT completion endpoint"""
 
+import json
 import logging
+from typing import Any
 from typing import AnyStr
 from typing import Dict
 
@@ -25,7 +27,7 @@ class GenericAPIFormatter:
     Generic Formatter class for API responses:
     - initialize with generic parameters
     - compute generic column descriptions
-    - apply format_row to dataframe
+    - apply format_columns to dataframe, which applies format_row to each row by default
     """
 
     def __init__(
@@ -46,9 +48,12 @@ class GenericAPIFormatter:
     def format_row(self, row: Dict) -> Dict:
         return row
 
+    def format_columns(self, df: pd.DataFrame) -> pd.DataFrame:
+        return df.apply(func=self.format_row, axis=1)
+
     def format_df(self, df: pd.DataFrame) -> pd.DataFrame:
         logging.info("Formatting API results...")
-        df = df.apply(func=self.format_row, axis=1)
+        df = self.format_columns(df)
         df = move_api_columns_to_end(df, self.api_column_names, self.error_handling)
         logging.info("Formatting API results: Done.")
         return df
@@ -92,6 +97,14 @@ class GPTAPIFormatter(GenericAPIFormatter):
                 self.generated_text_column_name
             ] = f'Generation based on "{self.input_column}" column'
 
+    def parse_response(self, raw_response: Any) -> Dict:
+        """
+        Parses a raw response, which is either a choice object returned by the client or a JSON string.
+        """
+        if isinstance(raw_response, dict):
+            return raw_response
+        return safe_json_loads(raw_response, self.error_handling)
+
     def format_row(self, row: Dict) -> Dict:
         """
         Formats raw row with response into final dataframe row.
@@ -102,6 +115,35 @@ class GPTAPIFormatter(GenericAPIFormatter):
             row: Dict of a single formatted dataframe row
         """
         raw_response = row[self.api_column_names.response]
-        response = safe_json_loads(raw_response, self.error_handling)
+        response = self.parse_response(raw_response)
         row[self.generated_text_column_name] = response.get(self.response_column, "")
+        row[self.api_column_names.response] = self.serialize_response(raw_response)
         return row
+
+    @staticmethod
+    def serialize_response(raw_response: Any) -> Any:
+        """
+        Serializes a choice object returned by the client to JSON, leaving other responses as is.
+        """
+        return json.dumps(raw_response) if isinstance(raw_response, dict) else raw_response
+
+    def format_columns(self, df: pd.DataFrame) -> pd.DataFrame:
+        """
+        Formats the raw response column into the generated text column, column by column.
+        Responses are parsed and serialized with Series.map, as JSON has no vectorized codec in pandas,
+        and the generated text is extracted from all parsed responses at once.
+
+        Args:
+            df: Dataframe with a column corresponding to the response.
+        Returns:
+            df: New formatted dataframe, with choice objects serialized to JSON in the response column.
+                The input dataframe is left unchanged.
+        """
+        raw_responses = df[self.api_column_names.response].astype(object)
+        responses = raw_responses.map(self.parse_response)
+        return df.assign(
+            **{
+                self.generated_text_column_name: responses.str.get(self.response_column).fillna(""),
+                self.api_column_names.response: raw_responses.map(self.serialize_response),
+            }
+        )
@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+"""Module with a checkpoint of responses to resume interrupted recipe runs"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+from typing import Any
+from typing import AnyStr
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+CHECKPOINT_FILE_NAME = "gpt_checkpoint.sqlite"
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+def compute_hash(value: Any) -> AnyStr:
+    """
+    Hashes a JSON-serializable value, or its string representation otherwise.
+    """
+    serialized_value = json.dumps(value, sort_keys=True, ensure_ascii=False, default=str)
+    return hashlib.sha256(serialized_value.encode("utf-8")).hexdigest()
+
+
+class GPTCheckpoint:
+    """
+    Persistent store of the responses obtained during a recipe run, saved after each chunk of rows.
+
+    Responses are keyed by the number of their row in the input dataset and a hash of the prompt configuration.
+    A hash of the row text is stored alongside, so that a row is only restored if its text has not changed.
+    If a run fails, the next run with the same prompt configuration only sends the rows missing
+    from the checkpoint. Responses of other prompt configurations are discarded when the checkpoint is opened.
+    """
+
+    def __init__(self, checkpoint_dir: AnyStr, prompt_config: Dict) -> None:
+        self.prompt_hash = compute_hash(prompt_config)
+        self.path = os.path.join(checkpoint_dir, CHECKPOINT_FILE_NAME)
+        self.num_restored = 0
+        self._connection = sqlite3.connect(self.path)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses (prompt_hash TEXT NOT NULL, row_number INTEGER NOT NULL, "
+            + "text_hash TEXT NOT NULL, response TEXT NOT NULL, PRIMARY KEY (prompt_hash, row_number))"
+        )
+        self._connection.execute(
+            "DELETE FROM responses WHERE prompt_hash != ?", (self.prompt_hash,)
+        )
+        self._connection.commit()
+        (num_rows,) = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()
+        if num_rows:
+            logging.info(f"Resuming from checkpoint {self.path} with {num_rows} saved response(s)")
+
+    def get_responses(self, row_numbers: List[int], texts: List) -> List[Optional[AnyStr]]:
+        """
+        Returns the saved response of each row, or None if it is missing or if the text has changed.
+        """
+        if not len(row_numbers):
+            return []
+        saved_rows = self._connection.execute(
+            "SELECT row_number, text_hash, response FROM responses "
+            + "WHERE prompt_hash = ? AND row_number BETWEEN ? AND ?",
+            (self.prompt_hash, int(min(row_numbers)), int(max(row_numbers))),
+        ).fetchall()
+        saved_responses = {
+            row_number: (text_hash, response) for (row_number, text_hash, response) in saved_rows
+        }
+        responses = []
+        for row_number, text in zip(row_numbers, texts):
+            (text_hash, response) = saved_responses.get(int(row_number), (None, None))
+            if text_hash is not None and text_hash != compute_hash(text):
+                response = None
+            responses.append(response)
+        self.num_restored += sum(response is not None for response in responses)
+        return responses
+
+    def save_responses(self, row_numbers: List[int], texts: List, responses: List[AnyStr]) -> None:
+        """
+        Saves the responses of successful rows, in a single transaction.
+        """
+        self._connection.executemany(
+            "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)",
+            [
+                (self.prompt_hash, int(row_number), compute_hash(text), response)
+                for (row_number, text, response) in zip(row_numbers, texts, responses)
+            ],
+        )
+        self._connection.commit()
+
+    def clear(self) -> None:
+        """
+        Deletes the saved responses, once the run has succeeded.
+        """
+        self._connection.execute("DELETE FROM responses")
+        self._connection.commit()
+
+    def close(self) -> None:
+        self._connection.close()
+
+
+def merge_saved_responses(
+    df: pd.DataFrame, output_df: pd.DataFrame, saved_responses: List, response_column: AnyStr
+) -> pd.DataFrame:
+    """
+    Returns the output of a chunk, from the output of its rows without a saved response,
+    and the saved responses of the other rows restored at their position in the chunk.
+    Other output columns of restored rows are left empty.
+    """
+    is_missing = np.array([response is None for response in saved_responses], dtype=bool)
+    if is_missing.all():
+        return output_df
+    output_columns = [column for column in output_df.columns if column not in df.columns]
+    restored_df = df[~is_missing].assign(**{column: "" for column in output_columns})
+    restored_df[response_column] = [r for r in saved_responses if r is not None]
+    # Put restored rows back at their position in the chunk
+    positions = np.concatenate([np.flatnonzero(is_missing), np.flatnonzero(~is_missing)])
+    return pd.concat([output_df, restored_df]).iloc[np.argsort(positions, kind="stable")]
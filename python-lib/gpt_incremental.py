@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""Module to carry forward the generations of a previous run in incremental mode"""
+
+import logging
+from typing import AnyStr
+from typing import Iterable
+from typing import List
+from typing import Optional
+
+import pandas as pd
+
+from gpt_checkpoint import compute_hash
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+def compute_input_hashes(texts: Iterable, prompt_hash: AnyStr) -> List[AnyStr]:
+    """
+    Hashes each text with the prompt configuration, so that a generation is reused only if both are unchanged.
+    """
+    return [compute_hash([prompt_hash, text]) for text in texts]
+
+
+class PreviousGenerations:
+    """
+    Successful responses of the previous run, read from the output dataset.
+
+    Rows are matched by a key column if specified, else by the hash of their text and prompt configuration.
+    A response is carried forward only if the input hash of the matching row is unchanged,
+    so that new and changed rows are generated again. Rows which failed are also generated again.
+    """
+
+    def __init__(self, key_column: Optional[AnyStr] = None) -> None:
+        self.key_column = key_column
+        self.num_reused = 0
+        self._responses = {}
+
+    def load(
+        self,
+        df_iterator: Iterable[pd.DataFrame],
+        input_hash_column: AnyStr,
+        response_column: AnyStr,
+        error_message_column: Optional[AnyStr] = None,
+    ) -> None:
+        """
+        Loads the successful responses of the previous run from dataframe chunks of the output dataset.
+        """
+        for df in df_iterator:
+            if error_message_column in df.columns:
+                df = df[df[error_message_column].fillna("") == ""]
+            input_hashes = df[input_hash_column].tolist()
+            keys = df[self.key_column].tolist() if self.key_column else input_hashes
+            for (key, input_hash, response) in zip(keys, input_hashes, df[response_column]):
+                if response:
+                    self._responses[key] = (input_hash, response)
+        logging.info(f"Loaded {len(self._responses)} generation(s) of the previous run")
+
+    def get_responses(self, keys: List, input_hashes: List[AnyStr]) -> List[Optional[AnyStr]]:
+        """
+        Returns the previous response of each row, or None if the row is new or has changed.
+        """
+        responses = []
+        for (key, input_hash) in zip(keys, input_hashes):
+            (previous_input_hash, response) = self._responses.get(key, (None, None))
+            responses.append(response if previous_input_hash == input_hash else None)
+        self.num_reused += sum(response is not None for response in responses)
+        return responses
@@ -0,0 +1,178 @@
+# -*- coding: utf-8 -*-
+"""Module with a collector of the cost and throughput metrics of a recipe run"""
+
+import json
+import threading
+from time import perf_counter
+from typing import AnyStr
+from typing import Dict
+from typing import List
+from typing import Optional
+
+import numpy as np
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+LATENCY_PERCENTILES = (50, 95, 99)
+# Fields of the usage object returned by the completion endpoint
+USAGE_FIELDS = ("prompt_tokens", "completion_tokens", "total_tokens")
+# Duration of the time windows over which throughput is measured
+DEFAULT_THROUGHPUT_INTERVAL_SECONDS = 10.0
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+class GPTMetrics:
+    """
+    Thread-safe collector of the cost and throughput of a run, summarized as JSON at the end.
+
+    GPTClient records the latency and token usage of each API request, including failed attempts,
+    and the time spent waiting for the rate limiter. RetryPolicy records each retry.
+    DataFrameParallelizer records each batch of rows as it completes, to measure throughput over time.
+    """
+
+    def __init__(
+        self, throughput_interval_seconds: float = DEFAULT_THROUGHPUT_INTERVAL_SECONDS
+    ) -> None:
+        self.throughput_interval_seconds = throughput_interval_seconds
+        self.num_requests = 0
+        self.num_failed_requests = 0
+        self.num_prompts = 0
+        self.num_requests_without_usage = 0
+        self.usage = {field: 0 for field in USAGE_FIELDS}
+        self.num_retries = 0
+        self.retry_wait_seconds = 0.0
+        self.num_rate_limit_waits = 0
+        self.rate_limit_wait_seconds = 0.0
+        self.num_rows = 0
+        self.num_failed_rows = 0
+        self._request_latencies = []
+        self._rows_per_interval = {}
+        self._start = perf_counter()
+        self._lock = threading.Lock()
+
+    def record_request(
+        self,
+        latency: float,
+        num_prompts: int,
+        usage: Optional[Dict] = None,
+        error: Optional[Exception] = None,
+    ) -> None:
+        """
+        Records one attempt of an API request, with the usage field of its response if it succeeded.
+        """
+        with self._lock:
+            self.num_requests += 1
+            self.num_prompts += num_prompts
+            self._request_latencies.append(latency)
+            if error is not None:
+                self.num_failed_requests += 1
+            elif usage:
+                for field in USAGE_FIELDS:
+                    self.usage[field] += usage.get(field, 0)
+            else:
+                self.num_requests_without_usage += 1
+
+    def record_retry(self, delay: float) -> None:
+        """
+        Records the retry of a failed request after a delay.
+        """
+        with self._lock:
+            self.num_retries += 1
+            self.retry_wait_seconds += delay
+
+    def record_rate_limit_wait(self, wait_seconds: float) -> None:
+        """
+        Records the time a request waited for the rate limiter before being sent.
+        """
+        if wait_seconds > 0:
+            with self._lock:
+                self.num_rate_limit_waits += 1
+                self.rate_limit_wait_seconds += wait_seconds
+
+    def record_batch(
+        self, num_rows: int, latency: float, error: Optional[Exception] = None
+    ) -> None:
+        """
+        Records a batch of rows processed by the parallelizer, in the time window of its completion.
+        """
+        interval = int((perf_counter() - self._start) // self.throughput_interval_seconds)
+        with self._lock:
+            self.num_rows += num_rows
+            if error is not None:
+                self.num_failed_rows += num_rows
+            self._rows_per_interval[interval] = self._rows_per_interval.get(interval, 0) + num_rows
+
+    def _get_throughput(self, elapsed_seconds: float) -> List[Dict]:
+        """
+        Returns the number of rows per second in each time window since the start, including idle ones.
+        """
+        if not self._rows_per_interval:
+            return []
+        throughput = []
+        for interval in range(max(self._rows_per_interval) + 1):
+            start_seconds = interval * self.throughput_interval_seconds
+            # The last window is still running
+            duration = min(self.throughput_interval_seconds, elapsed_seconds - start_seconds)
+            num_rows = self._rows_per_interval.get(interval, 0)
+            throughput.append(
+                {
+                    "start_seconds": round(start_seconds, 3),
+                    "rows": num_rows,
+                    "rows_per_second": round(num_rows / duration, 3) if duration > 0 else None,
+                }
+            )
+        return throughput
+
+    def get_summary(self) -> Dict:
+        """
+        Returns the metrics of the run as a JSON-serializable dictionary.
+        """
+        with self._lock:
+            elapsed_seconds = perf_counter() - self._start
+            latency = {"count": len(self._request_latencies)}
+            if self._request_latencies:
+                latencies = np.array(self._request_latencies)
+                latency["mean"] = round(float(latencies.mean()), 4)
+                latency["max"] = round(float(latencies.max()), 4)
+                for (percentile, value) in zip(
+                    LATENCY_PERCENTILES, np.percentile(latencies, LATENCY_PERCENTILES)
+                ):
+                    latency[f"p{percentile}"] = round(float(value), 4)
+            return {
+                "elapsed_seconds": round(elapsed_seconds, 3),
+                "rows": {
+                    "processed": self.num_rows,
+                    "failed": self.num_failed_rows,
+                    "rows_per_second": round(self.num_rows / elapsed_seconds, 3)
+                    if elapsed_seconds > 0
+                    else None,
+                },
+                "requests": {
+                    "sent": self.num_requests,
+                    "failed": self.num_failed_requests,
+                    "prompts": self.num_prompts,
+                    "latency_seconds": latency,
+                },
+                "retries": {
+                    "count": self.num_retries,
+                    "per_row": round(self.num_retries / self.num_rows, 4) if self.num_rows else None,
+                    "wait_seconds": round(self.retry_wait_seconds, 3),
+                },
+                "rate_limit": {
+                    "waits": self.num_rate_limit_waits,
+                    "wait_seconds": round(self.rate_limit_wait_seconds, 3),
+                },
+                "tokens": {
+                    **self.usage,
+                    "requests_without_usage": self.num_requests_without_usage,
+                },
+                "throughput": self._get_throughput(elapsed_seconds),
+            }
+
+    def to_json(self) -> AnyStr:
+        return json.dumps(self.get_summary(), indent=2)
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Module with a prompt template compiled once per run and rendered for each text"""
+
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from gpt_rate_limiter import estimate_num_tokens
+from gpt_tokenizer import GPTTokenizer
+from gpt_tokenizer import PromptTooLongError
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+class PromptTemplate:
+    """
+    Few-shot prompt compiled once from the task, descriptions and examples.
+
+    The task header and examples do not depend on the text, so they are joined once into a prefix.
+    Rendering a text then only joins the prefix with the final lines, e.g.:
+
+    Correct grammar mistakes.
+
+    Original: Where do you went?
+    Standard American English: Where did you go?
+    Original: Where is you?
+    Standard American English:
+
+    If a tokenizer is given, prompt tokens are counted exactly rather than estimated from characters.
+    """
+
+    def __init__(
+        self,
+        task: str = "",
+        input_desc: str = "",
+        output_desc: str = "",
+        examples: List[Tuple[str, str]] = [("", "")],
+        tokenizer: Optional[GPTTokenizer] = None,
+    ) -> None:
+        self.tokenizer = tokenizer
+        self.input_label = f"{input_desc}: " if input_desc else ""
+        output_label = f"{output_desc}: " if output_desc else ""
+        parts = [f"{task}\n\n"] if task else []
+        for ex_inp, ex_out in examples:
+            if ex_inp:
+                parts += [self.input_label, ex_inp, "\n"]
+            # One could also provide output examples without descriptions, e.g.
+            # elephant
+            # giraffe
+            # cat
+            if ex_out:
+                parts += [output_label, ex_out, "\n"]
+        self.prefix = "".join(parts)
+        # Do not end with a space, as it worsens generation
+        self.suffix = f"{output_desc}:" if output_desc else ""
+        self._prompt_without_text = self.prefix + self.suffix
+        self.num_prefix_tokens = self.count_tokens(self.prefix)
+        # Tokens of the prompt besides the text, which cannot be truncated
+        self.num_template_tokens = self.num_prefix_tokens + self.count_tokens(
+            f"{self.input_label}\n{self.suffix}"
+        )
+        self._num_prompt_without_text_tokens = self.count_tokens(self._prompt_without_text)
+
+    def count_tokens(self, text: str) -> int:
+        """
+        Returns the number of tokens of a text, or an estimate if there is no tokenizer.
+        """
+        if self.tokenizer is None:
+            return estimate_num_tokens(text)
+        return self.tokenizer.count_tokens(text)
+
+    def count_prompt_tokens(self, text: str = "") -> int:
+        """
+        Returns the number of tokens of the prompt for a text, without tokenizing the prefix again.
+        """
+        if not text:
+            return self._num_prompt_without_text_tokens
+        return self.num_prefix_tokens + self.count_tokens(
+            "".join((self.input_label, text, "\n", self.suffix))
+        )
+
+    def render(self, text: str = "") -> str:
+        """
+        Returns the prompt to complete for a text.
+        """
+        if not text:
+            return self._prompt_without_text
+        return "".join((self.prefix, self.input_label, text, "\n", self.suffix))
+
+    def render_within_budget(
+        self, text: str, max_prompt_tokens: int, truncate: bool = False
+    ) -> str:
+        """
+        Returns the prompt for a text if it fits in a number of tokens.
+        Otherwise, truncates the end of the text to fit if `truncate` is True, else raises PromptTooLongError.
+        """
+        num_prompt_tokens = self.count_prompt_tokens(text)
+        if num_prompt_tokens <= max_prompt_tokens:
+            return self.render(text)
+        max_text_tokens = max_prompt_tokens - self.num_template_tokens
+        if not truncate or not text or max_text_tokens <= 0 or self.tokenizer is None:
+            raise PromptTooLongError(
+                f"Prompt of {num_prompt_tokens} tokens exceeds the limit of {max_prompt_tokens} tokens "
+                + "left by the context window of the engine and the maximum tokens to output"
+            )
+        text_tokens = self.tokenizer.encode(text)[:max_text_tokens]
+        # Tokens may end in the middle of a multi-byte character, which is dropped
+        truncated_text = self.tokenizer.decode(text_tokens).rstrip("\ufffd")
+        return self.render(truncated_text)
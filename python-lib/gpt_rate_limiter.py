@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+"""Module with a client-side rate limiter to stay within the OpenAI API quotas"""
+
+import asyncio
+import math
+import threading
+from time import perf_counter
+from time import sleep
+from typing import AnyStr
+from typing import Callable
+from typing import Optional
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+# Rough average for English text, used when no tokenizer is available
+CHARACTERS_PER_TOKEN = 4
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+def estimate_num_tokens(text: AnyStr) -> int:
+    """
+    Estimates the number of tokens of a text from its number of characters.
+    """
+    return math.ceil(len(text) / CHARACTERS_PER_TOKEN)
+
+
+class TokenBucket:
+    """
+    Thread-safe token bucket, refilled continuously up to its capacity.
+
+    Callers reserve an amount upfront and are told how long to wait before using it.
+    The bucket can go into debt, so that concurrent callers queue up fairly instead of polling.
+    Time is read from `clock`, in seconds.
+    """
+
+    def __init__(
+        self, capacity: float, refill_per_second: float, clock: Callable[[], float] = perf_counter
+    ) -> None:
+        self.capacity = capacity
+        self.refill_per_second = refill_per_second
+        self.clock = clock
+        self._level = capacity
+        self._last_refill = clock()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount: float) -> float:
+        """
+        Takes an amount from the bucket and returns the number of seconds to wait before using it.
+        Amounts larger than the capacity are capped to it, as they could never be granted otherwise.
+        """
+        amount = min(amount, self.capacity)
+        with self._lock:
+            now = self.clock()
+            self._level = min(
+                self.capacity, self._level + (now - self._last_refill) * self.refill_per_second
+            )
+            self._last_refill = now
+            self._level -= amount
+            if self._level >= 0:
+                return 0.0
+            return -self._level / self.refill_per_second
+
+
+class RateLimiter:
+    """
+    Rate limiter with a requests-per-minute and a tokens-per-minute budget, shared by all threads.
+
+    Budgets set to None or 0 are not enforced.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute: Optional[int] = None,
+        tokens_per_minute: Optional[int] = None,
+        clock: Callable[[], float] = perf_counter,
+    ) -> None:
+        self.request_bucket = None
+        self.token_bucket = None
+        if requests_per_minute:
+            self.request_bucket = TokenBucket(requests_per_minute, requests_per_minute / 60, clock)
+        if tokens_per_minute:
+            self.token_bucket = TokenBucket(tokens_per_minute, tokens_per_minute / 60, clock)
+        self.total_wait_seconds = 0.0
+        self._lock = threading.Lock()
+
+    def reserve(self, num_tokens: int) -> float:
+        """
+        Reserves one request costing `num_tokens` and returns the number of seconds to wait before sending it.
+        """
+        wait_seconds = 0.0
+        if self.request_bucket is not None:
+            wait_seconds = max(wait_seconds, self.request_bucket.reserve(1))
+        if self.token_bucket is not None:
+            wait_seconds = max(wait_seconds, self.token_bucket.reserve(num_tokens))
+        with self._lock:
+            self.total_wait_seconds += wait_seconds
+        return wait_seconds
+
+    def acquire(self, num_tokens: int) -> float:
+        """
+        Blocks until one request costing `num_tokens` can be sent within the budgets.
+        Returns the number of seconds waited.
+        """
+        wait_seconds = self.reserve(num_tokens)
+        if wait_seconds > 0:
+            sleep(wait_seconds)
+        return wait_seconds
+
+    async def async_acquire(self, num_tokens: int) -> float:
+        """
+        Same as `acquire` without blocking the event loop.
+        """
+        wait_seconds = self.reserve(num_tokens)
+        if wait_seconds > 0:
+            await asyncio.sleep(wait_seconds)
+        return wait_seconds
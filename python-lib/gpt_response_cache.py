@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""Module with a two-tier cache for responses from the OpenAI GPT completion endpoint"""
+
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+from collections import OrderedDict
+from time import time
+from typing import AnyStr
+from typing import Dict
+from typing import Optional
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+CACHE_FILE_NAME = "gpt_response_cache.sqlite"
+DEFAULT_MAX_MEMORY_ENTRIES = 10000
+DEFAULT_MAX_DISK_ENTRIES = 100000
+# Number of writes between two evictions of the persistent tier
+DISK_EVICTION_INTERVAL = 1000
+# Number of changes to the persistent tier between two commits, also made when closing the cache
+DISK_COMMIT_INTERVAL = 100
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+class GPTResponseCache:
+    """
+    Content-addressed cache of API responses, keyed on a hash of the full request.
+
+    Responses are kept in an in-process LRU tier, and optionally persisted in a SQLite file
+    so that they can be reused by later recipe runs. Entries older than `ttl_seconds` are evicted,
+    as well as the least recently used ones beyond the maximum number of entries of each tier.
+    Changes to the persistent tier are committed in batches, and when the cache is closed.
+    """
+
+    def __init__(
+        self,
+        max_memory_entries: int = DEFAULT_MAX_MEMORY_ENTRIES,
+        cache_dir: AnyStr = None,
+        max_disk_entries: int = DEFAULT_MAX_DISK_ENTRIES,
+        ttl_seconds: Optional[float] = None,
+    ) -> None:
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl_seconds = ttl_seconds
+        self.hits = 0
+        self.misses = 0
+        self._memory_cache = OrderedDict()
+        self._lock = threading.Lock()
+        self._num_disk_writes = 0
+        self._num_uncommitted_changes = 0
+        self._connection = None
+        if cache_dir:
+            self._open_disk_cache(os.path.join(cache_dir, CACHE_FILE_NAME))
+
+    @staticmethod
+    def compute_key(request: Dict) -> AnyStr:
+        """
+        Hashes all the parameters of an API request into a cache key.
+        """
+        serialized_request = json.dumps(request, sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(serialized_request.encode("utf-8")).hexdigest()
+
+    def _open_disk_cache(self, path: AnyStr) -> None:
+        logging.info(f"Opening persistent response cache: {path}")
+        self._connection = sqlite3.connect(path, check_same_thread=False)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute("PRAGMA synchronous=NORMAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL, "
+            + "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)"
+        )
+        self._evict_disk_entries()
+        self._connection.commit()
+
+    def _is_expired(self, created_at: float, now: float) -> bool:
+        return self.ttl_seconds is not None and now - created_at > self.ttl_seconds
+
+    def _evict_disk_entries(self) -> None:
+        if self.ttl_seconds is not None:
+            self._connection.execute(
+                "DELETE FROM responses WHERE created_at < ?", (time() - self.ttl_seconds,)
+            )
+        self._connection.execute(
+            "DELETE FROM responses WHERE key IN "
+            + "(SELECT key FROM responses ORDER BY accessed_at DESC LIMIT -1 OFFSET ?)",
+            (self.max_disk_entries,),
+        )
+
+    def _commit_disk_changes(self) -> None:
+        self._connection.commit()
+        self._num_uncommitted_changes = 0
+
+    def _record_disk_change(self) -> None:
+        self._num_uncommitted_changes += 1
+        if self._num_uncommitted_changes >= DISK_COMMIT_INTERVAL:
+            self._commit_disk_changes()
+
+    def _set_memory_entry(self, key: AnyStr, value: AnyStr, created_at: float) -> None:
+        self._memory_cache[key] = (value, created_at)
+        self._memory_cache.move_to_end(key)
+        while len(self._memory_cache) > self.max_memory_entries:
+            self._memory_cache.popitem(last=False)
+
+    def get(self, key: AnyStr) -> Optional[AnyStr]:
+        """
+        Returns the cached response for a key, or None if it is missing or expired.
+        """
+        now = time()
+        with self._lock:
+            entry = self._memory_cache.get(key)
+            if entry is not None and self._is_expired(entry[1], now):
+                del self._memory_cache[key]
+                entry = None
+            if entry is not None:
+                self._memory_cache.move_to_end(key)
+            elif self._connection is not None:
+                row = self._connection.execute(
+                    "SELECT value, created_at FROM responses WHERE key = ?", (key,)
+                ).fetchone()
+                if row is not None and not self._is_expired(row[1], now):
+                    entry = row
+                    self._connection.execute(
+                        "UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key)
+                    )
+                    self._record_disk_change()
+                    self._set_memory_entry(key, *entry)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            return entry[0]
+
+    def set(self, key: AnyStr, value: AnyStr) -> None:
+        """
+        Stores a response in the in-process tier, and in the persistent tier if any.
+        """
+        now = time()
+        with self._lock:
+            self._set_memory_entry(key, value, now)
+            if self._connection is not None:
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?)", (key, value, now, now)
+                )
+                self._num_disk_writes += 1
+                if self._num_disk_writes % DISK_EVICTION_INTERVAL == 0:
+                    self._evict_disk_entries()
+                    self._commit_disk_changes()
+                else:
+                    self._record_disk_change()
+
+    def close(self) -> None:
+        """
+        Evicts stale entries and closes the persistent tier.
+        """
+        with self._lock:
+            if self._connection is not None:
+                self._evict_disk_entries()
+                self._commit_disk_changes()
+                self._connection.close()
+                self._connection = None
@@ -0,0 +1,145 @@
+# -*- coding: utf-8 -*-
+"""Module with the retry policy for requests to the OpenAI GPT completion endpoint"""
+
+import asyncio
+import logging
+import random
+from email.utils import parsedate_to_datetime
+from datetime import datetime
+from datetime import timezone
+from time import sleep
+from typing import Callable
+from typing import Optional
+
+import openai
+import requests
+
+from gpt_metrics import GPTMetrics
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+RETRIABLE_EXCEPTIONS = (requests.HTTPError, openai.error.OpenAIError)
+# Conflict and rate limit errors, in addition to server errors
+RETRIABLE_HTTP_STATUSES = (409, 429)
+# Upper bound on the delay requested by the API through the Retry-After header
+MAX_RETRY_AFTER_SECONDS = 600
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+def get_retry_after_seconds(error: Exception) -> Optional[float]:
+    """
+    Parses the Retry-After header of an API error, in seconds or as an HTTP date.
+    """
+    headers = getattr(error, "headers", None) or {}
+    retry_after = headers.get("retry-after")
+    if retry_after is None:
+        return None
+    try:
+        seconds = float(retry_after)
+    except ValueError:
+        try:
+            seconds = (
+                parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)
+            ).total_seconds()
+        except (TypeError, ValueError):
+            return None
+    return min(max(seconds, 0.0), MAX_RETRY_AFTER_SECONDS)
+
+
+class RetryPolicy:
+    """
+    Retries API requests failing with a transient error, using exponential backoff with full jitter.
+
+    Rate limit, conflict, server and connection errors are retried. Other errors such as invalid requests
+    or authentication failures are fatal, and raised right away.
+    The delay before attempt n+1 is drawn uniformly between 0 and min(max_delay, base_delay * 2^(n-1)),
+    so that threads failing at the same time do not retry in lockstep. If the API sends a Retry-After header,
+    the delay is at least the requested one.
+    Retries are recorded in the metrics collector if any, and each retried error is passed to `on_retry`
+    if specified, for instance to reduce concurrency as soon as the API is overloaded.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 3,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        metrics: Optional[GPTMetrics] = None,
+        on_retry: Optional[Callable[[Exception], None]] = None,
+    ) -> None:
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.metrics = metrics
+        self.on_retry = on_retry
+
+    @staticmethod
+    def is_retriable(error: Exception) -> bool:
+        """
+        Classifies an API error as transient (retriable) or fatal.
+        """
+        if isinstance(error, openai.error.OpenAIError):
+            status = error.http_status
+            if status is None:
+                # Connection errors and invalid response bodies have no status
+                return isinstance(error, (openai.error.APIConnectionError, openai.error.APIError))
+        elif isinstance(error, requests.HTTPError):
+            if error.response is None:
+                # Raised by GPTClient if the response has no choices
+                return True
+            status = error.response.status_code
+        else:
+            return False
+        return status in RETRIABLE_HTTP_STATUSES or status >= 500
+
+    def get_delay(self, attempt: int, error: Exception) -> float:
+        """
+        Returns the number of seconds to wait after a given failed attempt, starting at 1.
+        """
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+        retry_after = get_retry_after_seconds(error)
+        if retry_after is not None:
+            delay = max(delay, retry_after)
+        return delay
+
+    def _handle_failed_attempt(self, attempt: int, error: Exception) -> float:
+        """
+        Raises the error if it should not be retried, else returns the delay before the next attempt.
+        """
+        if attempt == self.max_attempts or not self.is_retriable(error):
+            raise error
+        delay = self.get_delay(attempt, error)
+        logging.warning(
+            f"API request failed on attempt {attempt}/{self.max_attempts} because of error: {error}. "
+            + f"Retrying in {delay:.2f} seconds."
+        )
+        if self.metrics is not None:
+            self.metrics.record_retry(delay)
+        if self.on_retry is not None:
+            self.on_retry(error)
+        return delay
+
+    def call(self, function: Callable, *args, **kwargs):
+        """
+        Calls a function making an API request, retrying it on transient errors.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return function(*args, **kwargs)
+            except RETRIABLE_EXCEPTIONS as error:
+                sleep(self._handle_failed_attempt(attempt, error))
+
+    async def async_call(self, function: Callable, *args, **kwargs):
+        """
+        Same as `call` for a coroutine function, without blocking the event loop.
+        """
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                return await function(*args, **kwargs)
+            except RETRIABLE_EXCEPTIONS as error:
+                await asyncio.sleep(self._handle_failed_attempt(attempt, error))
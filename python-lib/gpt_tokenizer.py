@@ -0,0 +1,146 @@
+# -*- coding: utf-8 -*-
+"""Module with an offline byte-level BPE tokenizer, using the GPT-2 vocabulary shared by GPT-3 engines"""
+
+import json
+import os
+import threading
+from functools import lru_cache
+from typing import AnyStr
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+import regex
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+# Files of the GPT-2 vocabulary released by OpenAI, shipped in the resource folder of the plugin
+ENCODER_FILE_NAME = "encoder.json"
+MERGES_FILE_NAME = "vocab.bpe"
+# Maximum number of tokens of the prompt and completion of a request to GPT-3 engines
+DEFAULT_CONTEXT_WINDOW = 2048
+CONTEXT_WINDOWS = {"davinci": 2048, "curie": 2048, "babbage": 2048, "ada": 2048}
+# Pre-tokenization pattern of GPT-2: contractions, words, numbers, punctuation and whitespace
+PRE_TOKENIZATION_PATTERN = regex.compile(
+    r"""'s|'t|'re|'ve|'m|'ll|'d| ?\p{L}+| ?\p{N}+| ?[^\s\p{L}\p{N}]+|\s+(?!\S)|\s+"""
+)
+# Maximum number of words whose BPE tokens are cached
+BPE_CACHE_SIZE = 100000
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+class PromptTooLongError(ValueError):
+    """Custom exception raised if a prompt and its completion do not fit in the context window"""
+
+
+@lru_cache(maxsize=None)
+def bytes_to_unicode() -> Dict[int, AnyStr]:
+    """
+    Maps each byte to a printable unicode character, as BPE merges operate on printable strings.
+    """
+    printable_bytes = (
+        list(range(ord("!"), ord("~") + 1))
+        + list(range(ord("¡"), ord("¬") + 1))
+        + list(range(ord("®"), ord("ÿ") + 1))
+    )
+    characters = printable_bytes[:]
+    n = 0
+    for byte in range(2 ** 8):
+        if byte not in printable_bytes:
+            printable_bytes.append(byte)
+            characters.append(2 ** 8 + n)
+            n += 1
+    return dict(zip(printable_bytes, [chr(character) for character in characters]))
+
+
+class GPTTokenizer:
+    """
+    Byte-level BPE tokenizer, loaded from vocabulary files without network access.
+
+    The BPE tokens of each word are cached, as most words of a dataset are repeated.
+    Use `load_tokenizer` to share one instance per vocabulary across a run.
+    """
+
+    def __init__(self, vocabulary_dir: AnyStr) -> None:
+        with open(os.path.join(vocabulary_dir, ENCODER_FILE_NAME), encoding="utf-8") as file:
+            self.encoder = json.load(file)
+        self.decoder = {token: piece for (piece, token) in self.encoder.items()}
+        with open(os.path.join(vocabulary_dir, MERGES_FILE_NAME), encoding="utf-8") as file:
+            # The first line is a version header and the last one is empty
+            merges = [tuple(line.split()) for line in file.read().split("\n")[1:-1]]
+        self.merge_ranks = {merge: rank for (rank, merge) in enumerate(merges)}
+        self.byte_encoder = bytes_to_unicode()
+        self.byte_decoder = {character: byte for (byte, character) in self.byte_encoder.items()}
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def _merge_word(self, word: AnyStr) -> Tuple[AnyStr]:
+        """
+        Applies BPE merges to a word, from the most to the least frequent, and returns its pieces.
+        """
+        pieces = tuple(word)
+        while len(pieces) > 1:
+            pairs = set(zip(pieces, pieces[1:]))
+            best_pair = min(pairs, key=lambda pair: self.merge_ranks.get(pair, float("inf")))
+            if best_pair not in self.merge_ranks:
+                break
+            (first, second) = best_pair
+            merged_pieces = []
+            i = 0
+            while i < len(pieces):
+                if i < len(pieces) - 1 and pieces[i] == first and pieces[i + 1] == second:
+                    merged_pieces.append(first + second)
+                    i += 2
+                else:
+                    merged_pieces.append(pieces[i])
+                    i += 1
+            pieces = tuple(merged_pieces)
+        return pieces
+
+    def _encode_word(self, word: AnyStr) -> List[int]:
+        tokens = self._cache.get(word)
+        if tokens is None:
+            byte_word = "".join(self.byte_encoder[byte] for byte in word.encode("utf-8"))
+            tokens = [self.encoder[piece] for piece in self._merge_word(byte_word)]
+            with self._lock:
+                if len(self._cache) >= BPE_CACHE_SIZE:
+                    self._cache.clear()
+                self._cache[word] = tokens
+        return tokens
+
+    def encode(self, text: AnyStr) -> List[int]:
+        """
+        Returns the tokens of a text.
+        """
+        tokens = []
+        for word in PRE_TOKENIZATION_PATTERN.findall(text):
+            tokens.extend(self._encode_word(word))
+        return tokens
+
+    def decode(self, tokens: List[int]) -> AnyStr:
+        """
+        Returns the text of a list of tokens. Incomplete multi-byte characters are replaced.
+        """
+        byte_text = "".join(self.decoder[token] for token in tokens)
+        return bytearray(self.byte_decoder[character] for character in byte_text).decode(
+            "utf-8", errors="replace"
+        )
+
+    def count_tokens(self, text: AnyStr) -> int:
+        """
+        Returns the number of tokens of a text.
+        """
+        return sum(len(self._encode_word(word)) for word in PRE_TOKENIZATION_PATTERN.findall(text))
+
+
+@lru_cache(maxsize=None)
+def load_tokenizer(vocabulary_dir: AnyStr) -> GPTTokenizer:
+    """
+    Returns the tokenizer of a vocabulary, loaded only once per process.
+    """
+    return GPTTokenizer(vocabulary_dir)
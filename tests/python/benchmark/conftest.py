@@ -0,0 +1,131 @@
+# -*- coding: utf-8 -*-
+"""Fixtures of the benchmark suite, run with `make benchmark-tests`"""
+
+import tracemalloc
+from typing import Callable
+
+import pytest
+
+from mock_completion_server import MockCompletionServer
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+DEFAULT_NUM_ROWS = "1000"
+DEFAULT_ROUNDS = 3
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+def pytest_addoption(parser) -> None:
+    parser.addoption(
+        "--rows",
+        default=DEFAULT_NUM_ROWS,
+        help="Comma-separated numbers of rows of each scenario, e.g. 1000,100000,1000000",
+    )
+    parser.addoption(
+        "--rounds", type=int, default=DEFAULT_ROUNDS, help="Number of runs of each scenario"
+    )
+    parser.addoption(
+        "--mock-latency",
+        type=float,
+        default=0.0,
+        help="Mean latency in seconds of the mock completion endpoint",
+    )
+    parser.addoption(
+        "--mock-latency-distribution",
+        default="constant",
+        help="Latency distribution of the mock completion endpoint: constant, uniform, exponential or lognormal",
+    )
+
+
+def pytest_generate_tests(metafunc) -> None:
+    if "num_rows" in metafunc.fixturenames:
+        num_rows = [int(n) for n in metafunc.config.getoption("rows").split(",")]
+        metafunc.parametrize("num_rows", num_rows, ids=[f"{n}_rows" for n in num_rows])
+
+
+def measure_peak_memory_mb(function: Callable, setup: Callable = None) -> float:
+    """
+    Runs a scenario once while tracing memory allocations, and returns their peak in MB.
+    Only allocations of the benchmark process are traced, not those of worker processes or of the mock server.
+    """
+    (args, kwargs) = setup() if setup is not None else ((), {})
+    tracemalloc.start()
+    try:
+        function(*args, **kwargs)
+        (_, peak_memory) = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return peak_memory / 1024 ** 2
+
+
+@pytest.fixture
+def num_runs(request) -> int:
+    """
+    Number of times each scenario runs: the timed rounds, then one run tracing memory.
+    With --benchmark-disable, each scenario only runs once, without measurements.
+    """
+    if request.config.getoption("benchmark_disable"):
+        return 1
+    return request.config.getoption("rounds") + 1
+
+
+@pytest.fixture
+def run_benchmark(benchmark, request) -> Callable:
+    """
+    Returns a function running a scenario on a number of rows, which records rows per second
+    (from the fastest round) and the peak memory of the scenario in the extra info of the benchmark report.
+    Tracing memory slows allocations down, so it is done in an extra run, after the timed rounds.
+    """
+    rounds = request.config.getoption("rounds")
+
+    def run(function: Callable, num_rows: int, setup: Callable = None):
+        result = benchmark.pedantic(function, setup=setup, rounds=rounds, iterations=1)
+        if benchmark.stats is None:
+            # Benchmarks are disabled: the scenario ran once, as a plain test
+            return result
+        benchmark.extra_info["rows"] = num_rows
+        benchmark.extra_info["rows_per_second"] = round(num_rows / benchmark.stats.stats.min, 1)
+        benchmark.extra_info["peak_memory_mb"] = round(measure_peak_memory_mb(function, setup), 1)
+        return result
+
+    return run
+
+
+@pytest.fixture(scope="session")
+def mock_server_factory(request) -> Callable:
+    """
+    Returns a function starting a mock completion server, stopped at the end of the session.
+    """
+    servers = []
+    default_latency = request.config.getoption("mock_latency")
+    default_distribution = request.config.getoption("mock_latency_distribution")
+
+    def start(**kwargs) -> MockCompletionServer:
+        kwargs.setdefault("latency_seconds", default_latency)
+        kwargs.setdefault("latency_distribution", default_distribution)
+        server = MockCompletionServer(**kwargs).start()
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.stop()
+
+
+@pytest.fixture(scope="session")
+def _shared_mock_server(mock_server_factory) -> MockCompletionServer:
+    return mock_server_factory()
+
+
+@pytest.fixture
+def mock_server(_shared_mock_server) -> MockCompletionServer:
+    """
+    Mock completion server without errors shared by the scenarios, with counters reset for each one.
+    """
+    _shared_mock_server.reset_counters()
+    return _shared_mock_server
@@ -0,0 +1,296 @@
+# -*- coding: utf-8 -*-
+"""Module with a local stand-in for the OpenAI completion endpoint, to benchmark without spending API credit"""
+
+import json
+import math
+import multiprocessing
+import random
+import re
+import threading
+import time
+import urllib.request
+from http.server import BaseHTTPRequestHandler
+from http.server import HTTPServer
+from socketserver import ThreadingMixIn
+from typing import Dict
+from typing import Optional
+from typing import Tuple
+
+# ==============================================================================
+# CONSTANT DEFINITION
+# ==============================================================================
+
+COMPLETIONS_PATH_PATTERN = re.compile(r"^/v1/engines/(?P<engine>[^/]+)/completions$")
+# Path outside of the API, to read and reset the counters of the server from the benchmark process
+COUNTERS_PATH = "/mock/counters"
+STARTUP_TIMEOUT_SECONDS = 30
+LATENCY_DISTRIBUTIONS = ("constant", "uniform", "exponential", "lognormal")
+# Rough average for English text, consistent with the estimate of the rate limiter
+CHARACTERS_PER_TOKEN = 4
+COMPLETION_TEXT = " Mock completion"
+
+# ==============================================================================
+# CLASS AND FUNCTION DEFINITION
+# ==============================================================================
+
+
+class MockCompletionServer:
+    """
+    Local HTTP server answering requests to the completion endpoint with a fixed completion.
+
+    Each request waits for a latency drawn from a configurable distribution, then fails with a rate limit (429)
+    or server (500) error at the configured rates, or returns one choice per prompt and `n`.
+    The server counts requests, prompts, injected errors, and prompt and completion tokens,
+    estimated from the number of characters, which are also returned in the usage field of responses.
+    It runs in a separate process, so that serving requests does not compete for the GIL with the benchmarked client.
+
+    Attributes:
+        latency_distribution: One of "constant", "uniform" (between 0 and twice the mean),
+            "exponential" or "lognormal" (with a standard deviation of the log of `latency_sigma`)
+        latency_seconds: Mean latency of a request
+        rate_limit_error_rate: Share of requests failing with a 429 error, with a Retry-After header
+        server_error_rate: Share of requests failing with a 500 error
+        retry_after_seconds: Value of the Retry-After header of rate limit errors
+        seed: Seed of the random generator of latencies and errors, for reproducible runs
+    """
+
+    def __init__(
+        self,
+        latency_distribution: str = "constant",
+        latency_seconds: float = 0.0,
+        latency_sigma: float = 0.5,
+        rate_limit_error_rate: float = 0.0,
+        server_error_rate: float = 0.0,
+        retry_after_seconds: int = 0,
+        seed: Optional[int] = 42,
+    ) -> None:
+        if latency_distribution not in LATENCY_DISTRIBUTIONS:
+            raise ValueError(f"Latency distribution must be one of {LATENCY_DISTRIBUTIONS}")
+        if rate_limit_error_rate + server_error_rate > 1:
+            raise ValueError("Error rates must sum to at most 1")
+        self.latency_distribution = latency_distribution
+        self.latency_seconds = latency_seconds
+        self.latency_sigma = latency_sigma
+        self.rate_limit_error_rate = rate_limit_error_rate
+        self.server_error_rate = server_error_rate
+        self.retry_after_seconds = retry_after_seconds
+        self.seed = seed
+        self._process = None
+        self._address = None
+
+    @property
+    def api_base(self) -> str:
+        """
+        Base URL of the API to give to clients, so that they send requests to this server.
+        """
+        (host, port) = self._address
+        return f"http://{host}:{port}"
+
+    @property
+    def counters(self) -> Dict:
+        return _request_json(f"{self.api_base}{COUNTERS_PATH}", method="GET")
+
+    def reset_counters(self) -> None:
+        _request_json(f"{self.api_base}{COUNTERS_PATH}", method="DELETE")
+
+    def start(self) -> "MockCompletionServer":
+        """
+        Starts serving requests in a child process, on a free port of the loopback interface.
+        """
+        # Spawned rather than forked, as the benchmark process may already run threads
+        context = multiprocessing.get_context("spawn")
+        address_queue = context.Queue()
+        self._process = context.Process(
+            target=_serve, args=(_MockCompletionEndpoint(self), address_queue), daemon=True
+        )
+        self._process.start()
+        self._address = tuple(address_queue.get(timeout=STARTUP_TIMEOUT_SECONDS))
+        return self
+
+    def stop(self) -> None:
+        self._process.terminate()
+        self._process.join()
+
+    def __enter__(self) -> "MockCompletionServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+
+class _MockCompletionEndpoint:
+    """
+    Logic of the mock completion endpoint, built from the settings of the server and run in its child process.
+    """
+
+    def __init__(self, server: MockCompletionServer) -> None:
+        self.latency_distribution = server.latency_distribution
+        self.latency_seconds = server.latency_seconds
+        self.latency_sigma = server.latency_sigma
+        self.rate_limit_error_rate = server.rate_limit_error_rate
+        self.server_error_rate = server.server_error_rate
+        self.retry_after_seconds = server.retry_after_seconds
+        self.seed = server.seed
+
+    def __getstate__(self) -> Dict:
+        return {k: v for (k, v) in self.__dict__.items() if not k.startswith("_")}
+
+    def __setstate__(self, state: Dict) -> None:
+        self.__dict__.update(state)
+        self._random = random.Random(self.seed)
+        self._lock = threading.Lock()
+        self.reset_counters()
+
+    def reset_counters(self) -> None:
+        with self._lock:
+            self.counters = {
+                "requests": 0,
+                "prompts": 0,
+                "rate_limit_errors": 0,
+                "server_errors": 0,
+                "prompt_tokens": 0,
+                "completion_tokens": 0,
+            }
+
+    def get_counters(self) -> Dict:
+        with self._lock:
+            return dict(self.counters)
+
+    def _draw(self) -> Tuple[float, float]:
+        """
+        Returns the latency of a request and a uniform draw deciding whether it fails.
+        """
+        with self._lock:
+            if self.latency_distribution == "uniform":
+                latency = self._random.uniform(0, 2 * self.latency_seconds)
+            elif self.latency_distribution == "exponential" and self.latency_seconds > 0:
+                latency = self._random.expovariate(1 / self.latency_seconds)
+            elif self.latency_distribution == "lognormal" and self.latency_seconds > 0:
+                # The mean of a lognormal variable is exp(mu + sigma^2 / 2)
+                mu = math.log(self.latency_seconds) - self.latency_sigma**2 / 2
+                latency = self._random.lognormvariate(mu, self.latency_sigma)
+            else:
+                latency = self.latency_seconds
+            return (latency, self._random.random())
+
+    def complete(self, params: Dict) -> Tuple[int, Dict, Dict]:
+        """
+        Returns the status, headers and body of the response to the parameters of a request.
+        """
+        (latency, error_draw) = self._draw()
+        if latency > 0:
+            time.sleep(latency)
+        prompts = params.get("prompt", "")
+        prompts = prompts if isinstance(prompts, list) else [prompts]
+        with self._lock:
+            self.counters["requests"] += 1
+            self.counters["prompts"] += len(prompts)
+            if error_draw < self.rate_limit_error_rate:
+                self.counters["rate_limit_errors"] += 1
+                return (
+                    429,
+                    {"Retry-After": str(self.retry_after_seconds)},
+                    _error_body("Rate limit reached", "requests"),
+                )
+            if error_draw < self.rate_limit_error_rate + self.server_error_rate:
+                self.counters["server_errors"] += 1
+                return (500, {}, _error_body("The server had an error", "server_error"))
+        n = params.get("n", 1)
+        max_tokens = params.get("max_tokens", 16)
+        completion_text = COMPLETION_TEXT[: max_tokens * CHARACTERS_PER_TOKEN]
+        choices = [
+            {"text": completion_text, "index": i, "logprobs": None, "finish_reason": "stop"}
+            for i in range(len(prompts) * n)
+        ]
+        prompt_tokens = sum(_estimate_num_tokens(prompt) for prompt in prompts)
+        completion_tokens = _estimate_num_tokens(completion_text) * len(choices)
+        with self._lock:
+            self.counters["prompt_tokens"] += prompt_tokens
+            self.counters["completion_tokens"] += completion_tokens
+        usage = {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": completion_tokens,
+            "total_tokens": prompt_tokens + completion_tokens,
+        }
+        body = {
+            "id": "cmpl-mock",
+            "object": "text_completion",
+            "created": int(time.time()),
+            "model": params.get("model", "mock"),
+            "choices": choices,
+            "usage": usage,
+        }
+        return (200, {}, body)
+
+
+def _estimate_num_tokens(text: str) -> int:
+    return math.ceil(len(text) / CHARACTERS_PER_TOKEN)
+
+
+def _error_body(message: str, error_type: str) -> Dict:
+    return {"error": {"message": message, "type": error_type, "param": None, "code": None}}
+
+
+def _request_json(url: str, method: str) -> Dict:
+    with urllib.request.urlopen(urllib.request.Request(url, method=method)) as response:
+        return json.loads(response.read())
+
+
+def _serve(endpoint: _MockCompletionEndpoint, address_queue) -> None:
+    """
+    Serves requests with the endpoint until the process is terminated, after sending the address of the server.
+    """
+    http_server = _ThreadingHTTPServer(("127.0.0.1", 0), _CompletionRequestHandler)
+    http_server.mock = endpoint
+    address_queue.put(http_server.server_address)
+    http_server.serve_forever()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """HTTP server handling each connection in a thread, like http.server.ThreadingHTTPServer (Python 3.7+)"""
+
+    daemon_threads = True
+    # Concurrent benchmarks open many connections at once
+    request_queue_size = 1024
+
+
+class _CompletionRequestHandler(BaseHTTPRequestHandler):
+    # Keep-alive connections, as used by the pooled sessions of the client
+    protocol_version = "HTTP/1.1"
+    # Headers and body are written separately, which would otherwise be delayed by Nagle's algorithm
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args) -> None:
+        pass
+
+    def do_GET(self) -> None:
+        if self.path == COUNTERS_PATH:
+            self._send_json(200, {}, self.server.mock.get_counters())
+        else:
+            self._send_json(404, {}, _error_body("Unknown path", "invalid_request_error"))
+
+    def do_DELETE(self) -> None:
+        if self.path == COUNTERS_PATH:
+            self.server.mock.reset_counters()
+            self._send_json(200, {}, {})
+        else:
+            self._send_json(404, {}, _error_body("Unknown path", "invalid_request_error"))
+
+    def do_POST(self) -> None:
+        content_length = int(self.headers.get("Content-Length", 0))
+        params = json.loads(self.rfile.read(content_length) or b"{}")
+        if COMPLETIONS_PATH_PATTERN.match(self.path):
+            (status, headers, body) = self.server.mock.complete(params)
+        else:
+            (status, headers, body) = (404, {}, _error_body("Unknown path", "invalid_request_error"))
+        self._send_json(status, headers, body)
+
+    def _send_json(self, status: int, headers: Dict, body: Dict) -> None:
+        content = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        for (name, value) in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of GPT API calls parallelized over a dataframe, against the mock completion endpoint"""
+
+import math
+from typing import Dict
+from typing import List
+
+import pytest
+
+from dkulib.parallelizer import DataFrameParallelizer
+from dkulib.parallelizer.parallelizer import ErrorHandling
+from dkulib.parallelizer.parallelizer import ExecutorType
+from gpt_api_client import API_EXCEPTIONS
+from gpt_api_client import MAX_CHOICES_PER_REQUEST
+from gpt_api_client import GPTClient
+from gpt_metrics import GPTMetrics
+from gpt_retry_policy import RetryPolicy
+from mock_completion_server import MockCompletionServer
+from test_benchmark_parallelizer import generate_input_df
+
+ENGINE = "ada"
+PARALLEL_WORKERS = {ExecutorType.THREAD: 32, ExecutorType.ASYNCIO: 100}
+
+
+def build_client(
+    server: MockCompletionServer,
+    metrics: GPTMetrics,
+    executor_type: ExecutorType = ExecutorType.THREAD,
+    **kwargs,
+) -> GPTClient:
+    client = GPTClient(
+        ENGINE,
+        "mock-api-key",
+        metrics=metrics,
+        api_base=server.api_base,
+        max_connections=PARALLEL_WORKERS[executor_type],
+        **kwargs,
+    )
+    client.prompt_template = client.compile_prompt(
+        task="Correct grammar mistakes.",
+        input_desc="Original",
+        output_desc="Standard American English",
+        examples=[("Where do you went?", "Where did you go?")],
+    )
+    return client
+
+
+def build_parallelizer(
+    client: GPTClient,
+    metrics: GPTMetrics,
+    executor_type: ExecutorType = ExecutorType.THREAD,
+    batch_size: int = 1,
+) -> DataFrameParallelizer:
+    if executor_type == ExecutorType.ASYNCIO:
+
+        async def generate(row: Dict) -> str:
+            return await client.agenerate(
+                text=row["text"], max_tokens=16, prompt_template=client.prompt_template
+            )
+
+    elif batch_size > 1:
+
+        def generate(batch: List[Dict]) -> List:
+            return client.generate_batch(
+                texts=[row["text"] for row in batch],
+                max_tokens=16,
+                prompt_template=client.prompt_template,
+            )
+
+    else:
+
+        def generate(row: Dict) -> str:
+            return client.generate(
+                text=row["text"], max_tokens=16, prompt_template=client.prompt_template
+            )
+
+    return DataFrameParallelizer(
+        function=generate,
+        error_handling=ErrorHandling.LOG,
+        exceptions_to_catch=API_EXCEPTIONS,
+        parallel_workers=PARALLEL_WORKERS[executor_type],
+        batch_support=batch_size > 1,
+        batch_size=batch_size,
+        output_column_prefix="gpt",
+        executor_type=executor_type,
+        async_context=client.async_session,
+        input_columns=["text"],
+        metrics_collector=metrics,
+        keep_raw_responses=True,
+    )
+
+
+def add_extra_info(benchmark, metrics: GPTMetrics, server_counters: Dict) -> None:
+    summary = metrics.get_summary()
+    benchmark.extra_info["request_latency_seconds"] = summary["requests"]["latency_seconds"]
+    benchmark.extra_info["retries"] = summary["retries"]["count"]
+    benchmark.extra_info["server"] = dict(server_counters)
+
+
+@pytest.mark.parametrize("executor_type", [ExecutorType.THREAD, ExecutorType.ASYNCIO])
+def test_client_generate(benchmark, run_benchmark, num_runs, mock_server, num_rows, executor_type):
+    input_df = generate_input_df(num_rows)
+    metrics = GPTMetrics()
+    client = build_client(mock_server, metrics, executor_type)
+    parallelizer = build_parallelizer(client, metrics, executor_type)
+    output_df = run_benchmark(lambda: parallelizer.run(input_df), num_rows)
+    client.close()
+    assert (output_df["gpt_error_message"] == "").all()
+    server_counters = mock_server.counters
+    assert server_counters["requests"] == num_rows * num_runs
+    add_extra_info(benchmark, metrics, server_counters)
+
+
+def test_client_generate_batch(benchmark, run_benchmark, num_runs, mock_server, num_rows):
+    input_df = generate_input_df(num_rows)
+    metrics = GPTMetrics()
+    client = build_client(mock_server, metrics)
+    parallelizer = build_parallelizer(client, metrics, batch_size=20)
+    output_df = run_benchmark(lambda: parallelizer.run(input_df), num_rows)
+    client.close()
+    assert (output_df["gpt_error_message"] == "").all()
+    server_counters = mock_server.counters
+    assert server_counters["requests"] == math.ceil(num_rows / 20) * num_runs
+    assert server_counters["prompts"] == num_rows * num_runs
+    add_extra_info(benchmark, metrics, server_counters)
+
+
+def test_client_generate_many(benchmark, run_benchmark, num_runs, mock_server, num_rows):
+    """Output-only mode, with one request sampling the generations of a whole batch of rows"""
+    input_df = generate_input_df(num_rows)
+    metrics = GPTMetrics()
+    client = build_client(mock_server, metrics)
+    parallelizer = DataFrameParallelizer(
+        function=lambda batch: client.generate_many(
+            max_tokens=16, prompt_template=client.prompt_template, n=len(batch)
+        ),
+        error_handling=ErrorHandling.LOG,
+        exceptions_to_catch=API_EXCEPTIONS,
+        parallel_workers=PARALLEL_WORKERS[ExecutorType.THREAD],
+        batch_support=True,
+        batch_size=MAX_CHOICES_PER_REQUEST,
+        output_column_prefix="gpt",
+        input_columns=[],
+        metrics_collector=metrics,
+        keep_raw_responses=True,
+    )
+    output_df = run_benchmark(lambda: parallelizer.run(input_df), num_rows)
+    client.close()
+    assert (output_df["gpt_error_message"] == "").all()
+    server_counters = mock_server.counters
+    assert server_counters["requests"] == math.ceil(num_rows / MAX_CHOICES_PER_REQUEST) * num_runs
+    add_extra_info(benchmark, metrics, server_counters)
+
+
+def test_client_generate_with_errors(
+    benchmark, run_benchmark, num_runs, mock_server_factory, num_rows
+):
+    """Rate limit and server errors are injected in 5% of requests each, and retried without delay"""
+    server = mock_server_factory(rate_limit_error_rate=0.05, server_error_rate=0.05)
+    input_df = generate_input_df(num_rows)
+    metrics = GPTMetrics()
+    retry_policy = RetryPolicy(max_attempts=10, base_delay=0.0, max_delay=0.0, metrics=metrics)
+    client = build_client(server, metrics, retry_policy=retry_policy)
+    parallelizer = build_parallelizer(client, metrics)
+    output_df = run_benchmark(lambda: parallelizer.run(input_df), num_rows)
+    client.close()
+    assert (output_df["gpt_error_message"] == "").all()
+    server_counters = server.counters
+    num_errors = server_counters["rate_limit_errors"] + server_counters["server_errors"]
+    # Each failed request is retried once more
+    assert server_counters["requests"] == num_rows * num_runs + num_errors
+    assert metrics.get_summary()["retries"]["count"] == num_errors
+    add_extra_info(benchmark, metrics, server_counters)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the formatting of GPT API responses into output columns"""
+
+import json
+
+import pandas as pd
+import pytest
+
+from gpt_api_formatting import GPTAPIFormatter
+from test_benchmark_parallelizer import generate_input_df
+
+
+def generate_output_df(num_rows: int, serialized: bool) -> pd.DataFrame:
+    """
+    Returns a dataframe as returned by the parallelizer, with choice objects returned by the client,
+    or JSON strings as restored from a checkpoint.
+    """
+    df = generate_input_df(num_rows)
+    choices = [
+        {
+            "text": f" Where did you go number {i}?",
+            "index": 0,
+            "logprobs": None,
+            "finish_reason": "stop",
+        }
+        for i in range(num_rows)
+    ]
+    df["gpt_response"] = [json.dumps(choice) for choice in choices] if serialized else choices
+    df["gpt_error_message"] = ""
+    df["gpt_error_type"] = ""
+    return df
+
+
+@pytest.mark.parametrize("serialized", [False, True], ids=["choice_objects", "json_strings"])
+def test_formatter_format_df(benchmark, run_benchmark, num_rows, serialized):
+    input_df = generate_input_df(0)
+    formatter = GPTAPIFormatter(
+        input_df=input_df,
+        input_column="text",
+        output_column="standard_american_english",
+        column_prefix="gpt",
+    )
+    output_df = generate_output_df(num_rows, serialized)
+
+    # Each round starts from a fresh copy, made outside of the timing
+    formatted_df = run_benchmark(
+        formatter.format_df, num_rows, setup=lambda: ((output_df.copy(),), {})
+    )
+    assert (
+        formatted_df["standard_american_english"].iloc[-1]
+        == f" Where did you go number {num_rows - 1}?"
+    )
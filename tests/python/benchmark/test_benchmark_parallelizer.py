@@ -0,0 +1,107 @@
+# -*- coding: utf-8 -*-
+"""Benchmark of the overhead of the parallelizer, with functions returning right away"""
+
+import json
+import re
+from typing import Dict
+from typing import List
+
+import pandas as pd
+import pytest
+
+from dkulib.parallelizer import DataFrameParallelizer
+from dkulib.parallelizer.parallelizer import ErrorHandling
+from dkulib.parallelizer.parallelizer import ExecutorType
+
+
+def generate_input_df(num_rows: int, num_distinct_texts: int = None) -> pd.DataFrame:
+    num_distinct_texts = num_distinct_texts or num_rows
+    return pd.DataFrame(
+        {
+            "id": range(num_rows),
+            "text": [
+                f"Where do you went number {i % num_distinct_texts}?" for i in range(num_rows)
+            ],
+            "other": ["Column not read by the function"] * num_rows,
+        }
+    )
+
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+def echo(row: Dict) -> str:
+    return row["text"]
+
+
+async def async_echo(row: Dict) -> str:
+    return row["text"]
+
+
+def echo_batch(batch: List[Dict]) -> List[str]:
+    return [row["text"] for row in batch]
+
+
+def clean_text(row: Dict) -> str:
+    """CPU-bound function, parsing and serializing JSON and matching regular expressions"""
+    words = []
+    for _ in range(50):
+        words = WORD_PATTERN.findall(json.loads(json.dumps({"text": row["text"]}))["text"].lower())
+    return " ".join(words)
+
+
+@pytest.mark.parametrize("executor_type", [ExecutorType.THREAD, ExecutorType.ASYNCIO])
+def test_parallelizer_row_by_row(run_benchmark, num_rows, executor_type):
+    input_df = generate_input_df(num_rows)
+    parallelizer = DataFrameParallelizer(
+        function=async_echo if executor_type == ExecutorType.ASYNCIO else echo,
+        error_handling=ErrorHandling.FAIL,
+        parallel_workers=8,
+        executor_type=executor_type,
+        input_columns=["text"],
+    )
+    output_df = run_benchmark(lambda: parallelizer.run(input_df), num_rows)
+    assert output_df["output_response"].tolist() == input_df["text"].tolist()
+
+
+def test_parallelizer_batch(run_benchmark, num_rows):
+    input_df = generate_input_df(num_rows)
+    parallelizer = DataFrameParallelizer(
+        function=echo_batch,
+        error_handling=ErrorHandling.FAIL,
+        parallel_workers=8,
+        batch_support=True,
+        batch_size=20,
+        input_columns=["text"],
+    )
+    output_df = run_benchmark(lambda: parallelizer.run(input_df), num_rows)
+    assert output_df["output_response"].tolist() == input_df["text"].tolist()
+
+
+def test_parallelizer_deduplicate(run_benchmark, num_rows):
+    input_df = generate_input_df(num_rows, num_distinct_texts=max(num_rows // 10, 1))
+    parallelizer = DataFrameParallelizer(
+        function=echo,
+        error_handling=ErrorHandling.FAIL,
+        parallel_workers=8,
+        deduplicate_columns=["text"],
+        input_columns=["text"],
+    )
+    output_df = run_benchmark(lambda: parallelizer.run(input_df), num_rows)
+    assert output_df["output_response"].tolist() == input_df["text"].tolist()
+
+
+@pytest.mark.parametrize(
+    "executor_type", [ExecutorType.THREAD, ExecutorType.PROCESS, ExecutorType.HYBRID]
+)
+def test_parallelizer_cpu_bound(run_benchmark, num_rows, executor_type):
+    input_df = generate_input_df(num_rows)
+    parallelizer = DataFrameParallelizer(
+        function=clean_text,
+        error_handling=ErrorHandling.FAIL,
+        parallel_workers=8,
+        executor_type=executor_type,
+        input_columns=["text"],
+    )
+    output_df = run_benchmark(lambda: parallelizer.run(input_df), num_rows)
+    assert output_df["output_response"].iloc[0] == "where do you went number 0"
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the chunked processing of datasets, on in-memory datasets"""
+
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+
+import pandas as pd
+import pytest
+
+pytest.importorskip("dataiku")
+
+from dkulib.dku_io_utils import chunked_processing  # noqa: E402
+from dkulib.dku_io_utils import process_dataset_chunks  # noqa: E402
+
+
+class ReadError(Exception):
+    pass
+
+
+class ProcessingError(Exception):
+    pass
+
+
+class WriteError(Exception):
+    pass
+
+
+class FakeMetrics:
+    """Last metric values of a dataset whose records were never counted"""
+
+    def get_metric_by_id(self, metric_id: str) -> Dict:
+        return {"lastValues": []}
+
+
+class FakeWriter:
+    """Dataset writer keeping the written dataframes, optionally failing on one of them"""
+
+    def __init__(self, fail_on_write: int = None):
+        self.fail_on_write = fail_on_write
+        self.dfs = []
+
+    def __enter__(self) -> "FakeWriter":
+        return self
+
+    def __exit__(self, *args) -> None:
+        pass
+
+    def write_dataframe(self, df: pd.DataFrame) -> None:
+        if len(self.dfs) == self.fail_on_write:
+            raise WriteError("Failed to write")
+        self.dfs.append(df)
+
+
+class FakeDataset:
+    """In-memory dataset, read by chunks like a dataiku.Dataset
+
+    Attributes:
+        num_closed_streams: Number of streams returned by `iter_dataframes` which were closed
+    """
+
+    def __init__(self, df: pd.DataFrame, fail_on_chunk: int = None, writer: FakeWriter = None):
+        self.name = "fake_dataset"
+        self.read_partitions = None
+        self.writePartition = None
+        self.df = df
+        self.fail_on_chunk = fail_on_chunk
+        self.writer = writer
+        self.num_closed_streams = 0
+
+    def iter_dataframes(self, chunksize: int, infer_with_pandas: bool) -> Iterator[pd.DataFrame]:
+        try:
+            for i, start in enumerate(range(0, len(self.df.index), chunksize)):
+                if i == self.fail_on_chunk:
+                    raise ReadError("Failed to read")
+                yield self.df.iloc[start : start + chunksize]
+        finally:
+            self.num_closed_streams += 1
+
+    def get_last_metric_values(self) -> FakeMetrics:
+        return FakeMetrics()
+
+    def read_schema(self, raise_if_empty: bool) -> List[Dict]:
+        return [{"name": "id", "type": "bigint"}]
+
+    def write_schema_from_dataframe(self, df: pd.DataFrame, dropAndCreate: bool = False) -> None:
+        pass
+
+    def get_writer(self) -> FakeWriter:
+        return self.writer
+
+
+class FakePartitionedDataset(FakeDataset):
+    """In-memory partitioned dataset, reading all partitions or the one added with `add_read_partitions`"""
+
+    def __init__(self, partition_dfs: Dict[str, pd.DataFrame]):
+        super().__init__(pd.concat(partition_dfs.values()))
+        self.partition_dfs = partition_dfs
+        self.read_partitions = list(partition_dfs)
+
+    def add_read_partitions(self, partition: str) -> None:
+        self.read_partitions = [partition]
+        self.df = self.partition_dfs[partition]
+
+
+def double(df: pd.DataFrame) -> pd.DataFrame:
+    return df.assign(double=df["id"] * 2)
+
+
+def fail_on_second_chunk() -> Callable:
+    num_chunks = [0]
+
+    def func(df: pd.DataFrame) -> pd.DataFrame:
+        num_chunks[0] += 1
+        if num_chunks[0] == 2:
+            raise ProcessingError("Failed to process")
+        return double(df)
+
+    return func
+
+
+def process(
+    input_dataset: FakeDataset, func: Callable, pipeline_depth: int, writer: FakeWriter = None
+) -> FakeWriter:
+    writer = writer or FakeWriter()
+    process_dataset_chunks(
+        input_dataset=input_dataset,
+        output_dataset=FakeDataset(pd.DataFrame(), writer=writer),
+        func=func,
+        chunksize=10,
+        pipeline_depth=pipeline_depth,
+        count_input_records=False,
+    )
+    return writer
+
+
+pipeline_depths = pytest.mark.parametrize("pipeline_depth", [0, 2], ids=["sequential", "pipelined"])
+
+
+@pipeline_depths
+def test_chunks_are_written_in_order(pipeline_depth):
+    input_dataset = FakeDataset(pd.DataFrame({"id": range(95)}))
+    writer = process(input_dataset, double, pipeline_depth)
+    output_df = pd.concat(writer.dfs)
+    assert output_df["id"].tolist() == list(range(95))
+    assert output_df["double"].tolist() == [2 * i for i in range(95)]
+    assert input_dataset.num_closed_streams == 1
+
+
+@pipeline_depths
+def test_read_error_is_raised(pipeline_depth):
+    input_dataset = FakeDataset(pd.DataFrame({"id": range(95)}), fail_on_chunk=3)
+    writer = FakeWriter()
+    with pytest.raises(ReadError):
+        process(input_dataset, double, pipeline_depth, writer)
+    # Chunks read before the error are processed and written
+    assert len(writer.dfs) == 3
+    assert input_dataset.num_closed_streams == 1
+
+
+@pipeline_depths
+def test_processing_error_is_raised_and_input_stream_is_closed(pipeline_depth):
+    input_dataset = FakeDataset(pd.DataFrame({"id": range(95)}))
+    with pytest.raises(ProcessingError) as error_info:
+        process(input_dataset, fail_on_second_chunk(), pipeline_depth)
+    # Holding the error keeps its traceback alive: the stream is closed before, not when it is freed
+    assert input_dataset.num_closed_streams == 1
+
+
+@pipeline_depths
+def test_write_error_is_raised(pipeline_depth):
+    input_dataset = FakeDataset(pd.DataFrame({"id": range(95)}))
+    with pytest.raises(WriteError):
+        process(input_dataset, double, pipeline_depth, FakeWriter(fail_on_write=1))
+    assert input_dataset.num_closed_streams == 1
+
+
+def build_partitioned_dataset(monkeypatch, partition_sizes: List[int]) -> FakePartitionedDataset:
+    """Returns a dataset whose partitions have consecutive ids, and which reads each partition through
+    its own dataset, as created by `dataiku.Dataset`
+    """
+    partition_dfs = {}
+    start = 0
+    for (i, size) in enumerate(partition_sizes):
+        partition_dfs[f"p{i}"] = pd.DataFrame({"id": range(start, start + size)})
+        start += size
+    input_dataset = FakePartitionedDataset(partition_dfs)
+    input_dataset.partition_datasets = []
+
+    def get_dataset(name: str, ignore_flow: bool) -> FakePartitionedDataset:
+        partition_dataset = FakePartitionedDataset(partition_dfs)
+        input_dataset.partition_datasets.append(partition_dataset)
+        return partition_dataset
+
+    monkeypatch.setattr(chunked_processing.dataiku, "Dataset", get_dataset)
+    return input_dataset
+
+
+def test_partitions_read_in_parallel_are_regrouped_in_chunks_with_a_running_index(monkeypatch):
+    input_dataset = build_partitioned_dataset(monkeypatch, [13, 0, 25, 7, 5])
+    chunks = []
+
+    def record(df: pd.DataFrame) -> pd.DataFrame:
+        chunks.append(df)
+        return double(df)
+
+    writer = FakeWriter()
+    process_dataset_chunks(
+        input_dataset=input_dataset,
+        output_dataset=FakeDataset(pd.DataFrame(), writer=writer),
+        func=record,
+        chunksize=10,
+        count_input_records=False,
+        parallel_partitions=2,
+        partition_prefetch_depth=1,
+    )
+    # Chunks are the same as if the partitions were read in a single stream
+    assert [len(df.index) for df in chunks] == [10, 10, 10, 10, 10]
+    for (i, df) in enumerate(chunks):
+        assert df.index.tolist() == list(range(10 * i, 10 * (i + 1)))
+        assert df["id"].tolist() == list(range(10 * i, 10 * (i + 1)))
+    assert pd.concat(writer.dfs)["double"].tolist() == [2 * i for i in range(50)]
+    assert len(input_dataset.partition_datasets) == 5
+    assert all(dataset.num_closed_streams == 1 for dataset in input_dataset.partition_datasets)
+
+
+def test_partitions_read_in_parallel_are_closed_on_error(monkeypatch):
+    input_dataset = build_partitioned_dataset(monkeypatch, [30, 30, 30, 30])
+    with pytest.raises(ProcessingError):
+        process_dataset_chunks(
+            input_dataset=input_dataset,
+            output_dataset=FakeDataset(pd.DataFrame(), writer=FakeWriter()),
+            func=fail_on_second_chunk(),
+            chunksize=10,
+            count_input_records=False,
+            parallel_partitions=3,
+        )
+    # Only the partitions read when the error was raised were opened, and they are all closed
+    assert len(input_dataset.partition_datasets) == 3
+    assert all(dataset.num_closed_streams == 1 for dataset in input_dataset.partition_datasets)
@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the adaptive AIMD concurrency controller"""
+
+import pytest
+
+from dkulib.parallelizer import AdaptiveConcurrencyController
+
+
+class OverloadError(Exception):
+    pass
+
+
+def build_controller(**kwargs) -> AdaptiveConcurrencyController:
+    kwargs.setdefault("initial_concurrency", 8)
+    kwargs.setdefault("max_concurrency", 16)
+    return AdaptiveConcurrencyController(overload_exceptions=(OverloadError,), **kwargs)
+
+
+def test_limit_increases_by_about_one_per_round_trip():
+    controller = build_controller(initial_concurrency=4, latency_tolerance=None)
+    for _ in range(4):
+        controller.record(latency=1.0)
+    assert controller.limit == 4
+    controller.record(latency=1.0)
+    assert controller.limit == 5
+
+
+def test_limit_is_bounded():
+    controller = build_controller(initial_concurrency=2, min_concurrency=2, max_concurrency=4)
+    for _ in range(100):
+        controller.record(latency=1.0)
+    assert controller.limit == 4
+    for _ in range(100):
+        controller.record(latency=1.0, error=OverloadError())
+    assert controller.limit == 2
+
+
+def test_overload_error_halves_limit_once_per_burst():
+    controller = build_controller()
+    controller.record(latency=1.0, error=OverloadError())
+    assert controller.limit == 4
+    # The 8 calls in flight when the limit decreased are not taken into account
+    for _ in range(8):
+        controller.record(latency=1.0, error=OverloadError())
+    assert controller.limit == 4
+    controller.record(latency=1.0, error=OverloadError())
+    assert controller.limit == 2
+
+
+def test_other_errors_leave_limit_unchanged():
+    controller = build_controller()
+    for _ in range(10):
+        controller.record(latency=1.0, error=ValueError())
+    assert controller.limit == 8
+
+
+def test_latency_increase_reduces_limit():
+    controller = build_controller(latency_tolerance=2.0)
+    for _ in range(10):
+        controller.record(latency=1.0)
+    limit = controller.limit
+    while controller.limit >= limit:
+        controller.record(latency=10.0)
+    assert controller.limit == limit // 2
+
+
+def test_record_error_only_takes_overload_errors_into_account():
+    controller = build_controller()
+    controller.record_error(ValueError())
+    assert controller.limit == 8
+    controller.record_error(OverloadError())
+    assert controller.limit == 4
+
+
+def test_invalid_bounds_are_rejected():
+    with pytest.raises(ValueError):
+        build_controller(initial_concurrency=20, max_concurrency=16)
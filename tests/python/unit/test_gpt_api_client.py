@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the GPT client, without calling the API"""
+
+import os
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+import openai
+import pandas as pd
+
+from dkulib.parallelizer import DataFrameParallelizer
+from gpt_api_client import API_EXCEPTIONS
+from gpt_api_client import GPTClient
+from gpt_retry_policy import RetryPolicy
+from gpt_tokenizer import PromptTooLongError
+from gpt_tokenizer import load_tokenizer
+
+VOCABULARY_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "..", "resource", "gpt2_bpe")
+TEXTS = ["Where do you went?", "Where " * 100, "Where is you?"]
+
+
+def build_client() -> GPTClient:
+    """Returns a client with a small context window, which completes each prompt with itself"""
+    client = GPTClient(
+        "ada", "fake-api-key", tokenizer=load_tokenizer(VOCABULARY_DIR), context_window=64
+    )
+    client.sent_prompts = []
+
+    def complete(prompts: List[str], temperature: float, max_tokens: int) -> List[str]:
+        client.sent_prompts += prompts
+        return prompts
+
+    client._complete = complete
+    return client
+
+
+def test_generate_batch_rejects_only_prompts_too_long():
+    client = build_client()
+    prompt_template = client.compile_prompt(task="Correct grammar mistakes.")
+    generations = client.generate_batch(texts=TEXTS, max_tokens=16, prompt_template=prompt_template)
+    assert client.sent_prompts == [
+        prompt_template.render(TEXTS[0]),
+        prompt_template.render(TEXTS[2]),
+    ]
+    assert generations[0] == prompt_template.render(TEXTS[0])
+    assert isinstance(generations[1], PromptTooLongError)
+    assert generations[2] == prompt_template.render(TEXTS[2])
+
+
+def test_parallelizer_records_rejected_prompts_per_row():
+    client = build_client()
+    prompt_template = client.compile_prompt(task="Correct grammar mistakes.")
+    parallelizer = DataFrameParallelizer(
+        function=lambda batch: client.generate_batch(
+            texts=[row["text"] for row in batch], max_tokens=16, prompt_template=prompt_template
+        ),
+        exceptions_to_catch=API_EXCEPTIONS,
+        batch_support=True,
+        batch_size=len(TEXTS),
+    )
+    output_df = parallelizer.run(pd.DataFrame({"text": TEXTS}))
+    assert output_df["output_response"].tolist() == [
+        prompt_template.render(TEXTS[0]),
+        "",
+        prompt_template.render(TEXTS[2]),
+    ]
+    assert output_df["output_error_type"].tolist() == ["", "gpt_tokenizer.PromptTooLongError", ""]
+
+
+def test_rate_limiter_cost_counts_prompt_tokens_exactly():
+    client = build_client()
+    prompts = ["Hello world", "Hello, world!"]
+    request = client._build_request(temperature=0.7, max_tokens=16, n=2)
+    assert client._estimate_request_tokens(prompts, request) == (2 + 4) + 2 * 16 * 2
+
+
+def test_on_response_receives_latency_of_successful_requests():
+    latencies = []
+    client = GPTClient(
+        "ada",
+        "fake-api-key",
+        retry_policy=RetryPolicy(max_attempts=2, base_delay=0.0),
+        on_response=latencies.append,
+    )
+    responses = [
+        openai.error.RateLimitError("Rate limit reached", http_status=429),
+        {"choices": [{"text": " Hello", "index": 0}]},
+    ]
+
+    def request(method: str, url: str, params: Dict) -> Tuple:
+        response = responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return (response, False, "fake-api-key")
+
+    client._requestor.request = request
+    assert client.generate(text="Hi")["text"] == " Hello"
+    assert len(latencies) == 1
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the formatting of GPT API responses into output columns"""
+
+import json
+
+import pandas as pd
+
+from gpt_api_formatting import GPTAPIFormatter
+
+
+def build_formatter() -> GPTAPIFormatter:
+    return GPTAPIFormatter(
+        input_df=pd.DataFrame({"text": []}),
+        input_column="text",
+        output_column="generation",
+        column_prefix="gpt",
+    )
+
+
+def test_choice_objects_and_json_strings_are_formatted():
+    choice = {"text": " Corrected", "index": 0, "finish_reason": "stop"}
+    df = pd.DataFrame(
+        {
+            "text": ["a", "b", "c"],
+            "gpt_response": [choice, json.dumps({"text": " Restored"}), ""],
+            "gpt_error_message": ["", "", "Timeout"],
+            "gpt_error_type": ["", "", "API_FAILURE"],
+        }
+    )
+    formatted_df = build_formatter().format_df(df)
+    assert formatted_df["generation"].tolist() == [" Corrected", " Restored", ""]
+    assert formatted_df["gpt_response"].tolist() == [
+        json.dumps(choice),
+        json.dumps({"text": " Restored"}),
+        "",
+    ]
+
+
+def test_input_dataframe_is_left_unchanged():
+    choice = {"text": " Corrected"}
+    df = pd.DataFrame(
+        {"text": ["a"], "gpt_response": [choice], "gpt_error_message": [""], "gpt_error_type": [""]}
+    )
+    build_formatter().format_df(df)
+    assert list(df.columns) == ["text", "gpt_response", "gpt_error_message", "gpt_error_type"]
+    assert df["gpt_response"].iloc[0] is choice
+
+
+def test_empty_dataframe_keeps_all_columns():
+    df = pd.DataFrame(
+        {"text": [], "gpt_response": [], "gpt_error_message": [], "gpt_error_type": []}
+    )
+    formatted_df = build_formatter().format_df(df)
+    assert "generation" in formatted_df.columns
+    assert formatted_df.empty
@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the checkpoint of responses, used to resume interrupted runs"""
+
+from typing import Dict
+
+import pandas as pd
+
+from dkulib.parallelizer import DataFrameParallelizer
+from dkulib.parallelizer.parallelizer import ErrorHandling
+from gpt_checkpoint import GPTCheckpoint
+from gpt_checkpoint import merge_saved_responses
+
+PROMPT_CONFIG = {"task": "Correct grammar mistakes.", "temperature": 0.7}
+
+
+def fail_if_called(row: Dict) -> str:
+    raise AssertionError("The API should not be called for restored rows")
+
+
+def test_restore_by_running_index(tmp_path):
+    checkpoint = GPTCheckpoint(str(tmp_path), PROMPT_CONFIG)
+    checkpoint.save_responses([1000, 1002], ["a", "c"], ["response a", "response c"])
+    checkpoint.close()
+
+    # A new run reads the same chunk, whose rows keep their position in the input dataset
+    checkpoint = GPTCheckpoint(str(tmp_path), PROMPT_CONFIG)
+    assert checkpoint.get_responses([1000, 1001, 1002], ["a", "b", "c"]) == [
+        "response a",
+        None,
+        "response c",
+    ]
+    assert checkpoint.get_responses([0, 1, 2], ["a", "b", "c"]) == [None, None, None]
+    assert checkpoint.num_restored == 2
+    checkpoint.close()
+
+
+def test_changed_text_is_not_restored(tmp_path):
+    checkpoint = GPTCheckpoint(str(tmp_path), PROMPT_CONFIG)
+    checkpoint.save_responses([0, 1], ["a", "b"], ["response a", "response b"])
+    assert checkpoint.get_responses([0, 1], ["a", "b changed"]) == ["response a", None]
+    checkpoint.close()
+
+
+def test_changed_prompt_config_discards_responses(tmp_path):
+    checkpoint = GPTCheckpoint(str(tmp_path), PROMPT_CONFIG)
+    checkpoint.save_responses([0], ["a"], ["response a"])
+    checkpoint.close()
+    checkpoint = GPTCheckpoint(str(tmp_path), {**PROMPT_CONFIG, "temperature": 0.0})
+    assert checkpoint.get_responses([0], ["a"]) == [None]
+    checkpoint.close()
+
+
+def test_clear(tmp_path):
+    checkpoint = GPTCheckpoint(str(tmp_path), PROMPT_CONFIG)
+    checkpoint.save_responses([0, 1], ["a", "b"], ["response a", "response b"])
+    checkpoint.clear()
+    assert checkpoint.get_responses([0, 1], ["a", "b"]) == [None, None]
+    checkpoint.close()
+    checkpoint = GPTCheckpoint(str(tmp_path), PROMPT_CONFIG)
+    assert checkpoint.get_responses([0, 1], ["a", "b"]) == [None, None]
+    checkpoint.close()
+
+
+def test_merge_partially_restored_chunk():
+    df = pd.DataFrame({"text": ["a", "b", "c"]}, index=[1000, 1001, 1002])
+    saved_responses = ["response a", None, "response c"]
+    output_df = df.iloc[[1]].assign(gpt_response="response b", gpt_error_message="")
+    merged_df = merge_saved_responses(df, output_df, saved_responses, "gpt_response")
+    assert merged_df.index.tolist() == [1000, 1001, 1002]
+    assert merged_df["gpt_response"].tolist() == ["response a", "response b", "response c"]
+    assert merged_df["gpt_error_message"].tolist() == ["", "", ""]
+
+
+def test_merge_fully_restored_chunk():
+    df = pd.DataFrame({"text": ["a", "b"]}, index=[1000, 1001])
+    saved_responses = ["response a", "response b"]
+    parallelizer = DataFrameParallelizer(
+        function=fail_if_called,
+        error_handling=ErrorHandling.LOG,
+        exceptions_to_catch=(ValueError,),
+        output_column_prefix="gpt",
+    )
+    # All rows are restored, so the parallelizer runs on an empty chunk
+    output_df = parallelizer.run(df.iloc[[]])
+    assert output_df.empty
+    merged_df = merge_saved_responses(df, output_df, saved_responses, "gpt_response")
+    assert merged_df.index.tolist() == [1000, 1001]
+    assert merged_df["text"].tolist() == ["a", "b"]
+    assert merged_df["gpt_response"].tolist() == ["response a", "response b"]
+    assert merged_df["gpt_error_message"].tolist() == ["", ""]
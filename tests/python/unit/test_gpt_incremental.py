@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the incremental mode, carrying forward the generations of a previous run"""
+
+import pandas as pd
+
+from gpt_checkpoint import compute_hash
+from gpt_incremental import PreviousGenerations
+from gpt_incremental import compute_input_hashes
+
+PROMPT_HASH = compute_hash({"task": "Correct grammar mistakes."})
+
+
+def build_previous_output_df() -> pd.DataFrame:
+    """Returns the output dataset of a previous run, where the last row failed"""
+    texts = ["a", "b", "c"]
+    return pd.DataFrame(
+        {
+            "id": [1, 2, 3],
+            "text": texts,
+            "gpt_input_hash": compute_input_hashes(texts, PROMPT_HASH),
+            "gpt_response": ["response a", "response b", ""],
+            "gpt_error_message": ["", "", "Rate limit reached"],
+        }
+    )
+
+
+def load_previous_generations(key_column: str = None) -> PreviousGenerations:
+    previous_output_df = build_previous_output_df()
+    previous_generations = PreviousGenerations(key_column=key_column)
+    # Chunks of the output dataset, as read by iter_dataframes
+    previous_generations.load(
+        [previous_output_df.iloc[:2], previous_output_df.iloc[2:]],
+        input_hash_column="gpt_input_hash",
+        response_column="gpt_response",
+        error_message_column="gpt_error_message",
+    )
+    return previous_generations
+
+
+def test_input_hash_depends_on_text_and_prompt():
+    (input_hash,) = compute_input_hashes(["a"], PROMPT_HASH)
+    assert compute_input_hashes(["a"], PROMPT_HASH) == [input_hash]
+    assert compute_input_hashes(["b"], PROMPT_HASH) != [input_hash]
+    assert compute_input_hashes(["a"], compute_hash({"task": "Summarize."})) != [input_hash]
+
+
+def test_match_by_hash_carries_forward_unchanged_rows():
+    previous_generations = load_previous_generations()
+    # Rows may move, since they are matched by the hash of their text
+    texts = ["b", "new", "a"]
+    input_hashes = compute_input_hashes(texts, PROMPT_HASH)
+    assert previous_generations.get_responses(input_hashes, input_hashes) == [
+        "response b",
+        None,
+        "response a",
+    ]
+    assert previous_generations.num_reused == 2
+
+
+def test_match_by_key_column_generates_changed_rows_again():
+    previous_generations = load_previous_generations(key_column="id")
+    keys = [1, 2, 4]
+    input_hashes = compute_input_hashes(["a", "b changed", "d"], PROMPT_HASH)
+    assert previous_generations.get_responses(keys, input_hashes) == ["response a", None, None]
+    assert previous_generations.num_reused == 1
+
+
+def test_failed_rows_are_generated_again():
+    for key_column in [None, "id"]:
+        previous_generations = load_previous_generations(key_column)
+        input_hashes = compute_input_hashes(["c"], PROMPT_HASH)
+        keys = [3] if key_column else input_hashes
+        assert previous_generations.get_responses(keys, input_hashes) == [None]
+        assert previous_generations.num_reused == 0
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the client-side rate limiter, on a fake clock"""
+
+import threading
+
+import gpt_rate_limiter
+from gpt_rate_limiter import RateLimiter
+
+
+class FakeClock:
+    """Clock which only moves forward when told to"""
+
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+def test_request_budget_is_refilled_over_time():
+    clock = FakeClock()
+    rate_limiter = RateLimiter(requests_per_minute=60, clock=clock)
+    assert [rate_limiter.reserve(num_tokens=1) for _ in range(60)] == [0.0] * 60
+    # One request per second is refilled, and later requests queue up behind the previous ones
+    assert rate_limiter.reserve(num_tokens=1) == 1.0
+    assert rate_limiter.reserve(num_tokens=1) == 2.0
+    clock.advance(3.0)
+    assert rate_limiter.reserve(num_tokens=1) == 0.0
+
+
+def test_token_debt_is_carried_over():
+    clock = FakeClock()
+    rate_limiter = RateLimiter(tokens_per_minute=600, clock=clock)
+    assert rate_limiter.reserve(num_tokens=500) == 0.0
+    # 200 tokens of debt, refilled at 10 tokens per second
+    assert rate_limiter.reserve(num_tokens=300) == 20.0
+    clock.advance(10.0)
+    assert rate_limiter.reserve(num_tokens=50) == 15.0
+    assert rate_limiter.total_wait_seconds == 35.0
+
+
+def test_request_larger_than_budget_is_capped():
+    clock = FakeClock()
+    rate_limiter = RateLimiter(tokens_per_minute=600, clock=clock)
+    assert rate_limiter.reserve(num_tokens=1000) == 0.0
+    assert rate_limiter.reserve(num_tokens=1000) == 60.0
+
+
+def test_concurrent_requests_wait_in_turn(monkeypatch):
+    clock = FakeClock()
+    rate_limiter = RateLimiter(requests_per_minute=60, tokens_per_minute=6000, clock=clock)
+    for _ in range(60):
+        rate_limiter.acquire(num_tokens=10)
+    waits = []
+    lock = threading.Lock()
+
+    def fake_sleep(seconds: float) -> None:
+        with lock:
+            waits.append(seconds)
+
+    monkeypatch.setattr(gpt_rate_limiter, "sleep", fake_sleep)
+    start = threading.Barrier(10)
+
+    def acquire() -> None:
+        start.wait()
+        rate_limiter.acquire(num_tokens=10)
+
+    threads = [threading.Thread(target=acquire) for _ in range(10)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    # Each thread is granted its own slot, one second after the previous one
+    assert sorted(waits) == [float(i) for i in range(1, 11)]
+    assert rate_limiter.total_wait_seconds == sum(range(1, 11))
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the two-tier cache of API responses"""
+
+import os
+import sqlite3
+
+import pytest
+
+import gpt_response_cache
+from gpt_response_cache import CACHE_FILE_NAME
+from gpt_response_cache import DISK_COMMIT_INTERVAL
+from gpt_response_cache import DISK_EVICTION_INTERVAL
+from gpt_response_cache import GPTResponseCache
+
+
+class FakeClock:
+    """Clock which only moves forward when told to"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float) -> None:
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch) -> FakeClock:
+    clock = FakeClock()
+    monkeypatch.setattr(gpt_response_cache, "time", clock)
+    return clock
+
+
+def count_committed_entries(cache_dir: str) -> int:
+    """Returns the number of entries of the persistent tier, as seen by another connection"""
+    connection = sqlite3.connect(os.path.join(cache_dir, CACHE_FILE_NAME))
+    try:
+        return connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_least_recently_used_entry_is_evicted_from_memory():
+    cache = GPTResponseCache(max_memory_entries=2)
+    cache.set("a", "response a")
+    cache.set("b", "response b")
+    assert cache.get("a") == "response a"
+    cache.set("c", "response c")
+    assert cache.get("b") is None
+    assert cache.get("a") == "response a"
+    assert cache.get("c") == "response c"
+    assert (cache.hits, cache.misses) == (3, 1)
+
+
+def test_responses_are_persisted_across_caches(tmp_path):
+    cache = GPTResponseCache(cache_dir=str(tmp_path))
+    cache.set("a", "response a")
+    cache.close()
+
+    cache = GPTResponseCache(cache_dir=str(tmp_path))
+    assert cache.get("a") == "response a"
+    assert cache.get("b") is None
+    cache.close()
+    # Without a cache directory, responses only live in memory
+    assert GPTResponseCache().get("a") is None
+
+
+def test_expired_entries_are_not_returned(tmp_path, clock):
+    cache = GPTResponseCache(cache_dir=str(tmp_path), ttl_seconds=60)
+    cache.set("a", "response a")
+    clock.advance(30)
+    cache.set("b", "response b")
+    clock.advance(40)
+    assert cache.get("a") is None
+    assert cache.get("b") == "response b"
+    cache.close()
+    # Expired entries are evicted from the persistent tier as well
+    assert count_committed_entries(str(tmp_path)) == 1
+    cache = GPTResponseCache(cache_dir=str(tmp_path), ttl_seconds=60)
+    clock.advance(40)
+    assert cache.get("b") is None
+    cache.close()
+
+
+def test_least_recently_used_entries_are_evicted_from_disk_periodically(tmp_path, clock):
+    cache = GPTResponseCache(max_memory_entries=1, cache_dir=str(tmp_path), max_disk_entries=10)
+    for i in range(DISK_EVICTION_INTERVAL - 1):
+        cache.set(str(i), f"response {i}")
+        clock.advance(1)
+    # Reading the oldest entry from disk makes it recently used
+    assert cache.get("0") == "response 0"
+    assert count_committed_entries(str(tmp_path)) > 10
+    cache.set("last", "last response")
+    assert count_committed_entries(str(tmp_path)) == 10
+    assert cache.get("0") == "response 0"
+    assert cache.get("1") is None
+    cache.close()
+
+
+def test_disk_changes_are_committed_in_batches(tmp_path):
+    cache = GPTResponseCache(cache_dir=str(tmp_path))
+    for i in range(DISK_COMMIT_INTERVAL - 1):
+        cache.set(str(i), f"response {i}")
+    assert count_committed_entries(str(tmp_path)) == 0
+    cache.set("last", "last response")
+    assert count_committed_entries(str(tmp_path)) == DISK_COMMIT_INTERVAL
+    cache.set("after", "response after")
+    cache.close()
+    assert count_committed_entries(str(tmp_path)) == DISK_COMMIT_INTERVAL + 1
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the retry policy of API requests"""
+
+from email.utils import format_datetime
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+
+import openai
+import pytest
+import requests
+from requests.structures import CaseInsensitiveDict
+
+import gpt_retry_policy
+from dkulib.parallelizer import AdaptiveConcurrencyController
+from gpt_api_client import OVERLOAD_EXCEPTIONS
+from gpt_retry_policy import MAX_RETRY_AFTER_SECONDS
+from gpt_retry_policy import RetryPolicy
+
+
+def build_error(http_status: int, retry_after: str = None) -> openai.error.OpenAIError:
+    headers = CaseInsensitiveDict({"Retry-After": retry_after} if retry_after else {})
+    return openai.error.OpenAIError("API error", http_status=http_status, headers=headers)
+
+
+def build_http_error(status_code: int) -> requests.HTTPError:
+    response = requests.Response()
+    response.status_code = status_code
+    return requests.HTTPError("HTTP error", response=response)
+
+
+@pytest.mark.parametrize("http_status", [409, 429, 500, 502, 503])
+def test_transient_errors_are_retried(http_status):
+    assert RetryPolicy.is_retriable(build_error(http_status))
+    assert RetryPolicy.is_retriable(build_http_error(http_status))
+
+
+@pytest.mark.parametrize("http_status", [400, 401, 403, 404, 422])
+def test_client_errors_are_not_retried(http_status):
+    assert not RetryPolicy.is_retriable(build_error(http_status))
+    assert not RetryPolicy.is_retriable(build_http_error(http_status))
+
+
+def test_connection_errors_are_retried():
+    assert RetryPolicy.is_retriable(openai.error.APIConnectionError("Connection reset"))
+    assert not RetryPolicy.is_retriable(openai.error.InvalidRequestError("Invalid", param=None))
+    assert not RetryPolicy.is_retriable(ValueError("Not an API error"))
+
+
+def test_delay_has_full_jitter_within_exponential_bound(monkeypatch):
+    retry_policy = RetryPolicy(base_delay=1.0, max_delay=60.0)
+    error = build_error(429)
+    for attempt in range(1, 10):
+        bound = min(60.0, 2.0 ** (attempt - 1))
+        delays = [retry_policy.get_delay(attempt, error) for _ in range(100)]
+        assert all(0 <= delay <= bound for delay in delays)
+        assert min(delays) < bound / 2 < max(delays)
+    monkeypatch.setattr(gpt_retry_policy.random, "uniform", lambda low, high: high)
+    assert retry_policy.get_delay(3, error) == 4.0
+    assert retry_policy.get_delay(10, error) == 60.0
+
+
+def test_delay_honors_retry_after():
+    retry_policy = RetryPolicy(base_delay=0.0)
+    assert retry_policy.get_delay(1, build_error(429, retry_after="5")) == 5.0
+    retry_date = format_datetime(datetime.now(timezone.utc) + timedelta(seconds=30), usegmt=True)
+    assert 25 <= retry_policy.get_delay(1, build_error(503, retry_after=retry_date)) <= 30
+    assert (
+        retry_policy.get_delay(1, build_error(429, retry_after="3600")) == MAX_RETRY_AFTER_SECONDS
+    )
+    assert retry_policy.get_delay(1, build_error(429, retry_after="soon")) == 0.0
+
+
+def test_exhausted_attempts_raise_original_error(monkeypatch):
+    delays = []
+    monkeypatch.setattr(gpt_retry_policy, "sleep", delays.append)
+    retry_policy = RetryPolicy(max_attempts=3, base_delay=1.0)
+    errors = [build_error(500), build_error(502), build_error(503)]
+    attempts = iter(errors)
+
+    def request() -> str:
+        raise next(attempts)
+
+    with pytest.raises(openai.error.OpenAIError) as raised:
+        retry_policy.call(request)
+    assert raised.value is errors[-1]
+    assert len(delays) == 2
+
+
+def test_fatal_error_is_raised_right_away(monkeypatch):
+    delays = []
+    monkeypatch.setattr(gpt_retry_policy, "sleep", delays.append)
+    error = build_error(401)
+
+    def request() -> str:
+        raise error
+
+    with pytest.raises(openai.error.OpenAIError) as raised:
+        RetryPolicy(max_attempts=3).call(request)
+    assert raised.value is error
+    assert delays == []
+
+
+def test_retried_overload_error_reduces_concurrency():
+    controller = AdaptiveConcurrencyController(
+        initial_concurrency=8, max_concurrency=16, overload_exceptions=OVERLOAD_EXCEPTIONS
+    )
+    retry_policy = RetryPolicy(max_attempts=3, base_delay=0.0, on_retry=controller.record_error)
+    attempts = []
+
+    def request() -> str:
+        attempts.append(len(attempts))
+        if len(attempts) == 1:
+            raise openai.error.RateLimitError("Rate limit reached", http_status=429)
+        return "completion"
+
+    assert retry_policy.call(request) == "completion"
+    assert len(attempts) == 2
+    assert controller.limit == 4
@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the offline GPT tokenizer and of prompt templates within a token budget"""
+
+import os
+
+import pytest
+
+from gpt_prompt_template import PromptTemplate
+from gpt_tokenizer import PromptTooLongError
+from gpt_tokenizer import load_tokenizer
+
+VOCABULARY_DIR = os.path.join(os.path.dirname(__file__), "..", "..", "..", "resource", "gpt2_bpe")
+TEXT = "Where do you went yesterday with all your friends from school?"
+
+
+@pytest.fixture(scope="module")
+def tokenizer():
+    return load_tokenizer(VOCABULARY_DIR)
+
+
+@pytest.fixture
+def prompt_template(tokenizer) -> PromptTemplate:
+    return PromptTemplate(
+        task="Correct grammar mistakes.",
+        input_desc="Original",
+        output_desc="Standard American English",
+        examples=[("Where do you went?", "Where did you go?")],
+        tokenizer=tokenizer,
+    )
+
+
+@pytest.mark.parametrize(
+    "text,expected_tokens",
+    [
+        ("Hello world", [15496, 995]),
+        ("Hello, world!", [15496, 11, 995, 0]),
+        ("The quick brown fox", [464, 2068, 7586, 21831]),
+    ],
+)
+def test_encode_matches_gpt2_tokens(tokenizer, text, expected_tokens):
+    assert tokenizer.encode(text) == expected_tokens
+    assert tokenizer.count_tokens(text) == len(expected_tokens)
+
+
+@pytest.mark.parametrize("text", ["Hello world", "héllo wörld 😀", "  multiple   spaces\n"])
+def test_decode_inverts_encode(tokenizer, text):
+    assert tokenizer.decode(tokenizer.encode(text)) == text
+
+
+def test_count_prompt_tokens_matches_rendered_prompt(tokenizer, prompt_template):
+    assert prompt_template.count_prompt_tokens(TEXT) == tokenizer.count_tokens(
+        prompt_template.render(TEXT)
+    )
+    assert prompt_template.count_prompt_tokens() == tokenizer.count_tokens(prompt_template.render())
+
+
+def test_render_within_budget_keeps_prompt_which_fits(prompt_template):
+    max_prompt_tokens = prompt_template.count_prompt_tokens(TEXT)
+    prompt = prompt_template.render_within_budget(TEXT, max_prompt_tokens)
+    assert prompt == prompt_template.render(TEXT)
+
+
+def test_render_within_budget_rejects_prompt_too_long(prompt_template):
+    max_prompt_tokens = prompt_template.count_prompt_tokens(TEXT) - 1
+    with pytest.raises(PromptTooLongError):
+        prompt_template.render_within_budget(TEXT, max_prompt_tokens, truncate=False)
+
+
+def test_render_within_budget_truncates_end_of_text(tokenizer, prompt_template):
+    max_prompt_tokens = prompt_template.count_prompt_tokens(TEXT) - 5
+    prompt = prompt_template.render_within_budget(TEXT, max_prompt_tokens, truncate=True)
+    assert tokenizer.count_tokens(prompt) <= max_prompt_tokens
+    text_start = len(prompt_template.prefix + prompt_template.input_label)
+    truncated_text = prompt[text_start : prompt.rindex("\n")]
+    assert truncated_text
+    assert TEXT.startswith(truncated_text)
+    assert prompt == prompt_template.render(truncated_text)
+
+
+def test_render_within_budget_drops_incomplete_characters(prompt_template):
+    # Each emoji is made of several tokens, so truncation may cut one in the middle
+    text = "😀" * 20
+    max_prompt_tokens = prompt_template.count_prompt_tokens(text) - 4
+    prompt = prompt_template.render_within_budget(text, max_prompt_tokens, truncate=True)
+    assert "�" not in prompt
+    assert "😀" in prompt
+
+
+def test_render_within_budget_rejects_budget_below_template(prompt_template):
+    with pytest.raises(PromptTooLongError):
+        prompt_template.render_within_budget(
+            TEXT, prompt_template.num_template_tokens, truncate=True
+        )
@@ -0,0 +1,367 @@
+# -*- coding: utf-8 -*-
+"""Unit tests of the DataFrameParallelizer"""
+
+import asyncio
+import os
+import threading
+import time
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dkulib.parallelizer import AdaptiveConcurrencyController
+from dkulib.parallelizer import DataFrameParallelizer
+from dkulib.parallelizer.parallelizer import BatchError
+from dkulib.parallelizer.parallelizer import ErrorHandling
+from dkulib.parallelizer.parallelizer import ExecutorType
+
+
+def count_max_pending_rows(max_inflight_batches_per_worker: Optional[int]) -> int:
+    """Returns the maximum number of rows read from the dataframe before their call completed"""
+    counts = {"generated": 0, "completed": 0, "max_pending": 0}
+    lock = threading.Lock()
+
+    def function(row: Dict) -> str:
+        time.sleep(0.001)
+        with lock:
+            counts["completed"] += 1
+        return "done"
+
+    parallelizer = DataFrameParallelizer(
+        function=function,
+        error_handling=ErrorHandling.FAIL,
+        parallel_workers=2,
+        max_inflight_batches_per_worker=max_inflight_batches_per_worker,
+    )
+    generate_rows = parallelizer._generate_rows
+
+    def generate_counted_rows(df: pd.DataFrame) -> Iterator[Dict]:
+        for row in generate_rows(df):
+            with lock:
+                counts["generated"] += 1
+                pending = counts["generated"] - counts["completed"]
+                counts["max_pending"] = max(counts["max_pending"], pending)
+            yield row
+
+    parallelizer._generate_rows = generate_counted_rows
+    output_df = parallelizer.run(pd.DataFrame({"id": range(200)}))
+    assert output_df["output_response"].tolist() == ["done"] * 200
+    return counts["max_pending"]
+
+
+def test_inflight_batches_are_bounded():
+    # Up to 2 batches per worker are in flight, and the next row is read before waiting on them
+    assert count_max_pending_rows(max_inflight_batches_per_worker=2) <= 2 * 2 + 1
+    # Without a bound, all rows are read upfront
+    assert count_max_pending_rows(max_inflight_batches_per_worker=None) > 2 * 2 + 1
+
+
+def sleep_and_record(row: Dict) -> str:
+    """Waits a bit and returns the process id, start and end time of the call"""
+    start = time.time()
+    time.sleep(0.1)
+    return f"{os.getpid()} {start} {time.time()}"
+
+
+def get_max_overlapping_calls(calls: List[Tuple[float, float]]) -> int:
+    """Returns the maximum number of calls running at the same time"""
+    events = sorted([(start, 1) for (start, _) in calls] + [(end, -1) for (_, end) in calls])
+    (num_running, max_running) = (0, 0)
+    for (_, change) in events:
+        num_running += change
+        max_running = max(max_running, num_running)
+    return max_running
+
+
+def test_process_pool_runs_workers_concurrently():
+    parallel_workers = 4
+    input_df = pd.DataFrame({"id": range(40)})
+    parallelizer = DataFrameParallelizer(
+        function=sleep_and_record,
+        error_handling=ErrorHandling.FAIL,
+        parallel_workers=parallel_workers,
+        max_inflight_batches_per_worker=1,
+        executor_type=ExecutorType.PROCESS,
+    )
+    output_df = parallelizer.run(input_df)
+    calls = [response.split() for response in output_df["output_response"]]
+    assert len({process_id for (process_id, _, _) in calls}) == parallel_workers
+    calls = [(float(start), float(end)) for (_, start, end) in calls]
+    assert get_max_overlapping_calls(calls) == parallel_workers
+
+
+def return_choice(row: Dict) -> Dict:
+    return {"text": f" Generation for {row['id']}", "index": 0}
+
+
+def test_responses_are_cast_to_strings_unless_kept_raw():
+    input_df = pd.DataFrame({"id": range(3)})
+    output_df = DataFrameParallelizer(
+        function=return_choice, error_handling=ErrorHandling.FAIL
+    ).run(input_df)
+    assert output_df["output_response"].tolist() == [
+        str(return_choice({"id": i})) for i in range(3)
+    ]
+    output_df = DataFrameParallelizer(
+        function=return_choice, error_handling=ErrorHandling.FAIL, keep_raw_responses=True
+    ).run(input_df)
+    assert output_df["output_response"].tolist() == [return_choice({"id": i}) for i in range(3)]
+
+
+def test_deduplicated_results_are_fanned_out_to_duplicate_rows():
+    texts = ["a", np.nan, "b", "a", np.nan, "a"]
+    calls = []
+
+    def generate(row: Dict) -> str:
+        calls.append(row["text"])
+        return f"generation of {row['text']}"
+
+    parallelizer = DataFrameParallelizer(
+        function=generate,
+        error_handling=ErrorHandling.FAIL,
+        parallel_workers=1,
+        deduplicate_columns=["text"],
+    )
+    output_df = parallelizer.run(pd.DataFrame({"id": range(len(texts)), "text": texts}))
+    # Missing values are grouped together, like any other value
+    assert [text if isinstance(text, str) else None for text in calls] == ["a", None, "b"]
+    assert output_df["id"].tolist() == list(range(len(texts)))
+    assert output_df["output_response"].tolist() == [f"generation of {text}" for text in texts]
+
+
+def test_batch_responses_are_aligned_with_rows():
+    batches = []
+
+    def generate_batch(batch: List[Dict]) -> List[str]:
+        batches.append([row["id"] for row in batch])
+        return [f"generation of {row['id']}" for row in batch]
+
+    parallelizer = DataFrameParallelizer(
+        function=generate_batch,
+        error_handling=ErrorHandling.FAIL,
+        parallel_workers=1,
+        batch_support=True,
+        batch_size=3,
+    )
+    output_df = parallelizer.run(pd.DataFrame({"id": range(7)}))
+    assert batches == [[0, 1, 2], [3, 4, 5], [6]]
+    assert output_df["output_response"].tolist() == [f"generation of {i}" for i in range(7)]
+
+
+def test_batches_are_packed_by_cost():
+    batches = []
+
+    def generate_batch(batch: List[Dict]) -> List[str]:
+        batches.append([row["cost"] for row in batch])
+        return [f"generation of {row['id']}" for row in batch]
+
+    costs = [3, 4, 2, 12, 1, 1, 1, 1, 5]
+    parallelizer = DataFrameParallelizer(
+        function=generate_batch,
+        error_handling=ErrorHandling.FAIL,
+        parallel_workers=1,
+        batch_support=True,
+        batch_size=3,
+        row_cost_function=lambda row: row["cost"],
+        max_batch_cost=10,
+    )
+    output_df = parallelizer.run(pd.DataFrame({"id": range(len(costs)), "cost": costs}))
+    # A row costlier than the maximum is sent alone, and batches never exceed batch_size rows
+    assert batches == [[3, 4, 2], [12], [1, 1, 1], [1, 5]]
+    assert output_df["id"].tolist() == list(range(len(costs)))
+    assert output_df["output_response"].tolist() == [
+        f"generation of {i}" for i in range(len(costs))
+    ]
+
+
+def test_row_cost_function_requires_max_batch_cost():
+    with pytest.raises(ValueError):
+        DataFrameParallelizer(
+            function=return_choice,
+            error_handling=ErrorHandling.FAIL,
+            batch_support=True,
+            row_cost_function=lambda row: 1,
+        )
+
+
+def generate_batch_failing_on_odd_ids(batch: List[Dict]) -> List:
+    return [
+        ValueError(f"Failed on {row['id']}") if row["id"] % 2 else f"generation of {row['id']}"
+        for row in batch
+    ]
+
+
+def test_row_errors_of_a_batch_are_logged_in_their_rows():
+    parallelizer = DataFrameParallelizer(
+        function=generate_batch_failing_on_odd_ids,
+        error_handling=ErrorHandling.LOG,
+        exceptions_to_catch=(ValueError,),
+        parallel_workers=1,
+        batch_support=True,
+        batch_size=4,
+    )
+    output_df = parallelizer.run(pd.DataFrame({"id": range(4)}))
+    assert output_df["output_response"].tolist() == ["generation of 0", "", "generation of 2", ""]
+    assert output_df["output_error_message"].tolist() == ["", "Failed on 1", "", "Failed on 3"]
+    assert output_df["output_error_type"].tolist() == ["", "ValueError", "", "ValueError"]
+
+
+def test_row_errors_of_a_batch_fail_the_run():
+    parallelizer = DataFrameParallelizer(
+        function=generate_batch_failing_on_odd_ids,
+        error_handling=ErrorHandling.FAIL,
+        parallel_workers=1,
+        batch_support=True,
+        batch_size=4,
+    )
+    with pytest.raises(BatchError, match="Failed on 1"):
+        parallelizer.run(pd.DataFrame({"id": range(4)}))
+
+
+class RecordingController(AdaptiveConcurrencyController):
+    """Concurrency controller keeping the errors it was fed, None for successful calls"""
+
+    def __init__(self):
+        super().__init__(
+            initial_concurrency=2, max_concurrency=4, overload_exceptions=(ValueError,)
+        )
+        self.recorded_errors = []
+
+    def record(self, latency: float, error: Optional[Exception] = None) -> None:
+        self.recorded_errors.append(error)
+        super().record(latency, error)
+
+
+def fail_on_odd_ids(row: Dict) -> str:
+    if row["id"] % 2:
+        raise ValueError("Overloaded")
+    return "done"
+
+
+def test_latency_feedback_may_be_left_to_the_function():
+    for latency_feedback in [True, False]:
+        controller = RecordingController()
+        DataFrameParallelizer(
+            function=fail_on_odd_ids,
+            exceptions_to_catch=(ValueError,),
+            concurrency_controller=controller,
+            latency_feedback=latency_feedback,
+        ).run(pd.DataFrame({"id": range(10)}))
+        num_errors = sum(error is not None for error in controller.recorded_errors)
+        assert num_errors == 5
+        assert len(controller.recorded_errors) == (10 if latency_feedback else 5)
+
+
+class CountingAsyncContext:
+    """Asynchronous context counting how many times it is entered and exited"""
+
+    def __init__(self):
+        (self.num_entered, self.num_exited) = (0, 0)
+
+    def __call__(self) -> "CountingAsyncContext":
+        return self
+
+    async def __aenter__(self) -> None:
+        self.num_entered += 1
+
+    async def __aexit__(self, *exc_info) -> None:
+        self.num_exited += 1
+
+
+async def generate_async(row: Dict) -> str:
+    return f"generation of {row['id']}"
+
+
+def test_shared_event_loop_enters_async_context_once():
+    input_df = pd.DataFrame({"id": range(5)})
+    async_context = CountingAsyncContext()
+    parallelizer = DataFrameParallelizer(
+        function=generate_async,
+        error_handling=ErrorHandling.FAIL,
+        executor_type=ExecutorType.ASYNCIO,
+        async_context=async_context,
+    )
+    for _ in range(2):
+        parallelizer.run(input_df)
+    assert (async_context.num_entered, async_context.num_exited) == (2, 2)
+    with parallelizer.shared_event_loop():
+        for _ in range(3):
+            output_df = parallelizer.run(input_df)
+            assert output_df["output_response"].tolist() == [f"generation of {i}" for i in range(5)]
+    assert (async_context.num_entered, async_context.num_exited) == (3, 3)
+
+
+def test_rows_keep_the_values_and_types_of_all_columns():
+    input_df = pd.DataFrame({"id": [1, 2], "score": [0.5, 1.5], "text": ["a", "b"]})
+    parallelizer = DataFrameParallelizer(function=return_choice, error_handling=ErrorHandling.FAIL)
+    rows = list(parallelizer._generate_rows(input_df))
+    assert rows == [{"id": 1, "score": 0.5, "text": "a"}, {"id": 2, "score": 1.5, "text": "b"}]
+    # Unlike rows of df.iterrows, integers are not cast to floats by the other columns
+    assert all(isinstance(row["id"], int) for row in rows)
+
+
+def test_function_reads_input_columns_and_returns_output_columns():
+    rows = []
+
+    def generate(row: Dict) -> str:
+        rows.append(row)
+        return f"generation of {row['text']}"
+
+    input_df = pd.DataFrame(
+        {"id": [3, 1, 2], "text": ["a", "b", "c"], "other": [None, 1.0, "x"]}, index=[10, 20, 30]
+    )
+    parallelizer = DataFrameParallelizer(
+        function=generate,
+        exceptions_to_catch=(ValueError,),
+        parallel_workers=1,
+        input_columns=["text"],
+    )
+    output_df = parallelizer.run(input_df)
+    assert rows == [{"text": "a"}, {"text": "b"}, {"text": "c"}]
+    # Output columns are joined to the input columns by index, which are left as is
+    assert output_df.index.tolist() == [10, 20, 30]
+    pd.testing.assert_frame_equal(output_df[input_df.columns], input_df)
+    assert output_df.columns.tolist() == [
+        "id",
+        "text",
+        "other",
+        "output_response",
+        "output_error_message",
+        "output_error_type",
+    ]
+    assert output_df["output_response"].tolist() == [f"generation of {text}" for text in "abc"]
+
+
+def generate_later_rows_first(row: Dict) -> str:
+    time.sleep(0.01 * (8 - row["id"]))
+    return f"generation of {row['id']}"
+
+
+async def generate_later_rows_first_async(row: Dict) -> str:
+    await asyncio.sleep(0.01 * (8 - row["id"]))
+    return f"generation of {row['id']}"
+
+
+@pytest.mark.parametrize(
+    "function,executor_type",
+    [
+        (generate_later_rows_first, ExecutorType.THREAD),
+        (generate_later_rows_first_async, ExecutorType.ASYNCIO),
+    ],
+)
+def test_results_keep_input_order_when_calls_complete_out_of_order(function, executor_type):
+    input_df = pd.DataFrame({"id": range(8)}, index=[7, 3, 5, 1, 0, 2, 6, 4])
+    output_df = DataFrameParallelizer(
+        function=function,
+        error_handling=ErrorHandling.FAIL,
+        parallel_workers=8,
+        executor_type=executor_type,
+    ).run(input_df)
+    assert output_df.index.tolist() == [7, 3, 5, 1, 0, 2, 6, 4]
+    assert output_df["output_response"].tolist() == [f"generation of {i}" for i in range(8)]